@@ -0,0 +1,89 @@
+"""
+Réductions pures des analyses (mois, revenus/dépenses, agrégats mensuels), sans Streamlit ni base :
+app.py les importe, et les tests les vérifient directement.
+"""
+import pandas as pd
+
+nomS_mois = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin", "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"]
+
+
+# --- CALCULS PAR MOIS (VECTORISÉS) ---
+# Les mois sont comparés et triés via un type catégoriel ordonné (Janvier < ... < Décembre)
+# plutôt qu'avec nomS_mois.index() appelé ligne par ligne.
+MOIS_ORDONNES = pd.CategoricalDtype(nomS_mois, ordered=True)
+
+
+def en_mois_ordonnes(mois):
+    """Series de mois au type MOIS_ORDONNES ; une valeur hors calendrier devient NaN (pas d'erreur de conversion)."""
+    mois = pd.Series(mois).astype(object)
+    return mois.where(mois.isin(nomS_mois)).astype(MOIS_ORDONNES)
+
+
+def rang_mois(mois):
+    """Position 0..11 de chaque mois (Series), -1 pour une valeur qui n'est pas un mois connu."""
+    return en_mois_ordonnes(mois).cat.codes
+
+
+def noms_mois_depuis_numeros(numeros):
+    """1..12 -> nom du mois ; toute autre valeur donne NaN."""
+    numeros = pd.to_numeric(numeros, errors='coerce')
+    return numeros.where(numeros.between(1, 12)).map(dict(enumerate(nomS_mois, start=1)))
+
+
+def trier_mois(mois):
+    """Mois distincts dans l'ordre du calendrier (les valeurs inconnues restent en tête, comme avant)."""
+    distincts = pd.Series(pd.unique(pd.Series(mois).dropna()))
+    return distincts.iloc[rang_mois(distincts).argsort(kind='stable').values].tolist()
+
+
+def revenus_depenses_par_mois(df, col_revenus='Revenus', col_depenses='Dépenses'):
+    """
+    Par mois : somme des montants positifs et valeur absolue de la somme des négatifs.
+    clip() + un seul groupby, les 12 mois sont toujours présents et dans l'ordre.
+    """
+    montants = pd.to_numeric(df['montant'], errors='coerce').fillna(0.0)
+    par_mois = pd.DataFrame({
+        col_revenus: montants.clip(lower=0),
+        col_depenses: -montants.clip(upper=0),
+    }).groupby(en_mois_ordonnes(df['mois']).values, observed=False).sum()
+    par_mois.index = par_mois.index.astype(str)
+    return par_mois.rename_axis('mois').reset_index()
+
+
+# --- AGRÉGATS MENSUELS ---
+# Même forme que la table agregats_mensuels : compte, annee, mois, categorie, sens, total, nb.
+COLONNES_AGREGATS = ['compte', 'annee', 'mois', 'categorie', 'sens', 'total', 'nb']
+
+
+def agregats_mensuels_depuis_df(df):
+    """Les mêmes totaux, calculés en mémoire à partir d'un DataFrame de transactions."""
+    if df.empty:
+        return pd.DataFrame(columns=COLONNES_AGREGATS)
+    montants = pd.to_numeric(df['montant'], errors='coerce').fillna(0.0)
+    col_annee = 'année' if 'année' in df.columns else 'annee'
+    annees = pd.to_numeric(df[col_annee], errors='coerce') if col_annee in df.columns else pd.Series(float('nan'), index=df.index)
+    annees = annees.fillna(pd.to_datetime(df['date'], errors='coerce').dt.year).fillna(0).astype(int)
+    cles = pd.DataFrame({
+        'compte': df['compte'].astype(object).fillna('').astype(str),
+        'annee': annees,
+        'mois': df['mois'].astype(object).fillna('').astype(str),
+        'categorie': df['categorie'].astype(object).fillna('').astype(str),
+        'sens': montants.ge(0).map({True: 'credit', False: 'debit'}),
+        'total': montants,
+    })
+    return (
+        cles.groupby(['compte', 'annee', 'mois', 'categorie', 'sens'], sort=False)['total']
+        .agg(total='sum', nb='count')
+        .reset_index()
+    )
+
+
+def flux_mensuels(agregats, categories_exclues=()):
+    """Revenus et Dépenses (en positif) par mois présent, dans l'ordre du calendrier, hors catégories exclues (virements internes)."""
+    flux = agregats[~agregats['categorie'].isin(list(categories_exclues))]
+    par_sens = flux.pivot_table(index='mois', columns='sens', values='total', aggfunc='sum').fillna(0.0)
+    resultat = pd.DataFrame({
+        'Revenus': par_sens['credit'] if 'credit' in par_sens.columns else 0.0,
+        'Dépenses': -par_sens['debit'] if 'debit' in par_sens.columns else 0.0,
+    }, index=par_sens.index).rename_axis('mois').reset_index()
+    return resultat.sort_values('mois', key=rang_mois, kind='stable', ignore_index=True)
@@ -4,15 +4,26 @@ import io
 import plotly.express as px
 import re
 import time
+import hashlib
+import json
+import logging
+from contextlib import contextmanager
+from collections import Counter, defaultdict, deque
+from functools import lru_cache, wraps
 import plotly.graph_objects as go
 from streamlit_option_menu import option_menu
 from streamlit_gsheets import GSheetsConnection
 import streamlit_authenticator as stauth
-from difflib import get_close_matches
+from difflib import get_close_matches, SequenceMatcher
 from datetime import datetime
 from datetime import date
 from fpdf import FPDF
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from migrations import migrations_manquantes
+from analyses import (
+    nomS_mois, rang_mois, noms_mois_depuis_numeros, trier_mois,
+    revenus_depenses_par_mois, agregats_mensuels_depuis_df, flux_mensuels,
+)
 
 def refresh_sidebar():
             # Cette fonction ne fait rien, mais son appel via 'on_change'
@@ -26,14 +37,363 @@ st.set_page_config(page_title="Mes Budgets",page_icon="💰", layout="wide",init
 if "user" not in st.session_state:
     st.session_state["user"] = None
 
+
+# --- PROFILAGE DES RERUNS (OPT-IN) ---
+# Activé par ?profil=1 dans l'URL, puis pour toute la session. Chaque rerun produit une trace :
+# des sections {nom, debut_ms, duree_ms, profondeur} (chargeurs, calculs, onglet, requêtes SQL),
+# affichée dans la sidebar et téléchargeable en JSON. Désactivé, mesurer() et profile() ne coûtent qu'un test.
+# Un fragment relancé seul a sa propre trace (profile_fragment) ; un rerun arrêté en route garde la sienne.
+NB_TRACES_CONSERVEES = 20
+
+
+def profilage_actif():
+    try:
+        return bool(st.session_state.get("profilage"))
+    except Exception:
+        # Hors d'un rerun (thread sans contexte Streamlit) : rien à mesurer
+        return False
+
+
+def ouvrir_trace(portee):
+    st.session_state.trace_rerun = {
+        "horodatage": datetime.now().isoformat(timespec="seconds"),
+        "portee": portee,
+        "debut": time.perf_counter(),
+        "sections": [],
+        "pile": [],
+    }
+
+
+def demarrer_profil_rerun():
+    """À appeler en tête de script : ouvre une trace vide pour ce rerun."""
+    if st.query_params.get("profil") == "1":
+        st.session_state.profilage = True
+    if profilage_actif():
+        if st.session_state.get("trace_rerun") is not None:
+            # Le rerun précédent n'est pas arrivé en fin de script (st.rerun, exception) : sa trace est gardée
+            cloturer_trace(interrompue=True)
+        ouvrir_trace("script")
+
+
+def ouvrir_section(nom):
+    """Début d'une section de la trace courante (None si le profilage est désactivé)."""
+    trace = st.session_state.get("trace_rerun") if profilage_actif() else None
+    if trace is None:
+        return None
+    section = {
+        "nom": nom,
+        "debut_ms": round((time.perf_counter() - trace["debut"]) * 1000, 2),
+        "duree_ms": None,
+        "profondeur": len(trace["pile"]),
+    }
+    trace["sections"].append(section)
+    trace["pile"].append(section)
+    return section
+
+
+def fermer_section(section):
+    trace = st.session_state.get("trace_rerun") if section is not None else None
+    if trace is None:
+        return
+    section["duree_ms"] = round((time.perf_counter() - trace["debut"]) * 1000 - section["debut_ms"], 2)
+    trace["pile"] = [s for s in trace["pile"] if s is not section]
+
+
+@contextmanager
+def mesurer(nom):
+    section = ouvrir_section(nom)
+    try:
+        yield
+    finally:
+        fermer_section(section)
+
+
+def profile(nom=None):
+    """Décorateur : chaque appel devient une section de la trace (nom de la fonction par défaut)."""
+    def decorateur(fonction):
+        @wraps(fonction)
+        def mesuree(*args, **kwargs):
+            if not profilage_actif():
+                return fonction(*args, **kwargs)
+            with mesurer(nom or fonction.__name__):
+                return fonction(*args, **kwargs)
+        return mesuree
+    return decorateur
+
+
+def profile_fragment(nom=None):
+    """
+    profile() pour un @st.fragment (à placer sous @st.fragment). Dans un rerun complet, le fragment est une section.
+    Relancé seul (st.rerun(scope="fragment"), widget du fragment), le haut et la fin du script ne tournent pas :
+    le fragment remet alors à zéro le compteur SQL et ouvre sa propre trace, puis fait lui-même le bilan
+    sous son contenu (un fragment ne peut pas écrire dans la sidebar ; le détail est dans la trace JSON).
+    """
+    def decorateur(fonction):
+        nom_trace = nom or fonction.__name__
+        profilee = profile(nom_trace)(fonction)
+
+        @wraps(fonction)
+        def mesuree(*args, **kwargs):
+            compteur = compteur_sql()
+            if compteur is not None and not compteur["termine"]:
+                # Rerun complet (ou fragment parent) en cours
+                return profilee(*args, **kwargs)
+            demarrer_compteur_sql(f"fragment {nom_trace}")
+            if profilage_actif():
+                ouvrir_trace(f"fragment {nom_trace}")
+            try:
+                resultat = profilee(*args, **kwargs)
+            finally:
+                clore_compteur_sql()
+                export = cloturer_trace() if profilage_actif() else None
+            bilan_requetes_rerun(fragment=nom_trace)
+            if export is not None:
+                st.caption(f"⏱️ Rerun du fragment {nom_trace} : {export['total_ms']:.0f} ms")
+            return resultat
+        return mesuree
+    return decorateur
+
+
+def cloturer_trace(interrompue=False):
+    """
+    Retire la trace courante de la session et l'ajoute à l'historique (traces_reruns) ; renvoie son export.
+    Pour une trace interrompue, les sections restées ouvertes gardent une durée vide et le total s'arrête
+    à la dernière section terminée.
+    """
+    trace = st.session_state.get("trace_rerun")
+    if trace is None:
+        return None
+    if interrompue:
+        fins = [s["debut_ms"] + s["duree_ms"] for s in trace["sections"] if s["duree_ms"] is not None]
+        total_ms = round(max(fins, default=0.0), 2)
+    else:
+        for section in list(trace["pile"]):
+            fermer_section(section)
+        total_ms = round((time.perf_counter() - trace["debut"]) * 1000, 2)
+    del st.session_state["trace_rerun"]
+    export = {
+        "horodatage": trace["horodatage"],
+        "portee": trace["portee"],
+        "interrompue": interrompue,
+        "total_ms": total_ms,
+        "sections": trace["sections"],
+        "sql": compteur_sql(),
+    }
+    if "traces_reruns" not in st.session_state:
+        st.session_state.traces_reruns = deque(maxlen=NB_TRACES_CONSERVEES)
+    st.session_state.traces_reruns.append(export)
+    return export
+
+
+def afficher_profil_rerun():
+    """À appeler en fin de script : clôt la trace du rerun et affiche le détail dans la sidebar."""
+    export = cloturer_trace() if profilage_actif() else None
+    if export is None:
+        return
+
+    with st.sidebar.expander(f"⏱️ Profil du rerun : {export['total_ms']:.0f} ms", expanded=False):
+        if export["sections"]:
+            detail = pd.DataFrame(export["sections"])
+            detail["nom"] = ["\u00a0\u00a0" * p + n for p, n in zip(detail["profondeur"], detail["nom"])]
+            st.dataframe(detail[["nom", "debut_ms", "duree_ms"]], hide_index=True, use_container_width=True)
+        st.download_button(
+            "📥 Trace JSON",
+            data=json.dumps(list(st.session_state.traces_reruns), ensure_ascii=False, indent=2),
+            file_name=f"trace_reruns_{export['horodatage'].replace(':', '-')}.json",
+            mime="application/json",
+            use_container_width=True
+        )
+
+
+# --- REQUÊTES SQL PAR RERUN ---
+# Toujours actif (quelques additions par requête) : les hooks d'exécution SQLAlchemy comptent, pour le rerun
+# et pour chaque onglet, les requêtes, les allers-retours, les lignes renvoyées et le temps passé.
+# Au-delà de SEUIL_REQUETES_RERUN requêtes, un avertissement signale un motif N+1 probable.
+# Un fragment relancé seul a son propre compteur et son propre bilan (profile_fragment).
+SEUIL_REQUETES_RERUN = 40
+TAILLE_JOURNAL_SQL = 300
+
+
+def compteur_sql():
+    """Compteur du rerun en cours (None hors d'un rerun)."""
+    try:
+        return st.session_state.get("requetes_rerun")
+    except Exception:
+        return None
+
+
+def demarrer_compteur_sql(onglet="démarrage"):
+    """À appeler en tête de script (ou d'un fragment relancé seul) : remet le compteur à zéro."""
+    st.session_state.requetes_rerun = {
+        "termine": False,
+        "onglet": onglet,
+        "requetes": 0,
+        "allers_retours": 0,
+        "lignes": 0,
+        "duree_ms": 0.0,
+        "par_onglet": {},
+        "par_requete": Counter(),
+        "journal": [],
+    }
+
+
+def clore_compteur_sql():
+    """Le rerun est fini : un fragment exécuté ensuite est relancé seul et repart de zéro."""
+    compteur = compteur_sql()
+    if compteur is not None:
+        compteur["termine"] = True
+    return compteur
+
+
+def entrer_onglet_sql(onglet):
+    """Les requêtes suivantes sont attribuées à cet onglet."""
+    compteur = compteur_sql()
+    if compteur is not None:
+        compteur["onglet"] = onglet
+
+
+def compter_requete(statement, nb_requetes, nb_lignes, duree_ms):
+    compteur = compteur_sql()
+    if compteur is None:
+        return
+    requete = " ".join(statement.split())
+    for cible in (compteur, compteur["par_onglet"].setdefault(compteur["onglet"], {"requetes": 0, "allers_retours": 0, "lignes": 0, "duree_ms": 0.0})):
+        cible["requetes"] += nb_requetes
+        cible["allers_retours"] += 1
+        cible["lignes"] += nb_lignes
+        cible["duree_ms"] = round(cible["duree_ms"] + duree_ms, 2)
+    compteur["par_requete"][requete[:120]] += nb_requetes
+    if len(compteur["journal"]) < TAILLE_JOURNAL_SQL:
+        compteur["journal"].append({"onglet": compteur["onglet"], "requete": requete[:200], "lignes": nb_lignes, "duree_ms": round(duree_ms, 2)})
+
+
+def suivre_requetes_sql(moteur):
+    """Hooks posés une fois, avec l'engine : chaque requête est comptée, et devient une section du profil s'il est actif."""
+    @event.listens_for(moteur, "before_cursor_execute")
+    def avant_requete(conn, cursor, statement, parameters, context, executemany):
+        section = ouvrir_section("SQL · " + " ".join(statement.split())[:60])
+        conn.info.setdefault("debuts_sql", []).append((time.perf_counter(), section))
+
+    @event.listens_for(moteur, "after_cursor_execute")
+    def apres_requete(conn, cursor, statement, parameters, context, executemany):
+        debuts = conn.info.get("debuts_sql")
+        if not debuts:
+            return
+        debut, section = debuts.pop()
+        fermer_section(section)
+        # executemany : un seul aller-retour pour plusieurs jeux de paramètres
+        nb_requetes = len(parameters) if executemany else 1
+        compter_requete(statement, nb_requetes, max(cursor.rowcount, 0), (time.perf_counter() - debut) * 1000)
+
+    @event.listens_for(moteur, "handle_error")
+    def erreur_requete(contexte):
+        debuts = contexte.connection.info.get("debuts_sql") if contexte.connection is not None else None
+        if debuts:
+            fermer_section(debuts.pop()[1])
+
+
+def bilan_requetes_rerun(fragment=None):
+    """
+    À appeler en fin de script : avertit au-delà du seuil, détaille par onglet et par requête si le profil est actif.
+    Pour un fragment relancé seul (profile_fragment), le bilan s'affiche dans le fragment, sans le détail.
+    """
+    compteur = clore_compteur_sql()
+    if compteur is None:
+        return
+    portee = f"le rerun du fragment {fragment}" if fragment else "ce rerun"
+    zone = st if fragment else st.sidebar
+    if compteur["requetes"] > SEUIL_REQUETES_RERUN:
+        plus_frequente, nb = compteur["par_requete"].most_common(1)[0]
+        logging.warning("%s requêtes SQL sur %s (seuil %s) ; la plus répétée (%sx) : %s",
+                        compteur["requetes"], portee, SEUIL_REQUETES_RERUN, nb, plus_frequente)
+        zone.warning(f"⚠️ {compteur['requetes']} requêtes SQL sur {portee} (seuil : {SEUIL_REQUETES_RERUN}). "
+                     f"La plus répétée ({nb}x) : `{plus_frequente[:80]}`")
+    if not profilage_actif():
+        return
+    if fragment:
+        st.caption(f"🗄️ SQL : {compteur['requetes']} requêtes, {compteur['allers_retours']} allers-retours, {compteur['duree_ms']:.0f} ms")
+        return
+    with st.sidebar.expander(f"🗄️ SQL : {compteur['requetes']} requêtes, {compteur['duree_ms']:.0f} ms", expanded=False):
+        st.caption(f"{compteur['allers_retours']} allers-retours • {compteur['lignes']} lignes (renvoyées ou modifiées, selon le pilote)")
+        st.dataframe(pd.DataFrame.from_dict(compteur["par_onglet"], orient="index").rename_axis("onglet"), use_container_width=True)
+        repetees = pd.DataFrame(compteur["par_requete"].most_common(10), columns=["requete", "nb"])
+        st.dataframe(repetees, hide_index=True, use_container_width=True)
+
+
+def arreter_rerun():
+    """st.stop() qui passe d'abord par la fin de script : bilan SQL et trace du rerun ne sont pas perdus."""
+    bilan_requetes_rerun()
+    afficher_profil_rerun()
+    st.stop()
+
+
+demarrer_profil_rerun()
+demarrer_compteur_sql()
+
+
 @st.cache_resource
 def get_engine():
     """Crée et met en cache l'engine SQL pour toute la durée de session"""
-    return create_engine(st.secrets["connections"]["postgresql"]["url"])
+    moteur = create_engine(st.secrets["connections"]["postgresql"]["url"])
+    suivre_requetes_sql(moteur)
+    return moteur
 
 # On crée l'unique instance
 engine = get_engine()
 
+@st.cache_resource
+def verifier_schema():
+    """
+    Une fois par serveur : le schéma doit être à jour (python migrations.py), l'application ne fait pas de DDL.
+    Une exception n'est pas mise en cache : la vérification reprend au rerun suivant, une fois la migration passée.
+    """
+    with engine.connect() as conn_sql:
+        manquantes = migrations_manquantes(conn_sql)
+    if manquantes:
+        raise RuntimeError(f"migration(s) {manquantes} non appliquée(s)")
+    return True
+
+try:
+    verifier_schema()
+except Exception as e:
+    st.error(f"❌ Schéma Neon pas à jour ({e}) : lancez `python migrations.py`.")
+    arreter_rerun()
+
+
+# --- VERSIONS DES DONNÉES (partagées par toutes les sessions du serveur) ---
+# Chaque jeu de données d'un utilisateur a un compteur : les caches prennent la version en argument,
+# et une modification incrémente le compteur au lieu de vider tout le cache.
+@st.cache_resource
+def _registre_versions():
+    return {}
+
+def version_donnees(user, jeu):
+    return _registre_versions().get((str(user), jeu), 0)
+
+def invalider_donnees(user, jeu):
+    registre = _registre_versions()
+    registre[(str(user), jeu)] = registre.get((str(user), jeu), 0) + 1
+
+def cache_utilisateur(jeu, **options_cache):
+    """
+    @st.cache_data pour un chargeur dont le premier argument est l'utilisateur.
+    La version (user, jeu) fait partie de la clé : invalider_donnees(user, jeu) ne périme que
+    les entrées de cet utilisateur pour ce jeu, les autres sessions gardent leur cache.
+    """
+    def decorateur(fonction):
+        def en_cache(nom, user, version, *args, **kwargs):
+            return fonction(user, *args, **kwargs)
+        # Streamlit identifie un cache par le nom qualifié de la fonction : un cache distinct par chargeur
+        en_cache.__qualname__ = f"{fonction.__qualname__}.en_cache"
+        en_cache = st.cache_data(**options_cache)(en_cache)
+
+        @profile(fonction.__name__)
+        @wraps(fonction)
+        def chargeur(user, *args, **kwargs):
+            return en_cache(fonction.__qualname__, user, version_donnees(user, jeu), *args, **kwargs)
+        return chargeur
+    return decorateur
+
 # Définis ta version ici centralisée
 APP_VERSION = "V2.0.0"
 
@@ -57,27 +417,19 @@ st.markdown(
 
 
 
-def supprimer_transaction_neon(row, user):
+def supprimer_transactions_neon(ids, user):
+    """Supprime d'un coup toutes les transactions dont l'id est dans ids (une seule requête, quel que soit le nombre)."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return True
     try:
            
         with engine.begin() as conn:
-            query = text("""
-                DELETE FROM transactions 
-                WHERE date = :date 
-                AND nom = :nom 
-                AND montant = :montant 
-                AND utilisateur = :utilisateur
-            """)
-            
-            # On convertit explicitement pour éviter le bug np.float64
-            parametres = {
-                "date": row['date'],
-                "nom": str(row['nom']),
-                "montant": float(row['montant']), # <--- C'est ici que ça se joue !
-                "utilisateur": str(user)
-            }
-            
-            conn.execute(query, parametres)
+            conn.execute(
+                text("DELETE FROM transactions WHERE utilisateur = :utilisateur AND id = ANY(:ids)"),
+                {"utilisateur": str(user), "ids": ids}
+            )
+        invalider_donnees(user, "transactions")
         return True
     except Exception as e:
         st.error(f"Erreur suppression Neon : {e}")
@@ -367,6 +719,7 @@ def trouver_categorie_similaire_neon(nom_transaction, user, seuil=0.6):
         st.error(f"Erreur suggestion catégorie : {e}")
         return None, None
 
+@profile()
 def preparer_credentials_neon():
     try:
            
@@ -391,17 +744,17 @@ def preparer_credentials_neon():
 # --- DANS TON SCRIPT PRINCIPAL ---
 credentials = preparer_credentials_neon()
 
-authenticator = stauth.Authenticate(
-    credentials,  # Ce dictionnaire contient maintenant la clé 'usernames'
-    st.secrets['cookie']['name'],
-    st.secrets['cookie']['key'],
-    st.secrets['cookie']['expiry_days']
-)
-
+with mesurer("authentification"):
+    authenticator = stauth.Authenticate(
+        credentials,  # Ce dictionnaire contient maintenant la clé 'usernames'
+        st.secrets['cookie']['name'],
+        st.secrets['cookie']['key'],
+        st.secrets['cookie']['expiry_days']
+    )
 
 
-@st.cache_data(ttl=1800)
 
+@cache_utilisateur("config", ttl=1800)
 def charger_config_neon(user):
     try:
            
@@ -439,13 +792,15 @@ def charger_config_neon(user):
         return {}
 
 
-@st.cache_data(ttl=1800)
+@cache_utilisateur("transactions", ttl=1800)
 def charger_donnees(user):
+    """
+    Tout l'historique de user, lu une fois par session (et par version des transactions).
+    Les filtres, le tri et la pagination de Gérer travaillent ensuite sur ce DataFrame (transactions_filtrees).
+    """
     try:
-           
-        # On teste 'utilisateur' d'abord, sinon '"user"'
         query = text('SELECT * FROM transactions WHERE utilisateur = :u')
-        
+
         with engine.connect() as sql_conn:
             df = pd.read_sql(query, sql_conn, params={"u": str(user).strip()})
 
@@ -461,14 +816,12 @@ def charger_donnees(user):
         if 'user' in df.columns:
             df = df.rename(columns={'user': 'utilisateur'})
             
-        # 3. Sécurité Dates et Années
-        if 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            # On crée 'annee' (sans accent) si elle n'existe pas
-            if 'annee' not in df.columns and 'année' not in df.columns:
-                df['annee'] = df['date'].dt.year
-        
-        return df
+        # 3. L'id de la transaction devient l'index : il reste stable quels que soient les filtres et suppressions
+        df = df.set_index(df['id'].astype('int64'))
+        df.index.name = None
+
+        # 4. Types canoniques (dates, montants, années, catégoriels), une fois pour toute la session
+        return normaliser_colonnes_transactions(df)
 
     except Exception as e:
         st.error(f"Erreur SQL lors du chargement : {e}")
@@ -508,7 +861,8 @@ def sauvegarder_config_neon(config_dict, user):
                         couleur = EXCLUDED.couleur;
                 """)
                 conn_sql.execute(query, row_data)
-        
+
+        invalider_donnees(user, "config")
         return True
         
     except Exception as e:
@@ -626,104 +980,386 @@ CORRESPONDANCE = {
     "Credit": ["Credit", "Crédit"]
 }
 
-nomS_mois = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin", "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"]
 
 
-@st.cache_data(ttl=600)
-def charger_memoire_neon(user):
+
+# --- MOTEUR DE CATÉGORISATION ---
+# Règles génériques communes à tous les utilisateurs. Les noms propres (proches, employeurs,
+# bailleur...) n'ont rien à faire ici : chacun les ajoute dans sa table 'regles'.
+MES_COMPTES = ["LIVRET A", "LDDS", "compte CHEQUES", "COMMUN"]
+EMPLOYEURS = ["FRANCE TRAVAIL"]
+
+categorieS_MOTS_CLES = {
+    "💰 Salaire": ["FRANCE TRAVAIL", "POLE EMPLOI", "SARL"],
+    "🏥 Remboursements": ["NOSTRUMCARE", "AMELI", "CPAM", "REMBOURSEMENT", "SANTÉ"],
+    "👫 compte Commun": ["VERSEMENT COMMUN", "VIREMENT COMMUN"],
+    "📱 Abonnements": ["NETFLIX", "SPOTIFY", "DISNEY PLUS", "AMAZON PRIME", "YOUTUBE PREMIUM", "ORANGE", "GOOGLE PLAY", "GOOGLE ONE", "AMZ DIGITAL", "TWITCH"],
+    "🛒 Alimentation": ["CARREFOUR", "AUCHAN", "MONOPRIX", "CASINO", "SUPER", "PICARD", "BIOCOOP", "MARCHE", "BOULANGERIE", "RESTAURANT", "BAR", "MCDO", "SUBWAY", "INTERMARCHE", "LECLERC", "AUTOGRILL", "PROZIS", "CIAO BELLA"],
+    "🛍️ Shopping": ["AMAZON", "FNAC", "DARTY", "CULTURA", "ZARA", "H&M", "KIABI", "KLARNA"],
+    "👕 Habillement": ["VETEMENTS", "CHAUSSURES", "MODE", "CELIO", "JULES", "ASOS"],
+    "⚖️ Impôts": ["IMPOTS", "TRESOR PUBLIC", "DGFIP"],
+    "🏦 Frais Bancaires": ["COTISATION BANCAIRE","COTISATIONS BANCAIRES", "FRAIS BANCAIRES", "COTISATION ESSENTIEL"],
+    "🏠 Assurance Habitation": ["PACIFICA", "MMA", "MAIF", "MACIF"],
+    "🎮 Jeux vidéos": ["SONY PLAYSTATION", "NINTENDO", "STEAM", "EPIC GAMES", "INSTANT GAMING"],
+    "🩺 Mutuelle": ["MUTUELLE", "HARMONIE", "MGEN", "NOSTRUM CARE"],
+    "💊 Pharmacie": ["PHARMACIE", "MÉNARD", "PHARMA"],
+    "👨‍⚕️ Médecin/Santé": ["MEDECIN", "DENTISTE", "DOCTOLIB"],
+    "🔑 Loyer": ["LOYER", "AGENCE IMMOBILIERE"],
+    "🔨 Bricolage": ["CASTORAMA", "LEROY", "BRICO DEPOT", "IKEA"],
+    "🚌 Transports": ["RATP", "SNCF", "TCL", "ORIZO"],
+    "⛽ Carburant": ["TOTAL", "BP", "ESSENCE", "SHELL", "ESSOF", "CERTAS", "STATION"],
+    "🚗 Auto": ["CREDIT AUTO", "GARAGE", "REPARATION", "AUTO"],
+    "💸 Virements envoyé": ["VIREMENT A", "VIREMENT INSTANTANE", "VIR SEPA"],
+    "🏧 Retraits": ["RETRAIT DAB", "RETRAIT GAB"],
+    "🌐 Web/Énergie": ["FREE", "SFR", "BOUYGUES", "EDF", "ENGIE"],
+}
+
+# Règles dans l'ordre de priorité : la première qui s'applique gagne.
+# type_match : 'contient', 'commence', 'exact' ou 'regex'.
+# portee 'texte' = libellé + informations complémentaires, 'nom' = libellé seul.
+# condition 'vers' = le texte contient VERS, 'credit' = montant positif.
+TYPES_MATCH = ["contient", "commence", "exact", "regex"]
+PORTEES = ["nom", "texte"]
+CONDITIONS = ["", "vers", "credit"]
+
+REGLES_PAR_DEFAUT = [
+    # --- ÉTAPE A : DÉTECTION DES TRANSFERTS INTERNES (🔄) ---
+    {"motifs": ["LIVRET A"], "categorie": "🔄 Virement : CCP vers Livret A", "type_match": "contient", "portee": "texte", "condition": "vers"},
+    {"motifs": ["compte CHEQUES", "CCP"], "categorie": "🔄 Virement : Livret A vers CCP", "type_match": "contient", "portee": "texte", "condition": "vers"},
+    {"motifs": MES_COMPTES, "categorie": "🔄 Transfert Interne", "type_match": "contient", "portee": "texte", "condition": "vers"},
+    # --- ÉTAPE C : SALAIRES ET REVENUS ---
+    {"motifs": EMPLOYEURS, "categorie": "💰 Salaire", "type_match": "contient", "portee": "texte", "condition": None},
+] + [
+    # --- TOUTES LES CATÉGORIES (dans l'ordre du dictionnaire) ---
+    {"motifs": mots, "categorie": cat, "type_match": "contient", "portee": "nom", "condition": None}
+    for cat, mots in categorieS_MOTS_CLES.items()
+]
+
+
+def _condition_remplie(regle, vers, credit):
+    condition = regle.get("condition")
+    return not ((condition == "vers" and not vers) or (condition == "credit" and not credit))
+
+
+class AutomateMotsCles:
+    """
+    Automate d'Aho-Corasick construit une fois sur TOUS les mots-clés des règles :
+    un libellé est parcouru une seule fois, quel que soit le nombre de mots-clés.
+    """
+
+    MARQUEUR_VERS = "VERS"
+
+    def __init__(self, regles):
+        self.regles = list(regles)
+        self.motifs = []
+        self.declencheurs = []  # pour chaque motif : index des règles qui l'utilisent (croissants)
+        index_motif = {}
+
+        def enregistrer(motif):
+            if motif not in index_motif:
+                index_motif[motif] = len(self.motifs)
+                self.motifs.append(motif)
+                self.declencheurs.append([])
+            return index_motif[motif]
+
+        for i, regle in enumerate(self.regles):
+            for motif in regle["motifs"]:
+                if motif:
+                    id_motif = enregistrer(motif)
+                    if i not in self.declencheurs[id_motif]:
+                        self.declencheurs[id_motif].append(i)
+        self.id_vers = enregistrer(self.MARQUEUR_VERS)
+
+        # 1. Arbre des préfixes
+        self.transitions = [{}]
+        self.sorties = [[]]
+        for id_motif, motif in enumerate(self.motifs):
+            etat = 0
+            for c in motif:
+                suivant = self.transitions[etat].get(c)
+                if suivant is None:
+                    suivant = len(self.transitions)
+                    self.transitions.append({})
+                    self.sorties.append([])
+                    self.transitions[etat][c] = suivant
+                etat = suivant
+            self.sorties[etat].append(id_motif)
+
+        # 2. Liens d'échec (parcours en largeur)
+        self.echec = [0] * len(self.transitions)
+        file = deque(self.transitions[0].values())
+        while file:
+            etat = file.popleft()
+            for c, suivant in self.transitions[etat].items():
+                file.append(suivant)
+                f = self.echec[etat]
+                while f and c not in self.transitions[f]:
+                    f = self.echec[f]
+                self.echec[suivant] = self.transitions[f].get(c, 0)
+                self.sorties[suivant] = self.sorties[suivant] + self.sorties[self.echec[suivant]]
+
+    def motifs_trouves(self, texte, limite_nom):
+        """Motifs présents dans texte, et ceux entièrement compris dans ses limite_nom premiers caractères."""
+        etat = 0
+        partout, dans_nom = set(), set()
+        for pos, c in enumerate(texte):
+            while etat and c not in self.transitions[etat]:
+                etat = self.echec[etat]
+            etat = self.transitions[etat].get(c, 0)
+            for id_motif in self.sorties[etat]:
+                partout.add(id_motif)
+                if pos < limite_nom:
+                    dans_nom.add(id_motif)
+        return partout, dans_nom
+
+    def meilleure_regle(self, texte, limite_nom, credit):
+        """Index de la règle la plus prioritaire qui s'applique, ou None. Renvoie aussi si VERS est présent."""
+        partout, dans_nom = self.motifs_trouves(texte, limite_nom)
+        vers = self.id_vers in partout
+        meilleure = None
+        for id_motif in partout:
+            for i in self.declencheurs[id_motif]:
+                if meilleure is not None and i >= meilleure:
+                    break
+                regle = self.regles[i]
+                if regle["portee"] == "nom" and id_motif not in dans_nom:
+                    continue
+                if not _condition_remplie(regle, vers, credit):
+                    continue
+                meilleure = i
+                break
+        return meilleure, vers
+
+
+class MoteurRegles:
+    """
+    Les règles d'un utilisateur (les siennes puis les génériques) compilées une fois :
+    l'automate traite les 'contient', les autres types sont testés directement.
+    """
+
+    def __init__(self, regles):
+        self.regles = list(regles)
+        # L'automate garde les index de toutes les règles (motifs vidés pour les autres types)
+        self.automate = AutomateMotsCles([
+            r if r.get("type_match", "contient") == "contient" else {**r, "motifs": []}
+            for r in self.regles
+        ])
+        self.autres = []
+        for i, regle in enumerate(self.regles):
+            type_match = regle.get("type_match", "contient")
+            if type_match == "contient":
+                continue
+            for motif in regle["motifs"]:
+                if type_match == "commence":
+                    test = lambda cible, m=motif: cible.startswith(m)
+                elif type_match == "exact":
+                    test = lambda cible, m=motif: cible.strip() == m
+                else:
+                    try:
+                        test = re.compile(motif).search
+                    except re.error:
+                        continue  # Une regex invalide saisie par l'utilisateur est ignorée
+                self.autres.append((i, regle, test))
+
+    def categorie(self, texte, limite_nom, credit):
+        meilleure, vers = self.automate.meilleure_regle(texte, limite_nom, credit)
+        for i, regle, test in self.autres:
+            if meilleure is not None and i >= meilleure:
+                break
+            if not _condition_remplie(regle, vers, credit):
+                continue
+            if test(texte[:limite_nom] if regle["portee"] == "nom" else texte):
+                meilleure = i
+        return self.regles[meilleure]["categorie"] if meilleure is not None else None
+
+
+MOTEUR_PAR_DEFAUT = MoteurRegles(REGLES_PAR_DEFAUT)
+
+
+@cache_utilisateur("regles", ttl=1800)
+def charger_regles_neon(user):
+    """Règles personnelles de l'utilisateur, par priorité croissante (DataFrame vide si aucune)."""
+    colonnes = ['priorite', 'motif', 'type_match', 'categorie', 'portee', 'condition']
     try:
-           
-        # On récupère les associations nom -> Catégorie enregistrées par l'utilisateur
-        query = text("SELECT nom_clean, categorie FROM memoire WHERE user = :u")
-        
         with engine.connect() as conn:
-            df = pd.read_sql(query, conn, params={"u": user})
-            
-        # On transforme le DF en dictionnaire { 'nom_CLEAN': 'Catégorie' }
-        return dict(zip(df['nom_clean'], df['categorie']))
+            df = pd.read_sql(
+                text("SELECT priorite, motif, type_match, categorie, portee, condition FROM regles WHERE utilisateur = :u ORDER BY priorite, id"),
+                conn, params={"u": user}
+            )
+        return df if not df.empty else pd.DataFrame(columns=colonnes)
     except Exception:
-        return {}
+        return pd.DataFrame(columns=colonnes)
+
 
+def sauvegarder_regles_neon(df_regles, user):
+    """Remplace toutes les règles de l'utilisateur (une suppression + une insertion groupée)."""
+    try:
+        df_regles = df_regles.dropna(subset=['motif', 'categorie'])
+        df_regles = df_regles[df_regles['motif'].astype(str).str.strip() != ""]
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM regles WHERE utilisateur = :u"), {"u": user})
+            if not df_regles.empty:
+                conn.execute(text("""
+                    INSERT INTO regles (utilisateur, priorite, motif, type_match, categorie, portee, condition)
+                    SELECT :u, s.priorite, s.motif, s.type_match, s.categorie, s.portee, NULLIF(s.condition, '')
+                    FROM unnest(
+                        CAST(:priorites AS integer[]), CAST(:motifs AS text[]), CAST(:types AS text[]),
+                        CAST(:categories AS text[]), CAST(:portees AS text[]), CAST(:conditions AS text[])
+                    ) AS s(priorite, motif, type_match, categorie, portee, condition)
+                """), {
+                    "u": user,
+                    "priorites": [int(p) for p in pd.to_numeric(df_regles['priorite'], errors='coerce').fillna(100)],
+                    "motifs": df_regles['motif'].astype(str).str.strip().tolist(),
+                    "types": df_regles['type_match'].fillna("contient").astype(str).tolist(),
+                    "categories": df_regles['categorie'].astype(str).tolist(),
+                    "portees": df_regles['portee'].fillna("nom").astype(str).tolist(),
+                    "conditions": df_regles['condition'].fillna("").astype(str).tolist(),
+                })
+        invalider_donnees(user, "regles")
+        return True
+    except Exception as e:
+        st.error(f"Erreur sauvegarde des règles : {e}")
+        return False
 
 
-def categoriser(nom_operation, montant=0, compte_actuel=None, ligne_complete=None):
-    n_brut = str(nom_operation).upper()
-    n_clean = simplifier_nom_definitif(n_brut)
-    
-    # 1. MÉMOIRE (Priorité absolue via Neon)
-    # On récupère l'user depuis le session_state
-    user = st.session_state.get("user")
-    if user:
-        # On utilise une fonction charger_memoire_neon que nous allons définir
-        memoire = charger_memoire_neon(user)
-        if n_clean in memoire: 
-            return memoire[n_clean]
+@st.cache_resource(max_entries=32)
+def charger_moteur_regles(user, version):
+    """Moteur compilé pour user. version (voir version_donnees) fait partie de la clé : une modification des règles crée une nouvelle entrée."""
+    regles_perso = [
+        {
+            "motifs": [row.motif if row.type_match == "regex" else str(row.motif).upper()],
+            "categorie": row.categorie,
+            "type_match": row.type_match,
+            "portee": row.portee,
+            "condition": row.condition if isinstance(row.condition, str) and row.condition else None,
+        }
+        for row in charger_regles_neon(user).itertuples(index=False)
+    ]
+    # Les règles personnelles passent avant les génériques
+    return MoteurRegles(regles_perso + REGLES_PAR_DEFAUT) if regles_perso else MOTEUR_PAR_DEFAUT
+
+
+@profile()
+def categoriser_batch(noms, montants, compte=None, infos=None):
+    """
+    Catégorise toute une colonne de libellés d'un coup (mêmes règles et même ordre de priorité que categoriser).
+    noms / montants / infos ('Informations complementaires') sont des Series alignées. Renvoie une Series de catégories.
+    """
+    n_brut = noms.astype(str).str.upper()
+    montants = pd.to_numeric(montants, errors='coerce')
+    positif = (montants > 0).to_numpy()
 
     # 2. SCAN COMPLET DE LA LIGNE
-    if ligne_complete is not None:
-        texte_integral = n_brut + " " + str(ligne_complete.get('Informations complementaires', '')).upper()
+    if infos is not None:
+        texte_integral = n_brut + " " + infos.fillna("").astype(str).str.upper()
     else:
         texte_integral = n_brut
 
-    # 3. LES compteS ET PROCHES
-    mes_comptes = ["LIVRET A", "LDDS", "compte CHEQUES", "COMMUN"]
-    proches = ["MARYLINE FONTA", "AURORE FONTA", "LEBARBIER THEO", "LEBARBIER DIDIER"]
+    resultat = pd.Series(None, index=noms.index, dtype=object)
+    moteur = MOTEUR_PAR_DEFAUT
 
-    # --- ÉTAPE A : DÉTECTION DES TRANSFERTS INTERNES (🔄) ---
-    # On cherche le mot "VERS" suivi d'un de tes comptes [cite: 2, 5]
-    
-    if "VERS" in texte_integral:
-        if "LIVRET A" in texte_integral: return "🔄 Virement : CCP vers Livret A"
-        if "compte CHEQUES" in texte_integral or "CCP" in texte_integral: return "🔄 Virement : Livret A vers CCP"
-        if any(c in texte_integral for c in mes_comptes): return "🔄 Transfert Interne"
+    # 1. MÉMOIRE (Priorité absolue via Neon) : une simple correspondance de dictionnaire
+    user = st.session_state.get("user")
+    if user:
+        moteur = charger_moteur_regles(user, version_donnees(user, "regles"))
+        memoire = charger_memoire_neon(user)
+        if memoire:
+            n_clean = simplifier_noms_series(n_brut)
+            resultat = n_clean.map(memoire).astype(object)
+
+    # 2. RÈGLES : un passage du moteur par libellé distinct restant
+    a_traiter = resultat.isna().to_numpy()
+    deja_vus = {}
+    categories = []
+    for texte, limite, credit in zip(texte_integral[a_traiter], n_brut[a_traiter].str.len(), positif[a_traiter]):
+        cle = (texte, limite, credit)
+        if cle not in deja_vus:
+            deja_vus[cle] = moteur.categorie(texte, limite, credit)
+        categories.append(deja_vus[cle])
+    resultat[a_traiter] = categories
+
+    # 3. PAR DÉFAUT
+    reste = resultat.isna().to_numpy()
+    resultat[reste & positif] = "💰 Autres Revenus"
+    resultat[reste & ~positif] = "❓ Autre"
+    return resultat
+
+
+@profile()
+def categoriser(nom_operation, montant=0, compte_actuel=None, ligne_complete=None):
+    """Version ligne à ligne de categoriser_batch (saisie unitaire)."""
+    infos = None
+    if ligne_complete is not None:
+        infos = pd.Series([ligne_complete.get('Informations complementaires', '')])
+    return categoriser_batch(pd.Series([nom_operation]), pd.Series([montant]), compte_actuel, infos).iloc[0]
 
-    # --- ÉTAPE B : DÉTECTION DES PROCHES (🤝) ---
-    # Si on est ici, c'est que ce n'est pas un transfert "VERS" un compte
-    if montant > 0 and any(p in n_brut for p in proches):
-        return "🤝 Virements Reçus"
 
-    # --- ÉTAPE C : SALAIRES ET REVENUS ---
-    if any(s in texte_integral for s in ["SARL LES GOURMANDISES", "FRANCE TRAVAIL", "JEFF DE BRUGES"]):
-        return "💰 Salaire"
-
-    # ... (Le reste de tes catégories habituelles)
-
-    # --- 5. TOUTES TES CATÉGORIES (Liste intégrale) ---
-    categorieS_MOTS_CLES = {
-        "💰 Salaire": ["MELTED", "JEFF DB", "FRANCE TRAVAIL", "POLE EMPLOI", "SARL", "JEFF DE BRUGES"],
-        "🏥 Remboursements": ["NOSTRUMCARE", "AMELI", "CPAM", "REMBOURSEMENT", "SANTÉ", "FAUSTINE BOJUC"],
-        "👫 compte Commun": ["A FONTA AUDE OU LEBARBIER THEO", "AUDE FONTATHEO LEBARBIE", "VERSEMENT COMMUN", "VIREMENT COMMUN"],
-        "🤝 Virements Reçus": proches,
-        "📱 Abonnements": ["NETFLIX", "SPOTIFY", "DISNEY PLUS", "AMAZON PRIME", "YOUTUBE PREMIUM", "ORANGE", "GOOGLE PLAY", "GOOGLE ONE", "AMZ DIGITAL", "TWITCH"],
-        "🛒 Alimentation": ["CARREFOUR", "AUCHAN", "MONOPRIX", "CASINO", "SUPER", "PICARD", "BIOCOOP", "MARCHE", "BOULANGERIE", "RESTAURANT", "BAR", "MCDO", "SUBWAY", "INTERMARCHE", "LECLERC", "AUTOGRILL", "PROZIS", "CIAO BELLA"],
-        "🛍️ Shopping": ["AMAZON", "FNAC", "DARTY", "CULTURA", "ZARA", "H&M", "KIABI", "KLARNA"],
-        "👕 Habillement": ["VETEMENTS", "CHAUSSURES", "MODE", "CELIO", "JULES", "ASOS"],
-        "⚖️ Impôts": ["IMPOTS", "TRESOR PUBLIC", "DGFIP"],
-        "🏦 Frais Bancaires": ["COTISATION BANCAIRE","COTISATIONS BANCAIRES", "FRAIS BANCAIRES", "COTISATION ESSENTIEL"],
-        "🏠 Assurance Habitation": ["PACIFICA", "MMA", "MAIF", "MACIF"],
-        "🎮 Jeux vidéos": ["SONY PLAYSTATION", "NINTENDO", "STEAM", "EPIC GAMES", "INSTANT GAMING"],
-        "🩺 Mutuelle": ["MUTUELLE", "HARMONIE", "MGEN", "NOSTRUM CARE"],
-        "💊 Pharmacie": ["PHARMACIE", "MÉNARD", "PHARMA"],
-        "👨‍⚕️ Médecin/Santé": ["MEDECIN", "DENTISTE", "DOCTOLIB"],
-        "🔑 Loyer": ["LOYER", "AGENCE IMMOBILIERE", "JASON MOLINER"],
-        "🔨 Bricolage": ["CASTORAMA", "LEROY", "BRICO DEPOT", "IKEA"],
-        "🚌 Transports": ["RATP", "SNCF", "TCL", "ORIZO"],
-        "⛽ Carburant": ["TOTAL", "BP", "ESSENCE", "SHELL", "ESSOF", "CERTAS", "STATION"],
-        "🚗 Auto": ["CREDIT AUTO", "GARAGE", "REPARATION", "AUTO"],
-        "💸 Virements envoyé": ["VIREMENT A", "VIREMENT INSTANTANE", "VIR SEPA"],
-        "🏧 Retraits": ["RETRAIT DAB", "RETRAIT GAB"],
-        "🌐 Web/Énergie": ["FREE", "SFR", "BOUYGUES", "EDF", "ENGIE"],
-    }
-    
-    for cat, mots in categorieS_MOTS_CLES.items():
-        if any(m in n_brut for m in mots):
-            return cat
-    
-    return "💰 Autres Revenus" if montant > 0 else "❓ Autre"
+# --- SUGGESTIONS PAR SIMILARITÉ ---
+CATEGORIES_A_TRIER = ["", "À catégoriser ❓"]
+
+
+class IndexSuggestions:
+    """
+    Index inversé de trigrammes sur les noms déjà catégorisés : on ne compare (difflib)
+    qu'aux quelques candidats qui partagent le plus de trigrammes, pas à tout l'historique.
+    """
+
+    def __init__(self):
+        self.categories = {}  # nom -> catégorie
+        self.trigrammes = defaultdict(set)  # trigramme -> noms qui le contiennent
+
+    @staticmethod
+    def _trigrammes(nom):
+        texte = f"  {nom.upper()} "
+        return {texte[i:i + 3] for i in range(len(texte) - 2)}
+
+    def mettre_a_jour(self, nom, categorie):
+        """Ajoute (ou recatégorise) un nom. Les lignes encore à trier ne servent pas de modèle."""
+        if pd.isna(nom) or pd.isna(categorie) or categorie in CATEGORIES_A_TRIER:
+            return
+        nom = str(nom)
+        if nom not in self.categories:
+            for tri in self._trigrammes(nom):
+                self.trigrammes[tri].add(nom)
+        self.categories[nom] = categorie
+
+    def ajouter_df(self, df):
+        """Indexe les couples (nom, catégorie) d'un DataFrame ; pour un nom déjà connu, la première catégorie vue est gardée."""
+        if df.empty:
+            return
+        for nom, categorie in df[['nom', 'categorie']].drop_duplicates('nom').itertuples(index=False):
+            if str(nom) not in self.categories:
+                self.mettre_a_jour(nom, categorie)
+
+    def suggerer(self, nom, seuil=0.6, nb_candidats=5):
+        """Renvoie (catégorie, nom proche) ou (None, None)."""
+        if pd.isna(nom) or not self.categories:
+            return None, None
+        nom = str(nom)
+        communs = Counter()
+        for tri in self._trigrammes(nom):
+            communs.update(self.trigrammes.get(tri, ()))
+
+        meilleur, meilleur_score = None, seuil
+        for candidat, _ in communs.most_common(nb_candidats):
+            score = SequenceMatcher(None, nom, candidat).ratio()
+            if score >= meilleur_score:
+                meilleur, meilleur_score = candidat, score
+        return (self.categories[meilleur], meilleur) if meilleur else (None, None)
+
+
+def index_suggestions():
+    """Index de la session courante, construit une fois depuis st.session_state.df puis tenu à jour."""
+    if "index_suggestions" not in st.session_state:
+        index = IndexSuggestions()
+        index.ajouter_df(st.session_state.get("df", pd.DataFrame()))
+        st.session_state.index_suggestions = index
+    return st.session_state.index_suggestions
 
 
 # --- FONCTIONS DE GESTION DES CATÉGORIES ---
 
+@cache_utilisateur("regles", ttl=1800)
 def charger_categories_neon(user):
     """Renvoie TOUTES les catégories (Défaut + Perso) SANS filtrer les masquées."""
     defaut = [
@@ -750,6 +1386,7 @@ def charger_categories_neon(user):
     except Exception as e:
         return sorted(defaut)
 
+@cache_utilisateur("regles", ttl=1800)
 def charger_categories_neon_masquees(user):
     """Lit les catégories masquées dans Neon pour l'utilisateur."""
     try:
@@ -763,6 +1400,7 @@ def charger_categories_neon_masquees(user):
     except Exception as e:
         return []
 
+@profile()
 def charger_categories_neon_visibles(user):
     """Renvoie la liste filtrée pour les menus déroulants du tableau."""
     # On récupère TOUT le référentiel
@@ -787,6 +1425,7 @@ def sauvegarder_preference_masquage_neon(user, liste_a_masquer):
                         text("INSERT INTO categories_masquees (nom, utilisateur) VALUES (:n, :u)"),
                         {"n": cat, "u": user}
                     )
+        invalider_donnees(user, "regles")
         return True
     except Exception as e:
         st.error(f"Erreur sauvegarde masquage : {e}")
@@ -802,6 +1441,7 @@ def sauvegarder_nouvelle_categorie_neon(nouvelle_cat, user):
                 VALUES (:n, :u)
                 ON CONFLICT (nom, utilisateur) DO NOTHING
             """), {"n": nouvelle_cat, "u": user})
+        invalider_donnees(user, "regles")
         
         # Rafraîchissement immédiat du session_state
         st.session_state.LISTE_categorieS_COMPLETE = charger_categories_neon(user)
@@ -819,53 +1459,51 @@ else:
 # --- 3. TOUTES LES FONCTIONS ---
 
 
-@st.cache_data(ttl=1800)
-
-def charger_memoire_neon(user):
+# --- MÉMOIRE DES CATÉGORIES (APPRENTISSAGE) ---
+# Table memoire : (utilisateur, nom simplifié) -> catégorie, écrite par l'apprentissage de l'onglet Gérer.
+# Un dictionnaire par utilisateur, gardé en mémoire dans le processus et partagé par ses sessions ;
+# la version 'memoire' (voir version_donnees) fait partie de la clé, un apprentissage en crée un nouveau.
+@st.cache_resource(max_entries=32)
+def _memoire_utilisateur(user, version):
     try:
-           
-        # On ne récupère que ce qui appartient à l'utilisateur
-        query = text("SELECT nom, categorie FROM memoire WHERE user = :u")
-        
-        with engine.connect() as conn:
-            df_memo = pd.read_sql(query, conn, params={"u": user})
-            
-        if df_memo.empty:
-            return {}
-            
-        # On transforme en dictionnaire { 'nom': 'Catégorie' }
-        return dict(zip(df_memo['nom'], df_memo['categorie']))
-    except Exception:
+        with engine.connect() as conn_sql:
+            lignes = conn_sql.execute(
+                text("SELECT nom, categorie FROM memoire WHERE utilisateur = :u AND categorie IS NOT NULL"),
+                {"u": user}
+            ).fetchall()
+        return {nom: categorie for nom, categorie in lignes}
+    except Exception as e:
+        st.error(f"Erreur chargement mémoire Neon : {e}")
         return {}
 
+
+def charger_memoire_neon(user):
+    """{nom simplifié: catégorie} appris par user. Dictionnaire partagé : à lire, jamais à modifier."""
+    return _memoire_utilisateur(user, version_donnees(user, "memoire"))
+
+
 def sauvegarder_apprentissage_batch_neon(liste_transactions, user):
+    """Mémorise les couples (libellé, catégorie) en un seul UPSERT, puis invalide la mémoire de user."""
+    # Un libellé simplifié n'apparaît qu'une fois par lot (le dernier choix l'emporte) : ON CONFLICT l'exige
+    lot = {simplifier_nom_definitif(nom_ope): categorie for nom_ope, categorie in liste_transactions}
+    if not lot:
+        return True
     try:
-           
-        
         with engine.begin() as conn_sql:
-            for nom_ope, categorie in liste_transactions:
-                nom_clean = simplifier_nom_definitif(nom_ope)
-                
-                # Le SQL "UPSERT" : si le nom existe déjà pour cet utilisateur, on met à jour la catégorie
-                query = text("""
-                    INSERT INTO memoire (utilisateur, nom, categorie)
-                    VALUES (:u, :n, :c)
-                    ON CONFLICT (utilisateur, nom) 
-                    DO UPDATE SET categorie = EXCLUDED.categorie
-                """)
-                
-                conn_sql.execute(query, {
-                    "u": user,
-                    "n": nom_clean,
-                    "c": categorie
-                })
+            conn_sql.execute(text("""
+                INSERT INTO memoire (utilisateur, nom, categorie)
+                SELECT :u, s.nom, s.categorie
+                FROM unnest(CAST(:noms AS text[]), CAST(:categories AS text[])) AS s(nom, categorie)
+                ON CONFLICT (utilisateur, nom)
+                DO UPDATE SET categorie = EXCLUDED.categorie
+            """), {"u": user, "noms": list(lot.keys()), "categories": [str(c) for c in lot.values()]})
+        invalider_donnees(user, "memoire")
         return True
     except Exception as e:
         st.error(f"Erreur apprentissage Neon : {e}")
         return False
 
-@st.cache_data(ttl=1800)
-
+@cache_utilisateur("theme", ttl=1800)
 def charger_tout_le_theme_neon(user):
     try:
            
@@ -896,9 +1534,8 @@ if "user_theme" not in st.session_state:
         st.session_state.user_theme = {}
         st.error(f"Erreur chargement design : {e}")
 
-@st.cache_data(ttl=1800)
-
 # Nouvelle fonction charger_couleur qui ne lit plus GSheets mais la session :
+# (pas de cache propre : elle ne fait que lire le thème déjà en cache pour l'utilisateur courant)
 def charger_couleur(type_couleur="Couleur", default="#222222"):
     try:
         # On utilise la fonction qui a le cache @st.cache_data
@@ -929,16 +1566,15 @@ def sauvegarder_plusieurs_couleurs_neon(nouveaux_reglages):
                 """)
                 conn_sql.execute(query, {"u": user, "e": element, "c": hex_color})
         
-        # On vide le cache spécifique du thème pour forcer le rafraîchissement visuel
-        st.cache_data.clear()
+        # On invalide seulement le thème de cet utilisateur pour forcer le rafraîchissement visuel
+        invalider_donnees(user, "theme")
         return True
     except Exception as e:
         st.error(f"Erreur sauvegarde thème Neon : {e}")
         return False
 
 
-@st.cache_data(ttl=1800)
-
+@cache_utilisateur("config", ttl=1800)
 def charger_groupes(user):
     """
     Récupère la liste des groupes uniques de l'utilisateur.
@@ -975,55 +1611,470 @@ def clean_montant_physique(valeur):
 
 
 
-def sauvegarder_donnees_neon(nouveau_df, user=None):
+def _preparer_lot_transactions(nouveau_df):
+    """Met un lot de transactions au format attendu par la table (dates, montants, textes, année)."""
+    df_to_save = nouveau_df.copy()
+    
+    # SÉCURITÉ : On s'assure que les dates sont JUSTE des dates (pas d'heures cachées)
+    df_to_save['date'] = pd.to_datetime(df_to_save['date'], dayfirst=True, errors='coerce')
+    df_to_save = df_to_save.dropna(subset=['date'])
+
+    # SÉCURITÉ : On nettoie les espaces dans les noms (souvent cause de faux doublons)
+    df_to_save['nom'] = df_to_save['nom'].astype(str).str.strip()
+    df_to_save['montant'] = pd.to_numeric(df_to_save['montant'], errors='coerce').fillna(0.0).round(2)
+
+    for col in ['categorie', 'compte', 'mois']:
+        if col not in df_to_save.columns:
+            df_to_save[col] = None
+        df_to_save[col] = df_to_save[col].astype(object).where(df_to_save[col].notna(), "Inconnu").astype(str)
+
+    # L'année est recalculée depuis la date si elle manque ou n'est pas exploitable
+    annees = pd.to_numeric(df_to_save['année'], errors='coerce') if 'année' in df_to_save.columns else pd.Series(float('nan'), index=df_to_save.index)
+    df_to_save['année'] = annees.fillna(df_to_save['date'].dt.year).astype(int)
+    return df_to_save
+
+
+def _colonnes_lot(df_to_save):
+    """Le lot découpé en colonnes (listes Python), prêtes à être dépliées par unnest côté Postgres."""
+    return {
+        "dates": df_to_save['date'].dt.date.tolist(),
+        "noms": df_to_save['nom'].tolist(),
+        "montants": [float(m) for m in df_to_save['montant']],
+        "categories": df_to_save['categorie'].tolist(),
+        "comptes": df_to_save['compte'].tolist(),
+        "mois": df_to_save['mois'].tolist(),
+        "annees": [int(a) for a in df_to_save['année']],
+    }
+
+
+def _inserer_transactions(conn_sql, df_to_save, user):
+    """
+    Insère un lot préparé (index = id provisoires, voir ids_provisoires) ; Neon attribue les id.
+    Renvoie {id provisoire: id définitif}.
+    """
+    if df_to_save.empty:
+        return {}
+    resultat = conn_sql.execute(text("""
+        INSERT INTO transactions (date, nom, montant, categorie, compte, utilisateur, mois, année)
+        SELECT s.date, s.nom, s.montant, s.categorie, s.compte, :utilisateur, s.mois, s.annee
+        FROM unnest(
+            CAST(:dates AS date[]), CAST(:noms AS text[]), CAST(:montants AS numeric[]),
+            CAST(:categories AS text[]), CAST(:comptes AS text[]),
+            CAST(:mois AS text[]), CAST(:annees AS integer[])
+        ) WITH ORDINALITY AS s(date, nom, montant, categorie, compte, mois, annee, ord)
+        ORDER BY s.ord
+        RETURNING id
+    """), {"utilisateur": str(user).strip(), **_colonnes_lot(df_to_save)})
+    return dict(zip((int(i) for i in df_to_save.index), (int(r[0]) for r in resultat)))
+
+
+def _maj_transactions_par_id(conn_sql, df_to_save, user):
+    """Met à jour, par id, les lignes d'un lot préparé. Les lignes identiques en base ne sont pas réécrites."""
+    if df_to_save.empty:
+        return 0
+    resultat = conn_sql.execute(text("""
+        UPDATE transactions t
+        SET date = s.date, nom = s.nom, montant = s.montant,
+            categorie = s.categorie, compte = s.compte, mois = s.mois, année = s.annee
+        FROM unnest(
+            CAST(:ids AS bigint[]),
+            CAST(:dates AS date[]), CAST(:noms AS text[]), CAST(:montants AS numeric[]),
+            CAST(:categories AS text[]), CAST(:comptes AS text[]),
+            CAST(:mois AS text[]), CAST(:annees AS integer[])
+        ) AS s(id, date, nom, montant, categorie, compte, mois, annee)
+        WHERE t.id = s.id AND t.utilisateur = :utilisateur
+        AND (t.date, t.nom, t.montant, t.categorie, t.compte, t.mois, t.année)
+            IS DISTINCT FROM (s.date, s.nom, s.montant, s.categorie, s.compte, s.mois, s.annee)
+    """), {"utilisateur": str(user).strip(), "ids": [int(i) for i in df_to_save.index], **_colonnes_lot(df_to_save)})
+    return resultat.rowcount
+
+
+def importer_transactions_neon(nouveau_df, user=None):
+    """
+    Import incrémental d'un relevé : n'insère que les lignes absentes de la base, en UNE requête.
+    Pour chaque clé (date, nom, montant), si le relevé en contient k et la base déjà e, seules
+    les k - e dernières sont insérées : réimporter un relevé qui chevauche le précédent ne crée
+    aucun doublon, mais deux achats identiques le même jour restent deux lignes.
+    Renvoie les lignes réellement insérées (avec leur id) ou None en cas d'erreur.
+    """
     try:
            
         u_final = user or st.session_state.get("user")
         if not u_final:
             st.error("❌ Utilisateur non détecté.")
-            return False
+            return None
+
+        df_to_save = _preparer_lot_transactions(nouveau_df)
+        if df_to_save.empty:
+            return df_to_save.iloc[0:0]
+
+        query = text("""
+            WITH lot AS (
+                SELECT * FROM unnest(
+                    CAST(:dates AS date[]), CAST(:noms AS text[]), CAST(:montants AS numeric[]),
+                    CAST(:categories AS text[]), CAST(:comptes AS text[]),
+                    CAST(:mois AS text[]), CAST(:annees AS integer[])
+                ) WITH ORDINALITY AS l(date, nom, montant, categorie, compte, mois, annee, ord)
+            ),
+            s AS (
+                SELECT lot.*, row_number() OVER (PARTITION BY date, nom, montant ORDER BY ord) AS rang
+                FROM lot
+            ),
+            existants AS (
+                SELECT t.date, t.nom, t.montant, count(*) AS nb
+                FROM transactions t
+                JOIN (SELECT DISTINCT date, nom, montant FROM lot) k
+                    ON t.date = k.date AND t.nom = k.nom AND t.montant = k.montant
+                WHERE t.utilisateur = :utilisateur
+                GROUP BY t.date, t.nom, t.montant
+            )
+            INSERT INTO transactions (date, nom, montant, categorie, compte, utilisateur, mois, année)
+            SELECT s.date, s.nom, s.montant, s.categorie, s.compte, :utilisateur, s.mois, s.annee
+            FROM s
+            LEFT JOIN existants e ON e.date = s.date AND e.nom = s.nom AND e.montant = s.montant
+            WHERE s.rang > COALESCE(e.nb, 0)
+            ORDER BY s.ord
+            RETURNING id, date, nom, montant, categorie, compte, utilisateur, mois, année
+        """)
+
+        with engine.begin() as conn_sql:
+            resultat = conn_sql.execute(query, {"utilisateur": str(u_final).strip(), **_colonnes_lot(df_to_save)})
+            df_inserees = pd.DataFrame(resultat.fetchall(), columns=list(resultat.keys()))
+        if not df_inserees.empty:
+            invalider_donnees(u_final, "transactions")
+
+        # Même forme que charger_donnees : dates en datetime, id en index
+        df_inserees['date'] = pd.to_datetime(df_inserees['date'], errors='coerce')
+        df_inserees['montant'] = df_inserees['montant'].astype(float)
+        df_inserees = df_inserees.set_index(df_inserees['id'].astype('int64'))
+        df_inserees.index.name = None
+        return df_inserees
+    except Exception as e:
+        st.error(f"Erreur d'import Neon : {e}")
+        return None
+
+
+def ids_provisoires(df_base, nb):
+    """
+    nb id négatifs pour des lignes pas encore dans Neon (la colonne identity n'en donne jamais) :
+    sauvegarder_modifications_neon les remplace par les id que renvoie l'INSERT.
+    """
+    plus_bas = min(int(df_base.index.min()), 0) if not df_base.empty else 0
+    return list(range(plus_bas - 1, plus_bas - 1 - nb, -1))
+
+
+def remplacer_ids(df, correspondance):
+    """Réindexe df sur place : {id provisoire: id définitif} (colonne id comprise)."""
+    if not correspondance:
+        return
+    index = df.index.to_numpy().copy()
+    index[df.index.get_indexer(list(correspondance))] = list(correspondance.values())
+    df.index = pd.Index(index, dtype='int64')
+    if 'id' in df.columns:
+        df['id'] = index
+
+
+# --- SUIVI DES MODIFICATIONS (SAUVEGARDE DELTA) ---
+# On garde une empreinte de chaque ligne (indexée par son id) telle qu'elle a été chargée ou sauvegardée.
+# À la sauvegarde, seules les lignes nouvelles, modifiées ou disparues partent vers Neon.
+COLONNES_SUIVIES = ['date', 'nom', 'montant', 'categorie', 'compte', 'mois', 'année']
+
+
+def _forme_canonique_transactions(df):
+    """Vue normalisée des colonnes suivies : un simple changement de format (date en texte, 12 vs 12.0) n'est pas une modification."""
+    canon = pd.DataFrame(index=df.index)
+    canon['date'] = pd.to_datetime(df['date'], dayfirst=True, errors='coerce').dt.normalize()
+    canon['nom'] = df['nom'].astype(str).str.strip()
+    canon['montant'] = pd.to_numeric(df['montant'], errors='coerce').round(2)
+    for col in ['categorie', 'compte', 'mois']:
+        canon[col] = df[col].astype(str) if col in df.columns else ""
+    canon['année'] = pd.to_numeric(df['année'], errors='coerce').astype('Int64').astype(str) if 'année' in df.columns else ""
+    return canon
 
-        df_to_save = nouveau_df.copy()
-        df_to_save["utilisateur"] = str(u_final).strip()
-        
-        # SÉCURITÉ : On s'assure que les dates sont JUSTE des dates (pas d'heures cachées)
-        df_to_save['date'] = pd.to_datetime(df_to_save['date'], dayfirst=True, errors='coerce').dt.date
-        df_to_save = df_to_save.dropna(subset=['date'])
 
-        # SÉCURITÉ : On nettoie les espaces dans les noms (souvent cause de faux doublons)
-        df_to_save['nom'] = df_to_save['nom'].astype(str).str.strip()
+def prendre_instantane_transactions(df):
+    """Mémorise l'état 'tel que dans Neon' de df : c'est la base de comparaison du prochain delta."""
+    st.session_state.df_reference = pd.util.hash_pandas_object(_forme_canonique_transactions(df), index=False)
+    st.session_state.modifs_en_attente = False
 
-        for col in ['nom', 'categorie', 'compte', 'mois']:
-            if col in df_to_save.columns:
-                df_to_save[col] = df_to_save[col].fillna("Inconnu")
+
+def completer_instantane_transactions(df_nouvelles):
+    """Ajoute à l'instantané des lignes qui viennent d'être écrites dans Neon, sans re-hacher tout l'historique."""
+    empreintes = pd.util.hash_pandas_object(_forme_canonique_transactions(df_nouvelles), index=False)
+    reference = st.session_state.get("df_reference")
+    st.session_state.df_reference = pd.concat([reference, empreintes]) if reference is not None else empreintes
+
+
+def calculer_delta_transactions(df, reference):
+    """
+    Compare df à l'instantané (lignes appariées par id).
+    Renvoie (lignes à insérer, lignes à mettre à jour, ids à supprimer).
+    """
+    if reference is None:
+        return df, df.iloc[0:0], []
+
+    empreintes = pd.util.hash_pandas_object(_forme_canonique_transactions(df), index=False)
+
+    communs = empreintes.index.intersection(reference.index)
+    nouvelles = empreintes.index.difference(reference.index)
+    modifiees = communs[empreintes.loc[communs].values != reference.loc[communs].values]
+    disparues = reference.index.difference(empreintes.index)
+
+    return df.loc[nouvelles], df.loc[modifiees], [int(i) for i in disparues]
+
+
+def ajouter_transactions(df_base, df_nouvelles):
+    """Concatène en donnant aux nouvelles lignes un id provisoire (l'index du DataFrame est l'id), sans aller-retour vers Neon."""
+    df_nouvelles = df_nouvelles.copy()
+    ids = ids_provisoires(df_base, len(df_nouvelles))
+    df_nouvelles.index = pd.Index(ids, dtype='int64')
+    df_nouvelles['id'] = ids
+    return concat_transactions(df_base, df_nouvelles)
+
+
+def sauvegarder_modifications_neon(df, user=None):
+    """
+    Persiste uniquement la différence entre df et le dernier instantané, dans une seule transaction
+    (au plus un DELETE, un UPDATE et un INSERT, tous par id).
+    En cas de succès, les lignes insérées prennent dans df leur id définitif et df devient le nouvel instantané.
+    Renvoie le bilan ou False.
+    """
+    try:
+        u_final = user or st.session_state.get("user")
+        if not u_final:
+            st.error("❌ Utilisateur non détecté.")
+            return False
+
+        a_inserer, a_modifier, ids_a_supprimer = calculer_delta_transactions(df, st.session_state.get("df_reference"))
 
         with engine.begin() as conn_sql:
-            for _, row in df_to_save.iterrows():
-                query = text("""
-                    INSERT INTO transactions (date, nom, montant, categorie, compte, utilisateur, mois, année)
-                    VALUES (:date, :nom, :montant, :categorie, :compte, :utilisateur, :mois, :année)
-                    ON CONFLICT (date, nom, montant, utilisateur)
-                    DO UPDATE SET
-                        categorie = EXCLUDED.categorie,
-                        mois = EXCLUDED.mois,
-                        compte = EXCLUDED.compte,
-                        année = EXCLUDED.année
-                """)
-                conn_sql.execute(query, row.to_dict())
-        return True
+            if ids_a_supprimer:
+                conn_sql.execute(
+                    text("DELETE FROM transactions WHERE utilisateur = :utilisateur AND id = ANY(:ids)"),
+                    {"utilisateur": str(u_final).strip(), "ids": ids_a_supprimer}
+                )
+            ids_inseres = _inserer_transactions(conn_sql, _preparer_lot_transactions(a_inserer), u_final)
+            nb_modifiees = _maj_transactions_par_id(conn_sql, _preparer_lot_transactions(a_modifier), u_final)
+
+        remplacer_ids(df, ids_inseres)
+        prendre_instantane_transactions(df)
+        invalider_donnees(u_final, "transactions")
+        return {"inserees": len(ids_inseres), "modifiees": nb_modifiees, "supprimees": len(ids_a_supprimer)}
     except Exception as e:
         st.error(f"Erreur de sauvegarde Neon : {e}")
         return False
 
 
-@st.cache_data(ttl=1800)
-def charger_previsions_neon():
-    if "user" not in st.session_state or not st.session_state["user"]:
+# --- TYPES DES COLONNES (FORME CANONIQUE) ---
+# st.session_state.df est typé une fois, au chargement (et pour chaque lot de lignes ajoutées) :
+# date en datetime64, montant en float, année en entier, compte/categorie/mois en Categorical.
+# Les écrans le lisent tel quel : pas de re-conversion des dates ni de copie défensive à chaque rerun.
+# compte_cle est la clé canonique du compte (sans espaces, en majuscules), calculée une fois.
+COLONNES_CATEGORIELLES = ['compte', 'categorie', 'mois']
+
+
+def normaliser_colonnes_transactions(df):
+    """Met df sous sa forme canonique (types ci-dessus, compte_cle). Modifie df et le renvoie."""
+    if df.empty:
+        return df
+    if 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['date'], dayfirst=True, errors='coerce')
+    if 'montant' in df.columns:
+        df['montant'] = pd.to_numeric(df['montant'], errors='coerce').astype(float)
+    if 'date' in df.columns:
+        # L'année suit la date quand elle manque ; entière (reste en float seulement si date et année sont toutes deux absentes)
+        annees = pd.to_numeric(df['année'], errors='coerce') if 'année' in df.columns else pd.Series(float('nan'), index=df.index)
+        annees = annees.fillna(df['date'].dt.year)
+        df['année'] = annees.astype('int64') if annees.notna().all() else annees.astype(float)
+    for col in ['compte', 'categorie']:
+        if col in df.columns:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str).str.strip()).astype('category')
+    if 'mois' in df.columns:
+        # Une valeur hors calendrier est conservée, rangée après Décembre
+        autres = sorted(set(df['mois'].dropna().astype(str)) - set(nomS_mois))
+        df['mois'] = df['mois'].astype(pd.CategoricalDtype(nomS_mois + autres, ordered=True))
+    if 'compte' in df.columns:
+        # map() sur un Categorical ne travaille que sur les catégories
+        df['compte_cle'] = df['compte'].map({c: c.upper() for c in df['compte'].cat.categories}).astype('category')
+    return df
+
+
+def cle_compte(df):
+    """Clé canonique du compte pour chaque ligne : compte_cle si elle est posée partout, sinon calculée."""
+    if 'compte_cle' in df.columns and df['compte_cle'].notna().all():
+        return df['compte_cle']
+    return df['compte'].astype(str).str.strip().str.upper()
+
+
+def affecter_valeur(df, index, colonne, valeur):
+    """df.loc[index, colonne] = valeur, en ajoutant d'abord la valeur aux catégories si la colonne est catégorielle."""
+    if isinstance(df[colonne].dtype, pd.CategoricalDtype) and pd.notna(valeur) and valeur not in df[colonne].cat.categories:
+        df[colonne] = df[colonne].cat.add_categories([valeur])
+    df.loc[index, colonne] = valeur
+
+
+def concat_transactions(df_base, df_nouvelles):
+    """pd.concat qui garde les colonnes catégorielles (catégories réunies) au lieu de retomber en object."""
+    df_nouvelles = normaliser_colonnes_transactions(df_nouvelles)
+    if df_base.empty:
+        return df_nouvelles
+    for col in COLONNES_CATEGORIELLES + ['compte_cle']:
+        if col in df_base.columns and col in df_nouvelles.columns and isinstance(df_base[col].dtype, pd.CategoricalDtype):
+            manquantes = [c for c in df_nouvelles[col].cat.categories if c not in df_base[col].cat.categories]
+            if manquantes:
+                df_base[col] = df_base[col].cat.add_categories(manquantes)
+            df_nouvelles[col] = df_nouvelles[col].astype(df_base[col].dtype)
+    return pd.concat([df_base, df_nouvelles])
+
+
+# --- AGRÉGATS MENSUELS (TABLEAU DE BORD) ---
+# Même forme que la table agregats_mensuels (COLONNES_AGREGATS) ; les réductions pures sont dans analyses.py.
+# Ce que la table évite, c'est le groupby sur toutes les lignes à chaque rerun du tableau de bord, pas leur chargement :
+# l'historique complet reste lu une fois à la connexion (charger_donnees), car l'éditeur de Gérer, la sauvegarde delta,
+# les soldes d'ouverture, l'évolution des comptes et l'index des suggestions travaillent sur les lignes elles-mêmes.
+@cache_utilisateur("transactions", ttl=1800, max_entries=32)
+def charger_agregats_mensuels(user):
+    """Lit les totaux mensuels de l'utilisateur (rechargés à chaque écriture de transactions). None en cas d'erreur."""
+    try:
+        with engine.connect() as conn_sql:
+            agregats = pd.read_sql(
+                text("SELECT compte, annee, mois, categorie, sens, total, nb FROM agregats_mensuels WHERE utilisateur = :u"),
+                conn_sql, params={"u": str(user).strip()}
+            )
+        agregats['total'] = agregats['total'].astype(float)
+        return agregats
+    except Exception as e:
+        st.error(f"Erreur SQL lors du chargement des agrégats : {e}")
+        return None
+
+
+def agregats_tableau_de_bord():
+    """
+    Totaux mensuels pour les analyses : lus dans Neon tant que la session n'a pas de modification
+    non sauvegardée, sinon recalculés depuis st.session_state.df (pour refléter l'écran).
+    """
+    user = st.session_state.get("user")
+    if user and not st.session_state.get("modifs_en_attente"):
+        agregats = charger_agregats_mensuels(user)
+        if agregats is not None:
+            return agregats
+    return agregats_mensuels_depuis_df(st.session_state.df)
+
+
+def transactions_filtrees(df, comptes=None, annee=None, mois=None, tri="date", descendant=True):
+    """
+    Sous-ensemble trié de df (le df de session) pour ces filtres, calculé en mémoire : la session a déjà tout
+    l'historique, le relire dans Neon coûterait un aller-retour par combinaison de filtres.
+    Les comptes sont comparés par leur clé canonique (sans espaces, en majuscules), comme partout ailleurs.
+    """
+    if comptes is not None or annee is not None or mois is not None:
+        masque = pd.Series(True, index=df.index)
+        if comptes is not None:
+            masque &= cle_compte(df).isin([str(c).strip().upper() for c in comptes])
+        if annee is not None:
+            masque &= df['année'] == annee
+        if mois is not None:
+            masque &= df['mois'] == mois
+        df = df[masque]
+    return df.sort_values(by=tri, ascending=not descendant, kind='stable')
+
+
+# --- PAGINATION DE L'ÉDITEUR ---
+# Seule la page visible est construite (une ligne = colonnes + 2 selectbox + 2 boutons) :
+# le nombre de widgets par rerun est borné par la taille de page, pas par l'historique.
+# Tri et découpage se font sur le df de session, déjà chargé : aucune requête par page.
+TAILLES_PAGE_EDITEUR = [25, 50, 100, 200]
+
+
+def page_editeur(df, signature):
+    """
+    Tranche de df pour la page courante (curseur dans st.session_state.page_editeur).
+    signature décrit filtres + tri : si elle change, on revient à la première page.
+    Renvoie (tranche, numéro de page, nombre de pages).
+    """
+    taille = st.session_state.get("taille_page_editeur", TAILLES_PAGE_EDITEUR[1])
+    nb_pages = max(1, -(-len(df) // taille))
+    if st.session_state.get("signature_editeur") != signature:
+        st.session_state.signature_editeur = signature
+        st.session_state.page_editeur = 0
+    page = min(max(st.session_state.get("page_editeur", 0), 0), nb_pages - 1)
+    st.session_state.page_editeur = page
+    return df.iloc[page * taille:(page + 1) * taille].copy(), page, nb_pages
+
+
+def changer_page_editeur(pas):
+    st.session_state.page_editeur = st.session_state.get("page_editeur", 0) + pas
+
+
+# --- ÉDITION EN MASSE (GRILLE) ---
+# Alternative à l'éditeur ligne par ligne : un seul st.data_editor pour toute la sélection.
+# À la sauvegarde on ne relit que son diff (edited_rows), pas un widget par transaction.
+MODES_EDITEUR = ["📝 Ligne par ligne", "▦ Grille"]
+COLONNES_GRILLE = ['date', 'nom', 'compte', 'montant', 'categorie', 'mois']
+COLONNES_GRILLE_MODIFIABLES = ['categorie', 'mois']
+
+
+def grille_editeur(df):
+    """Vue de df pour st.data_editor : colonnes affichées, catégoriels en texte (les options des SelectboxColumn sont des str)."""
+    grille = df[COLONNES_GRILLE].copy()
+    for col in ['compte', 'categorie', 'mois']:
+        grille[col] = grille[col].astype(object).where(grille[col].notna(), None)
+    return grille
+
+
+def modifications_grille(etat, index):
+    """
+    edited_rows de st.data_editor ({position de ligne: {colonne: valeur}}) -> {id: {colonne: valeur}}.
+    index est celui des données passées à la grille ; seules les colonnes modifiables sont gardées.
+    """
+    modifs = {}
+    for position, valeurs in (etat or {}).get("edited_rows", {}).items():
+        valeurs = {c: v for c, v in valeurs.items() if c in COLONNES_GRILLE_MODIFIABLES and v is not None}
+        if valeurs and int(position) < len(index):
+            modifs[index[int(position)]] = valeurs
+    return modifs
+
+
+def appliquer_modifications_grille(df, modifs, apprendre=False):
+    """
+    Reporte les modifications de la grille dans df (le df de session), sur place.
+    Avec apprendre, une catégorie changée s'applique à toutes les opérations du même nom.
+    Renvoie les règles à mémoriser [(nom, catégorie)].
+    """
+    regles = []
+    for idx, valeurs in modifs.items():
+        if idx not in df.index:
+            continue
+        if 'mois' in valeurs:
+            affecter_valeur(df, idx, 'mois', valeurs['mois'])
+        cat = valeurs.get('categorie')
+        if cat is None or str(cat) == str(df.at[idx, 'categorie']):
+            continue
+        nom_op = df.at[idx, 'nom']
+        index_suggestions().mettre_a_jour(nom_op, cat)
+        if apprendre:
+            regles.append((nom_op, cat))
+            affecter_valeur(df, df['nom'] == nom_op, 'categorie', cat)
+        else:
+            affecter_valeur(df, idx, 'categorie', cat)
+    return regles
+
+
+def filtrer_agregats(agregats, annee, comptes=None):
+    """Ne garde qu'une année et, si fourni, une liste de comptes (comparaison sans casse ni espaces)."""
+    masque = agregats['annee'] == int(annee)
+    if comptes is not None:
+        comptes_norm = [str(c).strip().upper() for c in comptes]
+        masque &= cle_compte(agregats).isin(comptes_norm)
+    return agregats[masque]
+
+
+@cache_utilisateur("previsions", ttl=1800)
+def charger_previsions_neon(user):
+    if not user:
         return pd.DataFrame(columns=["date", "nom", "montant", "categorie", "compte", "mois", "annee", "utilisateur"])
     try:
            
-        user = st.session_state["user"]
-        
         # On ne récupère que les prévisions de l'utilisateur actif
         query = text('SELECT * FROM previsions WHERE LOWER("utilisateur") = LOWER(:u)')
         
@@ -1066,6 +2117,7 @@ def sauvegarder_previsions_neon(df_prev, user):
             if not df_to_save.empty:
                 df_to_save.to_sql('previsions', conn_sql, if_exists='append', index=False)
         
+        invalider_donnees(user, "previsions")
         st.success("🔮 Prévisions synchronisées sur Neon !")
         return True
         
@@ -1074,83 +2126,234 @@ def sauvegarder_previsions_neon(df_prev, user):
         return False
 
 
-def simplifier_nom_definitif(nom):
-    """
-    Nettoie le libellé pour ne garder que l'essentiel.
-    Ex: 'ACHAT CB CARREFOUR 12345' -> 'CARREFOUR'
-    """
-    if not isinstance(nom, str): 
-        return str(nom)
-    
+# --- NORMALISATION DES LIBELLÉS ---
+# Expressions compilées une seule fois (et non à chaque libellé)
+MOTIF_REFERENCES = re.compile(r'(FAC|REF|NUM|ID|PRLV|VIREMENT|VIR)\s*[:.\-]?\s*[0-9A-Z]{3,}')
+MOTIF_DATES = re.compile(r'\d{2}[\./]\d{2}([\./]\d{2,4})?')
+MOTIF_SYMBOLES = re.compile(r'[\*\-\/#]')
+MOTIF_ESPACES = re.compile(r'\s+')
+MOTS_BANCAIRES = ["ACHAT CB", "ACHAT", "CB", "CARTE", "VERSEMENT", "CHEQUE", "SEPA", "PRÉLÈV"]
+
+
+@lru_cache(maxsize=65536)
+def _simplifier_libelle(nom):
     nom = nom.upper()
     
     # 1. Supprime les numéros de factures, de virements et IDs (Neon-Ready)
-    nom = re.sub(r'(FAC|REF|NUM|ID|PRLV|VIREMENT|VIR)\s*[:.\-]?\s*[0-9A-Z]{3,}', '', nom)
+    nom = MOTIF_REFERENCES.sub('', nom)
     
     # 2. Supprime les dates (ex: 12/01/24)
-    nom = re.sub(r'\d{2}[\./]\d{2}([\./]\d{2,4})?', '', nom)
+    nom = MOTIF_DATES.sub('', nom)
     
     # 3. Nettoyage des termes bancaires inutiles
-    mots_a_virer = ["ACHAT CB", "ACHAT", "CB", "CARTE", "VERSEMENT", "CHEQUE", "SEPA", "PRÉLÈV"]
-    for m in mots_a_virer:
+    for m in MOTS_BANCAIRES:
         nom = nom.replace(m, "")
     
     # 4. Nettoyage des caractères spéciaux et espaces superflus
     # On transforme les symboles en espaces puis on 're-join' pour supprimer les espaces doubles
-    nom_clean = ' '.join(re.sub(r'[\*\-\/#]', ' ', nom).split()).strip()
+    nom_clean = ' '.join(MOTIF_SYMBOLES.sub(' ', nom).split()).strip()
     
     return nom_clean or "AUTRE"
 
 
+def simplifier_nom_definitif(nom):
+    """
+    Nettoie le libellé pour ne garder que l'essentiel.
+    Ex: 'ACHAT CB CARREFOUR 12345' -> 'CARREFOUR'
+    Chaque libellé distinct n'est calculé qu'une fois (mémo LRU).
+    Une valeur manquante compte comme un libellé vide ('AUTRE'), comme dans simplifier_noms_series.
+    """
+    if not isinstance(nom, str):
+        nom = "" if pd.isna(nom) else str(nom)
+    return _simplifier_libelle(nom)
+
+
+def simplifier_noms_series(noms):
+    """
+    Version colonne de simplifier_nom_definitif (valeurs converties en texte, manquantes vides) : les mêmes
+    étapes appliquées par les méthodes .str de pandas, une seule fois par libellé distinct.
+    """
+    # Avant astype(str), qui écrirait NaN / None / <NA> en 'nan', 'None', '<NA>'
+    valeurs = noms.astype(object).where(noms.notna(), "").astype(str)
+    uniques = pd.Series(valeurs.unique(), dtype=object)
+    propres = uniques.str.upper()
+    propres = propres.str.replace(MOTIF_REFERENCES, '', regex=True)
+    propres = propres.str.replace(MOTIF_DATES, '', regex=True)
+    for m in MOTS_BANCAIRES:
+        propres = propres.str.replace(m, '', regex=False)
+    propres = propres.str.replace(MOTIF_SYMBOLES, ' ', regex=True).str.replace(MOTIF_ESPACES, ' ', regex=True).str.strip()
+    propres = propres.where(propres != "", "AUTRE")
+    return valeurs.map(dict(zip(uniques, propres)))
+
+
+def _compte_contrepartie(compte_source, cat, config):
+    """Compte (en majuscules) que le libellé d'un virement 🔄 désigne dans le même groupe, ou None."""
+    # On retrouve le groupe du compte source
+    nom_source_config = next((k for k in config.keys() if k.strip().upper() == compte_source), None)
+    if not nom_source_config:
+        return None
+    groupe_source = config[nom_source_config].get("Groupe")
+
+    for nom_dest_config, cfg_dest in config.items():
+        nom_dest_upper = str(nom_dest_config).strip().upper()
+
+        # Condition de groupe + Nom différent + Présent dans le texte
+        if cfg_dest.get("Groupe") == groupe_source and nom_dest_upper != compte_source:
+            mots = [m for m in nom_dest_upper.split() if len(m) > 2]
+            if mots and any(m in cat for m in mots):
+                return nom_dest_upper
+    return None
+
+
+# Deux jambes d'un même virement interne peuvent être passées à quelques jours d'écart
+FENETRE_APPARIEMENT_JOURS = 5
+
+
+@st.cache_data(max_entries=20)
+def _paires_virements(virements, config):
+    """
+    virements : lignes 🔄 (date, compte, montant, categorie), index 0..n-1.
+    Renvoie pour chacune le compte de contrepartie désigné et si l'autre jambe a été trouvée.
+    """
+    v = pd.DataFrame({
+        'date': pd.to_datetime(virements['date'], dayfirst=True, errors='coerce'),
+        'compte': virements['compte'].astype(str).str.strip().str.upper(),
+        'montant': pd.to_numeric(virements['montant'], errors='coerce').fillna(0.0),
+        'cat': virements['categorie'].astype(str).str.upper(),
+    })
+
+    # Le compte de destination ne dépend que du couple (compte, libellé de catégorie) : résolu une fois par couple
+    couples = v[['compte', 'cat']].drop_duplicates()
+    couples['cpte_contrepartie'] = [_compte_contrepartie(c, cat, config) for c, cat in zip(couples['compte'], couples['cat'])]
+    v = v.merge(couples, on=['compte', 'cat'], how='left')
+
+    # Candidats : une jambe sur le compte désigné, de montant opposé, dans la fenêtre de dates
+    jambes_a = v[v['cpte_contrepartie'].notna()].reset_index().rename(columns={'index': 'id_a'})
+    jambes_b = v[['compte', 'date', 'montant']].reset_index().rename(columns={'index': 'id_b', 'compte': 'cpte_contrepartie'})
+    candidats = jambes_a.merge(jambes_b, on='cpte_contrepartie', suffixes=('', '_b'))
+    candidats['ecart'] = (candidats['date'] - candidats['date_b']).abs()
+    candidats = candidats[
+        ((candidats['montant'] + candidats['montant_b']).abs() < 0.1) &
+        (candidats['ecart'] <= pd.Timedelta(days=FENETRE_APPARIEMENT_JOURS))
+    ].sort_values('ecart')
+
+    # Appariement un pour un, les dates les plus proches d'abord
+    apparies = set()
+    for id_a, id_b in zip(candidats['id_a'], candidats['id_b']):
+        if id_a not in apparies and id_b not in apparies:
+            apparies.update((id_a, id_b))
+
+    v['paire_trouvee'] = v.index.isin(apparies)
+    return v[['cpte_contrepartie', 'paire_trouvee']]
+
+
+def apparier_virements(df, config=None):
+    """
+    Colonnes d'appariement des virements internes, alignées sur df :
+    cpte_contrepartie (compte désigné par le libellé, en majuscules) et paire_trouvee
+    (l'autre jambe existe déjà). Une ligne 🔄 non appariée doit être simulée sur cpte_contrepartie.
+    """
+    config = st.session_state.get('config_groupes', {}) if config is None else config
+    resultat = pd.DataFrame({'cpte_contrepartie': None, 'paire_trouvee': False}, index=df.index)
+    if df.empty or not config:
+        return resultat
+
+    est_virement = df['categorie'].astype(str).str.contains("🔄", regex=False).to_numpy()
+    if est_virement.any():
+        # Seules les lignes 🔄 passent dans le cache : clé légère, recalcul seulement si elles changent
+        virements = df.loc[est_virement, ['date', 'compte', 'montant', 'categorie']].reset_index(drop=True)
+        paires = _paires_virements(virements, config)
+        resultat.loc[est_virement, 'cpte_contrepartie'] = paires['cpte_contrepartie'].to_numpy()
+        resultat.loc[est_virement, 'paire_trouvee'] = paires['paire_trouvee'].to_numpy()
+    return resultat
+
+
+@profile()
 def calculer_evolution_comptes(df_transactions, soldes_initiaux, noms_mois):
-    # Initialisation
-    evolution = {str(k).strip().upper(): [] for k in soldes_initiaux.keys()}
-    soldes_courants = {str(k).strip().upper(): float(v) for k, v in soldes_initiaux.items()}
-    config = st.session_state.get('config_groupes', {})
-
-    for mois in noms_mois:
-        df_mois = df_transactions[df_transactions['mois'] == mois]
-        virements_reels = df_mois[df_mois['categorie'].str.contains("🔄", na=False)]
-
-        for _, ligne in df_mois.iterrows():
-            montant = float(ligne.get('montant', 0))
-            compte_source = str(ligne.get('compte', '')).strip().upper()
-            cat = str(ligne.get('categorie', '')).upper()
-
-            # 1. Action sur le compte réel
-            if compte_source in soldes_courants:
-                soldes_courants[compte_source] += montant
-            
-            # 2. Simulation de la contrepartie (Logique restaurée)
-            if "🔄" in cat:
-                # On retrouve le groupe du compte source
-                nom_source_config = next((k for k in config.keys() if k.strip().upper() == compte_source), None)
-                if nom_source_config:
-                    groupe_source = config[nom_source_config].get("Groupe")
-                    
-                    for nom_dest_config, cfg_dest in config.items():
-                        nom_dest_upper = str(nom_dest_config).strip().upper()
-                        
-                        # Condition de groupe + Nom différent + Présent dans le texte
-                        if cfg_dest.get("Groupe") == groupe_source and nom_dest_upper != compte_source:
-                            mots = [m for m in nom_dest_upper.split() if len(m) > 2]
-                            if mots and any(m in cat for m in mots):
-                                
-                                # Anti-doublon
-                                deja_present = not virements_reels[
-                                    (virements_reels['compte'].str.upper() == nom_dest_upper) & 
-                                    (abs(virements_reels['montant'] - (-montant)) < 0.1)
-                                ].empty
-                                
-                                if not deja_present and nom_dest_upper in soldes_courants:
-                                    soldes_courants[nom_dest_upper] += (-montant)
-                                break
-        
-        # Enregistrement mensuel
-        for c in soldes_courants:
-            evolution[c].append(soldes_courants[c])
-            
-    return evolution
+    """
+    Solde de chaque compte à la fin de chaque mois de noms_mois : {COMPTE: [soldes]}.
+    Calcul vectoriel : somme par (compte, mois) puis cumul, contreparties des virements 🔄 non appariés comprises.
+    """
+    soldes_depart = {str(k).strip().upper(): float(v) for k, v in soldes_initiaux.items()}
+
+    df = df_transactions[df_transactions['mois'].isin(noms_mois)] if not df_transactions.empty else df_transactions
+    if df.empty:
+        return {c: [s] * len(noms_mois) for c, s in soldes_depart.items()}
+
+    mouvements = pd.DataFrame({
+        'compte': cle_compte(df).astype(str),
+        'mois': df['mois'],
+        'montant': pd.to_numeric(df['montant'], errors='coerce').fillna(0.0),
+    })
+
+    # 1. Action sur le compte réel
+    flux = [mouvements]
+
+    # 2. Contrepartie simulée des virements internes dont l'autre jambe est absente
+    paires = apparier_virements(df)
+    a_simuler = (paires['cpte_contrepartie'].notna() & ~paires['paire_trouvee'] & paires['cpte_contrepartie'].isin(soldes_depart.keys())).to_numpy()
+    if a_simuler.any():
+        flux.append(pd.DataFrame({
+            'compte': paires.loc[a_simuler, 'cpte_contrepartie'],
+            'mois': mouvements.loc[a_simuler, 'mois'],
+            'montant': -mouvements.loc[a_simuler, 'montant'],
+        }))
+
+    # 3. Cumul mois par mois, dans l'ordre de noms_mois
+    variations = (
+        pd.concat(flux)
+        .groupby(['compte', 'mois'], observed=True)['montant'].sum()
+        .unstack('mois')
+        .reindex(index=list(soldes_depart.keys()), columns=noms_mois)
+        .fillna(0.0)
+        .cumsum(axis=1)
+    )
+    return {c: (variations.loc[c] + s).tolist() for c, s in soldes_depart.items()}
+
+
+# --- SOLDES D'OUVERTURE (1ER JANVIER) ---
+def _table_mouvements_anterieurs(df):
+    """Par compte (en majuscules) et par année Y : somme des mouvements datés d'avant le 1er janvier Y."""
+    annees = pd.to_numeric(df['année'], errors='coerce') if 'année' in df.columns else pd.Series(dtype=float)
+    if df.empty or annees.dropna().empty:
+        return pd.DataFrame()
+    montants = pd.to_numeric(df['montant'], errors='coerce').fillna(0.0)
+    comptes = cle_compte(df)
+
+    par_annee = montants.groupby([comptes, annees], observed=True).sum().unstack(fill_value=0.0)
+    # Une colonne par année, de la première à la dernière + 1 (= tout l'historique)
+    par_annee = par_annee.reindex(columns=range(int(annees.min()), int(annees.max()) + 2), fill_value=0.0)
+    return par_annee.cumsum(axis=1).shift(1, axis=1).fillna(0.0)
+
+
+def empreinte_mouvements(df):
+    """Empreinte de (compte, année, montant) sur toutes les lignes : change dès qu'une modification touche un solde."""
+    colonnes = pd.DataFrame({'compte': cle_compte(df), 'année': df['année'], 'montant': df['montant']})
+    return int(pd.util.hash_pandas_object(colonnes, index=False).to_numpy().sum())
+
+
+def mouvements_avant_annee(df, jeu, annee):
+    """
+    {COMPTE: mouvements cumulés avant le 1er janvier de annee} pour le jeu 'transactions' ou 'previsions'.
+    La table est calculée une fois par session et par version du jeu : changer d'année ou de profil n'est qu'une lecture.
+    Avec des modifications non sauvegardées (même nombre de lignes), la clé prend aussi l'empreinte des mouvements.
+    """
+    user = st.session_state.get("user")
+    en_attente = jeu == "transactions" and st.session_state.get("modifs_en_attente") and not df.empty
+    cle = (jeu, version_donnees(user, jeu), len(df), empreinte_mouvements(df) if en_attente else None)
+    if "cache_soldes_ouverture" not in st.session_state:
+        st.session_state.cache_soldes_ouverture = {}
+    cache = st.session_state.cache_soldes_ouverture
+    if cle not in cache:
+        # On ne garde que la dernière table de chaque jeu
+        for ancienne in [c for c in cache if c[0] == jeu]:
+            del cache[ancienne]
+        cache[cle] = _table_mouvements_anterieurs(df)
+
+    table = cache[cle]
+    if table.empty or int(annee) <= table.columns.min():
+        return {}
+    return table[min(int(annee), table.columns.max())].to_dict()
 
 
 
@@ -1274,9 +2477,8 @@ else:
 
     # Si le compte actuel est différent du dernier compte enregistré dans cette session
     if st.session_state.last_logged_user != current_user:
-        st.cache_data.clear()  # ON VIDE TOUT LE CACHE GLOBAL
         # On supprime les variables de données pour forcer le rechargement
-        for key in ['df', 'config_groupes', 'df_f']:
+        for key in ['df', 'df_reference', 'df_prev', 'index_suggestions', 'cache_soldes_ouverture', 'config_groupes', 'df_f']:
             if key in st.session_state:
                 del st.session_state[key]
         st.session_state.last_logged_user = current_user
@@ -1291,7 +2493,6 @@ else:
 
         # Si après l'appel, le statut est tombé à None, on nettoie TOUT
         if st.session_state.get("authentication_status") is None:
-            st.cache_data.clear()
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             relancer_avec_succes()
@@ -1299,7 +2500,6 @@ else:
         # --- ASTUCE : ON VERIFIE SI L'AUTHENTIFICATION VIENT DE TOMBER ---
         if st.session_state.get("authentication_status") is None:
             # On vide tout avant de repartir
-            st.cache_data.clear()
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             relancer_avec_succes()
@@ -1350,6 +2550,8 @@ if st.session_state.get("authentication_status"):
         if st.session_state.df.empty:
             data = charger_donnees(user_actuel) 
             st.session_state.df = data if data is not None else pd.DataFrame()
+            if not st.session_state.df.empty:
+                prendre_instantane_transactions(st.session_state.df)
         
         # 3. Chargement de la configuration des groupeS
         if not st.session_state.config_groupes:
@@ -1365,10 +2567,7 @@ if st.session_state.get("authentication_status"):
             else:
                 st.session_state.groupes_liste = ["Personnel"]
 
-        # 5. Bloc-notes et Mémoire (Migration Neon)
-        if 'memoire' not in st.session_state:
-            st.session_state.memoire = charger_memoire_neon(user_actuel)
-
+        # 5. Bloc-notes (la mémoire des catégories est lue à la demande : charger_memoire_neon)
         if "bloc_notes_content" not in st.session_state:
             st.session_state.bloc_notes_content = charger_notes_neon(user_actuel)
         
@@ -1396,20 +2595,15 @@ if st.session_state.get("authentication_status"):
     # Récupération de la couleur de fond (vos préférences sauvegardées)
     bg_color_saved = st.session_state.get('page_bg_color', "#0e1117")
 
-    df_h = st.session_state.df.copy()
-   # 1. On sécurise le DataFrame
-    df_h.columns = [c.strip().lower() for c in df_h.columns]
+    # Le df de session est déjà sous forme canonique (colonnes en minuscules, types fixés au chargement) : simple référence
+    df_h = st.session_state.df
 
-    # 2. On s'assure que cps est bien une liste (pour .isin)
+    # On s'assure que cps est bien une liste (pour .isin)
     if not isinstance(cps, list):
         cps = [cps]
 
-    # 3. Maintenant, la ligne 1731 ne peut plus rater 'compte'
-    if "compte" in df_h.columns:
-        df_temp_filtre = df_h[df_h["compte"].isin(cps)]
-    else:
+    if not df_h.empty and "compte" not in df_h.columns:
         st.error(f"La colonne 'compte' est absente. Colonnes réelles : {list(df_h.columns)}")
-        df_temp_filtre = pd.DataFrame()
 
     # --- 5. SIDEBAR ---
     with st.sidebar:
@@ -1596,27 +2790,17 @@ if st.session_state.get("authentication_status"):
 
 
 
+    # Section fermée par afficher_profil_rerun(), en fin de script
+    ouvrir_section(f"onglet {selected}")
+    entrer_onglet_sql(selected)
+
     if selected == "Analyses":
             # --- INITIALISATION DE LA PERSISTENCE ---
             if "filtre_profil_index" not in st.session_state:
                 st.session_state.filtre_profil_index = 0  # Par défaut : "Tous"
-            # --- PRÉPARATION DES DONNÉES ---
-            if st.session_state.df.empty:
-                df_h = pd.DataFrame(columns=["date", "nom", "montant", "categorie", "compte", "mois", "année"])
-                liste_annees = [pd.Timestamp.now().year]
-            else:
-                df_h = st.session_state.df.copy()
-                # Sécurité conversion date
-                df_h["date"] = pd.to_datetime(df_h["date"], dayfirst=True, errors='coerce')
-                if "année" not in df_h.columns:
-                    df_h["année"] = df_h["date"].dt.year
-                
-                # On s'assure que les années sont bien des entiers uniques
-                df_h["année"] = pd.to_numeric(df_h["année"], errors='coerce')
-                annees_brutes = df_h['année'].dropna().unique()
-                liste_annees = sorted([int(a) for a in annees_brutes], reverse=True)
 
             @st.fragment
+            @profile_fragment()
             def afficher_dashboard():
                 # --- 1. CONFIGURATION DE BASE ---
                 noms_mois_list = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin", 
@@ -1664,16 +2848,12 @@ if st.session_state.get("authentication_status"):
                     obj = sum([v.get("Objectif", 0.0) for _, v in st.session_state.config_groupes.items() 
                             if str(v.get("Groupe", "")).strip().lower() == profil_recherche])
                     
-                    # 3. On FILTRE le DataFrame pour ce profil uniquement
-                    if not st.session_state.df.empty:
-                        df_h = st.session_state.df.copy()
-                        # Normalisation pour le filtrage
+                    # 3. On FILTRE le DataFrame pour ce profil uniquement (le df de session est déjà typé : lecture seule)
+                    df_h = st.session_state.df
+                    if not df_h.empty:
+                        # Filtrage sur la clé canonique du compte (codes catégoriels)
                         cps_norm = [str(c).strip().upper() for c in cps]
-                        df_h["temp_compte"] = df_h["compte"].astype(str).str.strip().str.upper()
-                        df_h = df_h[df_h["temp_compte"].isin(cps_norm)].copy()
-                        df_h = df_h.drop(columns=["temp_compte"])
-                    else:
-                        df_h = st.session_state.df.copy()
+                        df_h = df_h[cle_compte(df_h).isin(cps_norm)]
 
                 else:
                     # --- CAS Tous ---
@@ -1682,21 +2862,15 @@ if st.session_state.get("authentication_status"):
                     
                     # --- CAS Tous ---
                     cps = list(st.session_state.config_groupes.keys())
-                    # FORCE l'utilisation du DF original sans aucune transformation préalable
-                    df_h = st.session_state.df.copy() 
-                    
-                    # On force la config de départ en MAJUSCULES
-                    soldes_depart = {str(k).upper(): v.get("Solde", 0.0) for k, v in st.session_state.config_groupes.items()}
-                    
-                    # On recalcule TOUT à partir de zéro
-                    soldes_finaux = calculer_evolution_comptes(df_h, soldes_depart, noms_mois_list)
+                    # Le DF original, sans copie : il n'est que lu (soldes recalculés plus bas)
+                    df_h = st.session_state.df
 
 
 
                 # --- 4. HARMONISATION ET SÉLECTEUR D'ANNÉE ---
                 if not df_h.empty:
                     col_trouvee = next((c for c in df_h.columns if c.lower() in ['categorie', 'catégorie']), None)
-                    if col_trouvee:
+                    if col_trouvee and col_trouvee != 'categorie':
                         df_h = df_h.rename(columns={col_trouvee: 'categorie'})
                 
                 # On définit les années AVANT de calculer les soldes de départ
@@ -1716,16 +2890,13 @@ if st.session_state.get("authentication_status"):
 
 
                 # --- 4. CALCUL DES SOLDES AU 1ER JANVIER (L'étape qui manquait) ---
+                # Mouvements cumulés AVANT l'année choisie (table précalculée, une simple lecture)
+                mouvements_anterieurs = mouvements_avant_annee(st.session_state.df, "transactions", annee_choisie)
                 soldes_depart = {}
                 for c in cps:
                     nom_c = str(c).strip()
                     s_init = st.session_state.config_groupes.get(nom_c, {}).get("Solde", 0.0)
-                    # Mouvements cumulés AVANT l'année choisie
-                    mouv_prec = st.session_state.df[
-                        (st.session_state.df['compte'].astype(str).str.upper() == nom_c.upper()) & 
-                        (st.session_state.df['année'] < annee_choisie)
-                    ]['montant'].sum()
-                    soldes_depart[nom_c] = s_init + mouv_prec
+                    soldes_depart[nom_c] = s_init + mouvements_anterieurs.get(nom_c.upper(), 0.0)
 
 
                 # --- 6. CALCULS NEON (Virements simulés & Historique) ---
@@ -1735,7 +2906,12 @@ if st.session_state.get("authentication_status"):
                 solde_global = sum(soldes_finaux.values())
 
                 # --- 7. PRÉPARATION DES DONNÉES DE L'ANNÉE ---
-                df_dash = df_h[df_h["année"] == annee_choisie].copy()
+                df_dash = df_h[df_h["année"] == annee_choisie]
+                # Totaux mensuels précalculés (Neon) pour les récapitulatifs : pas de groupby sur les lignes brutes
+                agregats_annee = filtrer_agregats(
+                    agregats_tableau_de_bord(), annee_choisie,
+                    cps if choix_actuel != "Tous" else None
+                )
 
                 # Initialisation par défaut pour éviter les NameError
                 categories_dispo = []
@@ -1758,7 +2934,7 @@ if st.session_state.get("authentication_status"):
                     ])
 
                 # Sélecteur de mois (maintenant sécurisé)
-                liste_m = sorted(df_dash['mois'].unique(), key=lambda x: noms_mois_list.index(x) if x in noms_mois_list else 0) if not df_dash.empty else []
+                liste_m = trier_mois(df_dash['mois']) if not df_dash.empty else []
 
                 with cols_filtres[2]:
                     mois_choisi = st.pills(
@@ -1782,16 +2958,8 @@ if st.session_state.get("authentication_status"):
                     df_tab[nom_original] = liste_valeurs
 
                 # Calcul Revenus / Dépenses (sans virements)
-                df_flux_annuel = df_dash[~df_dash["categorie"].isin(virements_techniques)].copy()
-                if not df_flux_annuel.empty:
-                    df_ann = df_flux_annuel.groupby('mois').agg(
-                        Revenus=('montant', lambda x: x[x > 0].sum()),
-                        Dépenses=('montant', lambda x: abs(x[x < 0].sum()))
-                    ).reset_index()
-                    df_tab = pd.merge(df_tab, df_ann, on='mois', how='left').fillna(0)
-                else:
-                    df_tab['Revenus'] = 0.0
-                    df_tab['Dépenses'] = 0.0
+                df_ann = flux_mensuels(agregats_annee, virements_techniques)
+                df_tab = pd.merge(df_tab, df_ann, on='mois', how='left').fillna(0)
 
                 df_tab['Épargne'] = df_tab['Revenus'] - df_tab['Dépenses']
                 df_tab['Patrimoine'] = df_tab[cps].sum(axis=1)
@@ -1877,7 +3045,7 @@ if st.session_state.get("authentication_status"):
                         df_b = df_m[(df_m['montant'] < 0) & (~df_m['categorie'].isin(liste_exclusion))]
                         
                         if not df_b.empty:
-                            df_res = df_b.groupby("categorie")["montant"].sum().abs().reset_index().sort_values("montant")
+                            df_res = df_b.groupby("categorie", observed=True)["montant"].sum().abs().reset_index().sort_values("montant")
                             fig_b = px.bar(df_res, x="montant", y="categorie", orientation='h')
                             
                             max_val = df_res["montant"].max()
@@ -1916,14 +3084,8 @@ if st.session_state.get("authentication_status"):
                             # --- TON CODE MODIFIÉ ---
                             df_template = pd.DataFrame({'mois': nomS_mois})
                             if not df_dash.empty:
-                                # CORRECTION : On crée un DataFrame sans les virements internes pour le calcul
-                                df_flux_reels = df_dash[~df_dash["categorie"].isin(virements_techniques)].copy()
-
-                                # 1. On crée le récap sur les flux réels uniquement
-                                df_reel_mois = df_flux_reels.groupby('mois')['montant'].agg(
-                                    Revenus=lambda x: x[x > 0].sum(),
-                                    Dépenses=lambda x: abs(x[x < 0].sum())
-                                ).reset_index()
+                                # 1. On crée le récap sur les flux réels uniquement (sans les virements internes)
+                                df_reel_mois = flux_mensuels(agregats_annee, virements_techniques)
 
                                 # 2. CRÉATION DE LA STRUCTURE COMPLÈTE (Jan à Déc)
                                 df_tab = pd.merge(df_template, df_reel_mois, on='mois', how='left').fillna(0)
@@ -1932,8 +3094,7 @@ if st.session_state.get("authentication_status"):
                                 df_tab['Épargne'] = df_tab['Revenus'] - df_tab['Dépenses']
                                 
                                 # 4. Tri chronologique
-                                df_tab['mois_idx'] = df_tab['mois'].apply(lambda x: nomS_mois.index(x))
-                                df_tab = df_tab.sort_values('mois_idx')
+                                df_tab = df_tab.sort_values('mois', key=rang_mois)
 
                                 # 5. Calcul du Patrimoine cumulé
                                 # Note : Le patrimoine doit inclure les virements (car l'argent bouge mais ne sort pas)
@@ -1972,15 +3133,15 @@ if st.session_state.get("authentication_status"):
                             with tab_details_cat:
                                 
                                 if not df_dash.empty:
-                                    # 1. Préparation des données
-                                    df_dep = df_dash[df_dash['montant'] < 0].copy()
-                                    df_dep['montant'] = df_dep['montant'].abs()
+                                    # 1. Préparation des données (totaux de dépenses déjà agrégés par catégorie et mois)
+                                    df_dep = agregats_annee[agregats_annee['sens'] == 'debit'].copy()
+                                    df_dep['total'] = df_dep['total'].abs()
 
                                     # 2. Création du Pivot avec TOUS les mois
                                     pivot_cat = df_dep.pivot_table(
                                         index='categorie', 
                                         columns='mois', 
-                                        values='montant', 
+                                        values='total', 
                                         aggfunc='sum'
                                     ).fillna(0)
 
@@ -2043,21 +3204,11 @@ if st.session_state.get("authentication_status"):
                             for c in cps:
                                 nom_c = str(c).strip()
                                 s_init = st.session_state.config_groupes.get(nom_c, {}).get("Solde", 0.0)
-                                mouv_prec = st.session_state.df[
-                                    (st.session_state.df['compte'].str.upper() == nom_c.upper()) & 
-                                    (st.session_state.df['année'] < annee_choisie)
-                                ]['montant'].sum()
-                                soldes_au_1er_janvier[nom_c] = s_init + mouv_prec
+                                soldes_au_1er_janvier[nom_c] = s_init + mouvements_anterieurs.get(nom_c.upper(), 0.0)
 
                             # 2. Calcul des flux (Revenus / Dépenses)
-                            df_flux_reels = df_dash[~df_dash["categorie"].str.contains("🔄", na=False)].copy()
-                            if not df_flux_reels.empty:
-                                df_ann = df_flux_reels.groupby('mois').agg(
-                                    Revenus=('montant', lambda x: x[x > 0].sum()),
-                                    Dépenses=('montant', lambda x: abs(x[x < 0].sum()))
-                                ).reset_index()
-                            else:
-                                df_ann = pd.DataFrame(columns=['mois', 'Revenus', 'Dépenses'])
+                            virements_graph = [c for c in agregats_annee['categorie'].unique() if "🔄" in str(c)]
+                            df_ann = flux_mensuels(agregats_annee, virements_graph)
 
                             # 3. Calcul de l'évolution des comptes (Logic Neon)
                             historique_comptes = calculer_evolution_comptes(df_dash, soldes_au_1er_janvier, noms_mois)
@@ -2204,17 +3355,12 @@ if st.session_state.get("authentication_status"):
                                                 # --- PRÉPARATION DES DONNÉES PAR compte ---
                             for c in cps:
                                     nom_c = str(c).strip()
-                                    df_mouv = df_dash[df_dash['compte'] == nom_c].groupby('mois')['montant'].sum().reset_index()
+                                    df_mouv = df_dash[df_dash['compte'] == nom_c].groupby('mois', observed=True)['montant'].sum().reset_index()
                                     df_mouv.columns = ['mois', 'Mouv_mois']
                                     df_tab = pd.merge(df_tab, df_mouv, on='mois', how='left').fillna(0)
                                     
                                     solde_initial_historique = st.session_state.config_groupes.get(nom_c, {}).get("Solde", 0.0)
-                                    mouvements_passes = st.session_state.df[
-                                        (st.session_state.df['compte'] == nom_c) & 
-                                        (st.session_state.df['année'] < annee_choisie)
-                                    ]['montant'].sum()
-                                    
-                                    solde_au_depart = solde_initial_historique + mouvements_passes
+                                    solde_au_depart = solde_initial_historique + mouvements_anterieurs.get(nom_c.upper(), 0.0)
                                     df_tab[nom_c] = solde_au_depart + df_tab['Mouv_mois'].cumsum()
                                     df_tab = df_tab.drop(columns=['Mouv_mois'])
 
@@ -2309,14 +3455,14 @@ if st.session_state.get("authentication_status"):
 
                             if not df_dash.empty:
                                 # On filtre df_dash (qui est déjà filtré par année et groupe) pour n'avoir que le mois choisi
-                                df_mois = df_dash[df_dash['mois'] == mois_choisi].copy()
+                                df_mois = df_dash[df_dash['mois'] == mois_choisi]
                                 
                                 # On ne garde que les dépenses (montant < 0)
                                 depenses_groupe = df_mois[df_mois['montant'] < 0]
                                 
                                 if not depenses_groupe.empty:
                                     # On somme par catégorie
-                                    stats_depenses = depenses_groupe.groupby('categorie')['montant'].sum().abs().to_dict()
+                                    stats_depenses = depenses_groupe.groupby('categorie', observed=True)['montant'].sum().abs().to_dict()
 
                             # 2. Chargement et Agrégation des Budgets GSheets
                             # On doit récupérer les budgets de TOUS les comptes du groupe (cps)
@@ -2495,7 +3641,6 @@ if st.session_state.get("authentication_status"):
                                                     conn_sql.execute(query, params)
                                                 
                                                 # --- REFRESH ---
-                                                st.cache_data.clear() 
                                                 st.session_state["active_tab"] = "Projets"
                                                 
                                                 st.success(f"✅ Projet '{nom_p}' enregistré avec succès !")
@@ -2586,7 +3731,6 @@ if st.session_state.get("authentication_status"):
                                                                     })
                                                                 
                                                                 # --- REFRESH ---
-                                                                st.cache_data.clear()
                                                                 st.session_state["active_tab"] = "Projets"
                                                                 
                                                                 # Petit message éphémère avant le reload
@@ -2612,7 +3756,6 @@ if st.session_state.get("authentication_status"):
                                                                 "u": user, "p": choix_actuel, "n": p['Nom']
                                                             })
                                                         
-                                                        st.cache_data.clear()
                                                         st.session_state["active_tab"] = "Projets"
                                                         relancer_avec_succes()
                                                     except Exception as e:
@@ -2632,7 +3775,7 @@ if st.session_state.get("authentication_status"):
         # --- 1. INITIALISATION AVEC RECHARGEMENT FORCÉ ---
         # On charge si la variable n'existe pas OU si elle est vide
         if "df_prev" not in st.session_state or st.session_state.df_prev is None or st.session_state.df_prev.empty:
-            st.session_state.df_prev = charger_previsions_neon()
+            st.session_state.df_prev = charger_previsions_neon(st.session_state.get("user"))
         
         # Initialisation de l'état d'affichage par mois (True par défaut)
         if "show_prev_mois" not in st.session_state:
@@ -2660,14 +3803,13 @@ if st.session_state.get("authentication_status"):
                 # 2. On RECALCULE toujours le mois et l'année à partir de la date réelle
                 # C'est ça qui corrige ton bug !
                 df_p["année"] = df_p["date"].dt.year
-                df_p["mois"] = df_p["date"].dt.month.map(
-                    lambda x: nomS_mois[int(x)-1] if pd.notnull(x) and 0 < x <= 12 else None
-                )
+                df_p["mois"] = noms_mois_depuis_numeros(df_p["date"].dt.month)
 
             # On réinjecte le DataFrame "propre"
             st.session_state.df_prev = df_p
 
         @st.fragment
+        @profile_fragment()
         def afficher_zone_previsionnelle():
 
             # --- 2. FILTRES COMPACTS ---
@@ -2796,12 +3938,11 @@ if st.session_state.get("authentication_status"):
             # On harmonise cps et la colonne compte pour être sûr qu'ils se trouvent
             cps_upper = [str(c).strip().upper() for c in cps]
 
-            df_reel_filtre = st.session_state.df.copy()
-            df_reel_filtre = df_reel_filtre[df_reel_filtre["compte"].astype(str).str.strip().str.upper().isin(cps_upper)]
+            # Filtres booléens directs : le df de session est déjà typé (dates comprises), pas de copie préalable
+            df_reel_filtre = st.session_state.df[cle_compte(st.session_state.df).isin(cps_upper)]
 
-            df_prev_filtre = st.session_state.df_prev.copy()
-            df_prev_filtre = df_prev_filtre[df_prev_filtre["compte"].astype(str).str.strip().str.upper().isin(cps_upper)]
-            df_reel_filtre["date"] = pd.to_datetime(df_reel_filtre["date"], dayfirst=True, errors='coerce')
+            df_prev_filtre = st.session_state.df_prev
+            df_prev_filtre = df_prev_filtre[cle_compte(df_prev_filtre).isin(cps_upper)]
 
             soldes_finaux_comptes = {}
             for c in cps:
@@ -2812,47 +3953,20 @@ if st.session_state.get("authentication_status"):
                 soldes_finaux_comptes[nom_c_upper] = solde_initial
 
             # --- 1. TRAITEMENT DU RÉEL (CSV) ---
-            # On définit les virements déjà présents pour éviter les doublons
-            virements_reels = df_reel_filtre[df_reel_filtre['categorie'].str.contains("🔄", na=False)]
-
-            for _, ligne in df_reel_filtre.iterrows():
-                mnt = float(ligne['montant'])
-                cpte_source = str(ligne['compte']).strip().upper()
-                cat = str(ligne['categorie']).upper()
+            mnts_reels = pd.to_numeric(df_reel_filtre['montant'], errors='coerce').fillna(0.0)
+            comptes_reels = cle_compte(df_reel_filtre)
 
-                # A. Impact direct (On touche au compte qui a la ligne)
+            # A. Impact direct (On touche au compte qui a la ligne)
+            for cpte_source, total in mnts_reels.groupby(comptes_reels, observed=True).sum().items():
                 if cpte_source in soldes_finaux_comptes:
-                    soldes_finaux_comptes[cpte_source] += mnt
-                
-                # B. Impact indirect (Contrepartie virtuelle)
-                if "🔄" in cat:
-                    # On cherche le nom exact dans la config pour trouver le groupe
-                    nom_source_cfg = next((k for k in st.session_state.config_groupes.keys() if k.strip().upper() == cpte_source), None)
-                    
-                    if nom_source_cfg:
-                        groupe_src = st.session_state.config_groupes[nom_source_cfg].get("Groupe")
-                        
-                        for nom_c, cfg in st.session_state.config_groupes.items():
-                            nom_c_upper = str(nom_c).strip().upper()
-                            
-                            # Si même groupe, compte différent et le nom du compte est dans le libellé
-                            if cfg.get("Groupe") == groupe_src and nom_c_upper != cpte_source:
-                                mots = [m for m in nom_c_upper.split() if len(m) > 2]
-                                if mots and mots[0] in cat:
-                                    
-                                    # ANTI-DOUBLON : Est-ce que la ligne d'arrivée existe déjà dans notre sélection ?
-                                    deja_present = not virements_reels[
-                                        (virements_reels['compte'].str.upper() == nom_c_upper) & 
-                                        (abs(virements_reels['montant']) == abs(mnt))
-                                    ].empty
-                                    
-                                    if not deja_present:
-                                        # On ne voit pas la ligne, donc on l'ajoute au compte cible (même s'il n'est pas dans cps)
-                                        if mnt < 0:
-                                            soldes_finaux_comptes[nom_c_upper] = soldes_finaux_comptes.get(nom_c_upper, 0) + abs(mnt)
-                                        else:
-                                            soldes_finaux_comptes[nom_c_upper] = soldes_finaux_comptes.get(nom_c_upper, 0) - abs(mnt)
-                                    break
+                    soldes_finaux_comptes[cpte_source] += total
+
+            # B. Impact indirect (Contrepartie virtuelle) : seulement pour les virements dont l'autre jambe est absente
+            paires_reelles = apparier_virements(df_reel_filtre)
+            a_simuler = (paires_reelles['cpte_contrepartie'].notna() & ~paires_reelles['paire_trouvee']).to_numpy()
+            for nom_c_upper, total in (-mnts_reels[a_simuler]).groupby(paires_reelles.loc[a_simuler, 'cpte_contrepartie']).sum().items():
+                # On ne voit pas la ligne, donc on l'ajoute au compte cible (même s'il n'est pas dans cps)
+                soldes_finaux_comptes[nom_c_upper] = soldes_finaux_comptes.get(nom_c_upper, 0) + total
 
             # --- 2. TRAITEMENT DU PRÉVISIONNEL ---
             # (On applique exactement la même logique sur df_p_periode)
@@ -2860,7 +3974,7 @@ if st.session_state.get("authentication_status"):
                 
             mask_p = (df_prev_filtre["année"] < annee_p_int) | \
                     ((df_prev_filtre["année"] == annee_p_int) & 
-                    (df_prev_filtre["mois"].apply(lambda x: nomS_mois.index(x) <= mois_idx_fin if x in nomS_mois else False)))
+                    rang_mois(df_prev_filtre["mois"]).between(0, mois_idx_fin).values)
             
             df_p_periode = df_prev_filtre[mask_p]
 
@@ -2900,11 +4014,6 @@ if st.session_state.get("authentication_status"):
                     idx_a_supprimer = df_tab_data[(df_tab_data["mois"] == m) & (df_tab_data["nom"].str.contains(r"\[PRÉVI\]", na=False))].index
                     df_tab_data = df_tab_data.drop(idx_a_supprimer)
 
-            stats = df_tab_data.groupby('mois')['montant'].agg(
-                Rev=lambda x: x[x>0].sum(), 
-                Dep=lambda x: abs(x[x<0].sum())
-            ).reset_index()
-
 
             # --- 4. CARDS ---
             st.markdown(f"#### 🏦 Situation Financière prévisionnelle : {choix_g}")
@@ -2928,6 +4037,7 @@ if st.session_state.get("authentication_status"):
                 st.session_state.nb_lignes_saisie = 1
 
             @st.fragment
+            @profile_fragment()
             def fragment_formulaire_previsions(cats, cps, annee_p_int, mois_idx_fin):
                 st.markdown("##### ➕ Ajouter Prévisions")
                 
@@ -2992,7 +4102,7 @@ if st.session_state.get("authentication_status"):
                         df_new = pd.DataFrame(lignes_a_sauver)
                         df_new["date"] = pd.to_datetime(df_new["date"])
                         df_new["nom"] = "[PRÉVI] " + df_new["nom"]
-                        df_new["mois"] = df_new["date"].dt.month.apply(lambda x: nomS_mois[x-1])
+                        df_new["mois"] = noms_mois_depuis_numeros(df_new["date"].dt.month)
                         df_new["année"] = df_new["date"].dt.year
                         
                         st.session_state.df_prev = pd.concat([st.session_state.df_prev, df_new], ignore_index=True)
@@ -3167,8 +4277,6 @@ if st.session_state.get("authentication_status"):
                                     if "df_prev" in st.session_state:
                                         del st.session_state.df_prev
                                     
-                                    # 2. On vide le cache Streamlit (si tu en utilises un)
-                                    st.cache_data.clear()
                                     
                                     # 3. On relance l'app pour qu'elle réexécute charger_previsions_neon()
                                     st.rerun()
@@ -3217,18 +4325,14 @@ if st.session_state.get("authentication_status"):
                 base_config += float(st.session_state.config_groupes.get(c, {}).get("Solde", 0.0))
 
             # 2. Somme de tout le REEL (CSV) avant l'année en cours
-            base_reel_passe = st.session_state.df[
-                (st.session_state.df["compte"].isin(cps)) & 
-                (st.session_state.df["année"] < annee_p_int)
-            ]["montant"].sum()
+            reel_anterieur = mouvements_avant_annee(st.session_state.df, "transactions", annee_p_int)
+            base_reel_passe = sum(reel_anterieur.get(str(c).strip().upper(), 0.0) for c in cps)
 
         
 
             # 3. Somme de toutes les PREVISIONS avant l'année en cours
-            base_prev_passee = st.session_state.df_prev[
-                (st.session_state.df_prev["compte"].isin(cps)) & 
-                (st.session_state.df_prev["année"] < annee_p_int)
-            ]["montant"].sum()
+            prev_anterieur = mouvements_avant_annee(st.session_state.df_prev, "previsions", annee_p_int)
+            base_prev_passee = sum(prev_anterieur.get(str(c).strip().upper(), 0.0) for c in cps)
 
             solde_base_annee = base_config + base_reel_passe + base_prev_passee
 
@@ -3238,10 +4342,7 @@ if st.session_state.get("authentication_status"):
                 df_tab_p = pd.DataFrame({'mois': nomS_mois})
                 mask_interne = df_tab_data['categorie'].str.upper().str.contains("🔄|VERS|INTERNE", na=False)
 
-                stats = df_tab_data[~mask_interne].groupby('mois')['montant'].agg(
-                    Rev=lambda x: x[x>0].sum(), 
-                    Dep=lambda x: abs(x[x<0].sum())
-                ).reset_index()
+                stats = revenus_depenses_par_mois(df_tab_data[~mask_interne], 'Rev', 'Dep')
 
                 df_tab_p = pd.merge(df_tab_p, stats, on='mois', how='left').fillna(0)
                 df_tab_p['Epargne'] = df_tab_p['Rev'] - df_tab_p['Dep']
@@ -3474,9 +4575,10 @@ if st.session_state.get("authentication_status"):
                                         
                                         # 3. On sauvegarde la nouvelle configuration (sans le compte)
                                         sauvegarder_config_neon(st.session_state.config_groupes, st.session_state["user"])
+                                    invalider_donnees(st.session_state["user"], "transactions")
+                                    invalider_donnees(st.session_state["user"], "previsions")
                                         
                                     # ... fin de ton bloc try ...
-                                    st.cache_data.clear()
                                     st.toast(f"✅ Compte '{cpte_a_suppr}' supprimé", icon="🗑️")
                                     time.sleep(1) # Petit délai pour laisser lire le message
                                     st.rerun()
@@ -3544,6 +4646,7 @@ if st.session_state.get("authentication_status"):
                             relancer_avec_succes()
             # On définit le fragment
             @st.fragment
+            @profile_fragment()
             def calculateur_prorata():
                 st.markdown("### 🧮 Calculateur au Prorata")
                 
@@ -3599,31 +4702,8 @@ if st.session_state.get("authentication_status"):
             }.items():
                 if key not in st.session_state: st.session_state[key] = val
 
-            # --- 2. PRÉPARATION DES DONNÉES SÉCURISÉE ---
-            # On crée un DataFrame vide avec les bonnes colonnes si df_h est vide
-            if df_h.empty:
-                df_edit = pd.DataFrame(columns=["date", "nom", "montant", "categorie", "compte", "mois", "année"])
-                liste_annees = ["Toutes"]
-            else:
-                df_edit = df_h.copy().reset_index(drop=True)
-                # Sécurité pour le format date
-                df_edit['date'] = pd.to_datetime(df_edit['date'], dayfirst=True, errors='coerce')
-                df_edit['année'] = df_edit['date'].dt.year.fillna(0).astype(int)
-                liste_annees = ["Toutes"] + sorted(df_edit['année'].unique().astype(str).tolist(), reverse=True)
-
-            df_f = df_edit.copy()
-            
-            # Filtrage (ne s'applique que si df_f n'est pas vide)
-            if not df_f.empty:
-                if st.session_state.filter_g != "Tous":
-                    cps = [c for c,v in st.session_state.config_groupes.items() if v.get("Groupe") == st.session_state.filter_g]
-                    df_f = df_f[df_f["compte"].isin(cps)]
-                if st.session_state.filter_c != "Tous": 
-                    df_f = df_f[df_f["compte"] == st.session_state.filter_c]
-                if st.session_state.filter_a != "Toutes": 
-                    df_f = df_f[df_f["année"] == int(st.session_state.filter_a)]
-                if st.session_state.filter_m != "Tous": 
-                    df_f = df_f[df_f["mois"] == st.session_state.filter_m]
+            # --- 2. DONNÉES ---
+            # Le tableau (fragment plus bas) lit directement st.session_state.df, déjà typé au chargement.
 
             # --- 3. MISE EN PAGE (S'affiche dans tous les cas) ---
             col_large, col_main = st.columns([2, 4], gap="small")
@@ -3634,6 +4714,7 @@ if st.session_state.get("authentication_status"):
 
                 with col_cat: 
                     @st.fragment
+                    @profile_fragment()
                     def fragment_categorie():
                         st.markdown('<p style="font-weight:bold; margin-bottom:15px;">✨ Catégorie</p>', unsafe_allow_html=True)
                         
@@ -3722,6 +4803,31 @@ if st.session_state.get("authentication_status"):
                                     st.session_state.LISTE_categorieS_COMPLETE = charger_categories_neon_visibles(st.session_state.user)
                                     st.toast("Préférences enregistrées ! ✨")
                                     st.rerun()
+
+                    # --- RÈGLES DE CATÉGORISATION PERSONNELLES ---
+                    with st.popover("🧠 Règles d'import", width='stretch'):
+                        st.caption("Appliquées à l'import avant les règles génériques, par priorité croissante. "
+                                   "Ex : 'DUPONT MARIE' · contient · 🤝 Virements Reçus · nom · credit")
+                        with st.form("form_regles", border=False):
+                            regles_editees = st.data_editor(
+                                charger_regles_neon(st.session_state.user),
+                                num_rows="dynamic",
+                                hide_index=True,
+                                use_container_width=True,
+                                column_config={
+                                    "priorite": st.column_config.NumberColumn("Priorité", min_value=0, step=1, default=100),
+                                    "motif": st.column_config.TextColumn("Motif", required=True),
+                                    "type_match": st.column_config.SelectboxColumn("Type", options=TYPES_MATCH, default="contient", required=True),
+                                    "categorie": st.column_config.SelectboxColumn("Catégorie", options=charger_categories_neon(st.session_state.user), required=True),
+                                    "portee": st.column_config.SelectboxColumn("Portée", options=PORTEES, default="nom", required=True),
+                                    "condition": st.column_config.SelectboxColumn("Condition", options=CONDITIONS),
+                                },
+                                key="editeur_regles"
+                            )
+                            if st.form_submit_button("Enregistrer les règles", width='stretch', type="primary"):
+                                if sauvegarder_regles_neon(regles_editees, st.session_state.user):
+                                    st.toast("Règles enregistrées ! 🧠")
+                                    st.rerun()
                 
                 
                 
@@ -3761,7 +4867,6 @@ if st.session_state.get("authentication_status"):
 
                         if submitted:
                             if enregistrer_ligne_budget_neon(user, m_cible, c_cible, cat_choisie, nouveau_montant):
-                                st.cache_data.clear() # On vide le cache pour que le nouveau budget apparaisse partout
                                 st.toast(f"Budget {cat_choisie} enregistré pour {m_cible} !", icon="✔️")
                                 time.sleep(0.5)
                                 st.rerun() # Seul ce bouton déclenche maintenant le refresh global
@@ -3776,6 +4881,7 @@ if st.session_state.get("authentication_status"):
                     st.markdown('<p style="font-weight:bold; margin-bottom:-10px;">➕ Ajouter des opérations</p>', unsafe_allow_html=True)
                     # Définition du fragment pour isoler la zone de saisie
                     @st.fragment
+                    @profile_fragment()
                     def zone_saisie_multi():
                         # Récupération des options
                         options_comptes = list(st.session_state.config_groupes.keys()) if st.session_state.config_groupes else ["Défaut"]
@@ -3832,16 +4938,18 @@ if st.session_state.get("authentication_status"):
                                 if valides:
                                     try:
                                         df_new_ops = pd.DataFrame(valides)
-                                        df_existant = st.session_state.df.copy() if not st.session_state.df.empty else pd.DataFrame()
-                                        df_total = pd.concat([df_existant, df_new_ops], ignore_index=True)
                                         
-                                        # Nettoyage des dates
-                                        df_total['date'] = pd.to_datetime(df_total['date'], dayfirst=True, format='mixed', errors='coerce')
-                                        df_total = df_total.dropna(subset=['date'])
-                                        df_total['date'] = df_total['date'].dt.strftime('%d/%m/%Y')
+                                        # Nettoyage des dates (seulement sur les nouvelles lignes)
+                                        df_new_ops['date'] = pd.to_datetime(df_new_ops['date'], dayfirst=True, format='mixed', errors='coerce')
+                                        df_new_ops = df_new_ops.dropna(subset=['date'])
+                                        df_total = ajouter_transactions(st.session_state.df, df_new_ops)
                                         
-                                        if sauvegarder_donnees_neon(df_total, st.session_state["user"]):
+                                        # Seules les nouvelles lignes partent vers Neon
+                                        if sauvegarder_modifications_neon(df_total, st.session_state["user"]):
                                             st.session_state.df = df_total
+                                            # Catégories choisies à la main : elles servent de modèle aux suggestions
+                                            for nom_op, cat in df_new_ops[['nom', 'categorie']].itertuples(index=False):
+                                                index_suggestions().mettre_a_jour(nom_op, cat)
                                             st.session_state.indices_reel = [0]
                                             st.success(f"✅ {len(valides)} opérations ajoutées !")
                                             time.sleep(1)
@@ -3874,10 +4982,12 @@ if st.session_state.get("authentication_status"):
                 
             with col_main:  
                 @st.fragment
+                @profile_fragment()
                 def zone_interactive_tableau():
                     # 1. INITIALISATION DES DONNÉES
                     if 'df' in st.session_state and not st.session_state.df.empty:
-                        df_f = st.session_state.df.copy()
+                        # Lecture seule : les filtres plus bas produisent de nouveaux DataFrames
+                        df_f = st.session_state.df
                     else:
                         st.info("Aucune donnée disponible.")
                         return
@@ -3918,27 +5028,9 @@ if st.session_state.get("authentication_status"):
                             # 2. Le selectbox
                             annee_selectionnee = st.selectbox("Année", liste_a, key="filter_a_select")
 
-                            # 3. LE FILTRAGE (La correction est ici)
-                            df_filtre = df_f.copy()
-
-                            if annee_selectionnee != "Toutes":
-                                # On convertit le choix du filtre ("2025") en entier (2025) pour matcher le DF
-                                annee_num = int(annee_selectionnee)
-                                df_filtre = df_filtre[df_filtre['année'] == annee_num]
-                            
                             liste_m = ["Tous"] + nomS_mois
                             st.selectbox("Mois", liste_m, key="filter_m_select")
 
-                                # --- 4. PRÉPARATION DE L'AFFICHAGE (Tri, Dates, etc.) ---
-                            if not df_f.empty:
-                                df_f['date'] = pd.to_datetime(df_f['date'], dayfirst=True, errors='coerce')
-                                df_f['date_Affiche'] = df_f['date'].dt.strftime('%d/%m/%Y').fillna("⚠️ Erreur Format")
-                                
-                                # Tri initial
-                                sort_order = st.session_state.get('sort_order', "↓ Décroissant")
-                                ascending = (sort_order == "↑ Croissant")
-                                df_f = df_f.sort_values(by="date", ascending=ascending)
-
                             st.markdown('Tri transactions')
                         # --- LOGIQUE DE TRI ---
                             # On définit d'abord les tris pour que df_f soit prêt
@@ -3947,89 +5039,85 @@ if st.session_state.get("authentication_status"):
                             st.session_state.sort_by = map_sort[sort_label]
                             st.session_state.sort_order = st.selectbox("Ordre", ["↑ Croissant", "↓ Décroissant"], index=1, label_visibility="collapsed", key="sort_ord")
 
-                            st.markdown('Supprimer transactions')
-                            def toggle_all():
-                                # On récupère la valeur de manière sécurisée avec .get()
-                                # Si la clé n'existe pas, on prend False par défaut
-                                val = st.session_state.get("master_control_v3", False)
-                                
-                                for idx in df_f.index:
-                                    st.session_state[f"cb_v3_{idx}"] = val
-
-                            st.checkbox("Tout sélectionner", key="master_control_v3", on_change=toggle_all)
-
-                            # --- 2. CALCUL DES SÉLECTIONNÉS ---
-                            # On regarde uniquement les checkboxes individuelles maintenant
-                            indices_selectionnes = [idx for idx in df_f.index if st.session_state.get(f"cb_v3_{idx}", False)]
-                            nb = len(indices_selectionnes)
-
-                            # --- DANS TON FRAGMENT (afficher_tableau_transactions) ---
-
-                            @st.dialog("Confirmer la suppression")
-                            def confirmer_suppression(indices_selectionnes, df_f):
-                                st.warning(f"Êtes-vous sûr de vouloir supprimer {len(indices_selectionnes)} transaction(s) ? Cette action est irréversible.")
-                                
-                                col1, col2 = st.columns(2)
-                                with col1:
-                                    if st.button("Annuler", use_container_width=True):
-                                        st.rerun()
-                                with col2:
-                                    if st.button("Oui, supprimer", type="primary", use_container_width=True):
-                                        with st.spinner("Suppression dans Neon..."):
-                                            lignes_a_effacer = df_f.loc[indices_selectionnes]
-                                            success = True
-                                            try:
-                                                with engine.begin() as conn:
-                                                    for _, row in lignes_a_effacer.iterrows():
-                                                        query = text("""
-                                                            DELETE FROM transactions 
-                                                            WHERE date = :date 
-                                                            AND nom = :nom 
-                                                            AND montant = :montant 
-                                                            AND utilisateur = :utilisateur
-                                                        """)
-                                                        conn.execute(query, {
-                                                            "date": row['date'],
-                                                            "nom": row['nom'],
-                                                            "montant": row['montant'],
-                                                            "utilisateur": st.session_state.user
-                                                        })
-                                            except Exception as e:
-                                                st.error(f"Erreur : {e}")
-                                                success = False
-
-                                            if success:
-                                                # Mise à jour du DataFrame en session
-                                                st.session_state.df = st.session_state.df.drop(index=indices_selectionnes).reset_index(drop=True)
-                                                st.success("Transactions supprimées !")
-                                                time.sleep(1)
-                                                st.rerun()
-
-                            if st.button(f"🗑️ Supprimer", type="primary", key="btn_del_v3", use_container_width=True):
-                                if nb > 0:
-                                    confirmer_suppression(indices_selectionnes, df_f)
-                                else:
-                                    st.error("Veuillez sélectionner au moins une transaction.")
+                            # Rempli après le filtrage : la sélection ne porte que sur les transactions affichées
+                            zone_suppression = st.container()
                                                 
                     
 
 
                     # 3. APPLICATION RÉELLE DES FILTRES SUR DF_F
+                    filtres = {}
                     if st.session_state.frag_filter_g != "Tous":
-                        comptes_du_groupe = [c for c,v in st.session_state.config_groupes.items() if v["Groupe"] == st.session_state.filter_g]
-                        df_f = df_f[df_f['compte'].isin(comptes_du_groupe)]
+                        filtres['comptes'] = [c for c,v in st.session_state.config_groupes.items() if v["Groupe"] == st.session_state.filter_g]
                     
                     if st.session_state.frag_filter_c != "Tous":
-                        df_f = df_f[df_f['compte'] == st.session_state.frag_filter_c]
+                        # Compte ET groupe : le compte doit appartenir au groupe choisi
+                        c_choisi = st.session_state.frag_filter_c
+                        filtres['comptes'] = [c_choisi] if c_choisi in filtres.get('comptes', [c_choisi]) else []
                         
                     if st.session_state.filter_a_select != "Toutes":
                         # On convertit le choix du widget (str) en entier (int)
-                        annee_recherchee = int(st.session_state.filter_a_select)
-                        # On filtre sur la colonne numérique
-                        df_f = df_f[df_f['année'] == annee_recherchee]
+                        filtres['annee'] = int(st.session_state.filter_a_select)
                         
                     if st.session_state.filter_m_select != "Tous":
-                        df_f = df_f[df_f['mois'] == st.session_state.filter_m_select]
+                        filtres['mois'] = st.session_state.filter_m_select
+
+                    # Tri choisi dans la colonne de gauche, appliqué en mémoire par transactions_filtrees
+                    tri_editeur = st.session_state.get("sort_by", "date")
+                    descendant_editeur = st.session_state.get("sort_order", "↓ Décroissant") != "↑ Croissant"
+                    df_f = transactions_filtrees(df_f, tri=tri_editeur, descendant=descendant_editeur, **filtres)
+                    signature_editeur = (tuple(sorted((k, str(v)) for k, v in filtres.items())), tri_editeur, descendant_editeur)
+
+                    with zone_suppression:
+                        st.markdown('Supprimer transactions')
+                        def toggle_all():
+                            # On récupère la valeur de manière sécurisée avec .get()
+                            # Si la clé n'existe pas, on prend False par défaut
+                            val = st.session_state.get("master_control_v3", False)
+                            
+                            # Seulement la page affichée : ce sont les seules cases visibles
+                            page_visible, _, _ = page_editeur(df_f, signature_editeur)
+                            for idx in page_visible.index:
+                                st.session_state[f"cb_v3_{idx}"] = val
+
+                        st.checkbox("Tout sélectionner", key="master_control_v3", on_change=toggle_all)
+
+                        # --- 2. CALCUL DES SÉLECTIONNÉS ---
+                        # On regarde uniquement les checkboxes individuelles, parmi les transactions filtrées
+                        # (une case cochée puis sortie des filtres n'est pas supprimée)
+                        indices_selectionnes = [idx for idx in df_f.index if st.session_state.get(f"cb_v3_{idx}", False)]
+                        nb = len(indices_selectionnes)
+
+                        # --- DANS TON FRAGMENT (afficher_tableau_transactions) ---
+
+                        @st.dialog("Confirmer la suppression")
+                        def confirmer_suppression(indices_selectionnes, df_f):
+                            st.warning(f"Êtes-vous sûr de vouloir supprimer {len(indices_selectionnes)} transaction(s) ? Cette action est irréversible.")
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.button("Annuler", use_container_width=True):
+                                    st.rerun()
+                            with col2:
+                                if st.button("Oui, supprimer", type="primary", use_container_width=True):
+                                    with st.spinner("Suppression dans Neon..."):
+                                        # L'index est l'id de la transaction : un seul DELETE pour toute la sélection
+                                        success = supprimer_transactions_neon(indices_selectionnes, st.session_state.user)
+
+                                        if success:
+                                            # Mise à jour du DataFrame en session, sur place (les id servent au suivi delta)
+                                            st.session_state.df.drop(index=indices_selectionnes, inplace=True)
+                                            if st.session_state.get("df_reference") is not None:
+                                                st.session_state.df_reference.drop(index=indices_selectionnes, errors='ignore', inplace=True)
+                                            st.success("Transactions supprimées !")
+                                            time.sleep(1)
+                                            st.rerun()
+
+                        if st.button(f"🗑️ Supprimer ({nb})", type="primary", key="btn_del_v3", use_container_width=True):
+                            if nb > 0:
+                                confirmer_suppression(indices_selectionnes, df_f)
+                            else:
+                                st.error("Veuillez sélectionner au moins une transaction.")
 
                         
 
@@ -4046,43 +5134,34 @@ if st.session_state.get("authentication_status"):
                         if 'df_temoin' not in st.session_state:
                             st.session_state.df_temoin = df_f['categorie'].to_dict()
 
-                        if not df_f.empty:
-                            # 1. On repart de la colonne brute si possible
-                            # On force la conversion en précisant bien que le jour est en premier
-                            df_f['date'] = pd.to_datetime(df_f['date'], dayfirst=True, errors='coerce')
-                            
-                            # 2. Si après ça on a encore des NaT, c'est que la donnée source dans le DF 
-                            # était déjà corrompue au chargement. 
-                            # ASTUCE : Vérifie si dans ton Google Sheet la colonne est bien au format "Texte brut"
-                            
-                            # 3. Création de l'affichage
-                            df_f['date_Affiche'] = df_f['date'].dt.strftime('%d/%m/%Y').fillna("⚠️ Erreur Format")
+                        mode_grille = st.radio("Mode d'édition", MODES_EDITEUR, horizontal=True, key="mode_editeur", label_visibility="collapsed") == MODES_EDITEUR[1]
+                        # La clé suit la sélection : changer de filtres ou de tri repart d'une grille sans modifications
+                        cle_grille = f"grille_editeur_{hashlib.md5(repr((signature_editeur, len(df_f))).encode()).hexdigest()[:8]}"
 
-                            # 4. Tri
-                            ascending = (st.session_state.sort_order == "Ascendant")
-                            df_f = df_f.sort_values(by="date", ascending=ascending)
-
-                            # --- LOGS DES ERREURS (Dans la console) ---
-                            invalides = df_f[df_f['date_Affiche'] == "⚠️ Invalide"]
-                            if not invalides.empty:
-                                print("\n❌ --- LOGS dateS INVALIDES ---")
-                                for idx, row in invalides.iterrows():
-                                    nom = row['nom']
-                                    valeur_brute = row['date_Raw']
-                                    type_brut = type(valeur_brute)
-                                    print(f"Transaction: {nom} | Contenu Brut: '{valeur_brute}' | Type Python: {type_brut}")
-                                print("-------------------------------\n")
-                            
+                        # df_f est déjà filtré et trié (transactions_filtrees) : le fragment n'en construit qu'une page
                         @st.fragment
+                        @profile_fragment()
                         def afficher_tableau_transactions(df_f):
                             
 
                             # Utilisation du style plus fin comme vu précédemment
                             st.markdown(f'<p style="font-size:18px; font-weight:bold; margin-top:5px;">📝 Édition ({len(df_f)})</p>', unsafe_allow_html=True)
 
-                            # --- APPLICATION DU TRI ---
-                            ascending = (st.session_state.sort_order == "↑ Croissant")
-                            df_f = df_f.sort_values(by=st.session_state.sort_by, ascending=ascending)
+                            # --- PAGINATION ---
+                            p_taille, p_prec, p_info, p_suiv = st.columns([1.2, 0.5, 1.3, 0.5])
+                            with p_taille:
+                                st.selectbox("Lignes par page", TAILLES_PAGE_EDITEUR, index=1, key="taille_page_editeur", label_visibility="collapsed")
+                            df_f, page, nb_pages = page_editeur(df_f, signature_editeur)
+                            with p_prec:
+                                st.button("◀", key="page_prec", disabled=page == 0, on_click=changer_page_editeur, args=(-1,), use_container_width=True)
+                            with p_info:
+                                st.markdown(f'<p style="text-align:center; margin-top:8px; font-size:12px; color:gray;">Page {page + 1} / {nb_pages}</p>', unsafe_allow_html=True)
+                            with p_suiv:
+                                st.button("▶", key="page_suiv", disabled=page >= nb_pages - 1, on_click=changer_page_editeur, args=(1,), use_container_width=True)
+
+                            # Création de l'affichage, pour la page seulement (un NaT vient d'une date déjà illisible au chargement)
+                            df_f['date_Affiche'] = df_f['date'].dt.strftime('%d/%m/%Y').fillna("⚠️ Erreur Format")
+
                             # Utilisation de ratios IDENTIQUES à ceux des lignes du tableau
                             h_col1, h_col2, h_col3, h_col5, h_col4 = st.columns([2.5, 1.8, 1.5, 0.5, 0.5])
 
@@ -4111,7 +5190,10 @@ if st.session_state.get("authentication_status"):
                                 # Cette fonction met à jour la source de vérité dès qu'un selectbox change
                                     if key_widget in st.session_state:
                                         nouvelle_valeur = st.session_state[key_widget]
-                                        st.session_state.df.at[index_global, colonne] = nouvelle_valeur
+                                        affecter_valeur(st.session_state.df, index_global, colonne, nouvelle_valeur)
+                                        st.session_state.modifs_en_attente = True
+                                        if colonne == 'categorie':
+                                            index_suggestions().mettre_a_jour(st.session_state.df.at[index_global, 'nom'], nouvelle_valeur)
 
 
 
@@ -4144,20 +5226,9 @@ if st.session_state.get("authentication_status"):
                                         nom_similaire = None
                                         
                                         # On ne cherche une suggestion que si la ligne n'est pas encore catégorisée
-                                        if pd.isna(current_cat) or current_cat in ["", "À catégoriser ❓"]:
-                                            # On cherche dans le DF global (st.session_state.df) des noms proches
-                                            noms_connus = st.session_state.df[st.session_state.df['categorie'].notna()]['nom'].unique().tolist()
-                                            from difflib import get_close_matches
-                                            nom_a_chercher = str(nom_transac) if nom_transac is not None else ""
-
-                                            # On filtre noms_connus pour enlever les éventuels None ou NaN qui font planter difflib
-                                            noms_propres = [str(n) for n in noms_connus if pd.notna(n)]
-
-                                            matches = get_close_matches(nom_a_chercher, noms_propres, n=1, cutoff=0.6)
-                                            
-                                            if matches:
-                                                nom_similaire = matches[0]
-                                                suggestion = st.session_state.df[st.session_state.df['nom'] == nom_similaire]['categorie'].iloc[0]
+                                        if pd.isna(current_cat) or current_cat in CATEGORIES_A_TRIER:
+                                            # On cherche des noms proches dans l'index de la session (trigrammes), pas dans tout le DF
+                                            suggestion, nom_similaire = index_suggestions().suggerer(nom_transac)
 
                                         # --- LOGIQUE EXISTANTE DES OPTIONS ---
                                         options_dynamiques = LISTE_categorieS_COMPLETE.copy()
@@ -4174,28 +5245,24 @@ if st.session_state.get("authentication_status"):
                                         # --- CALCUL DE L'INDEX PAR DÉFAUT ---
                                         # Si vide, on prend la suggestion, sinon la catégorie actuelle
                                         try:
-                                            if (pd.isna(current_cat) or current_cat in ["", "À catégoriser ❓"]) and suggestion:
+                                            if (pd.isna(current_cat) or current_cat in CATEGORIES_A_TRIER) and suggestion:
                                                 idx_init = options_dynamiques.index(suggestion)
                                             else:
                                                 idx_init = options_dynamiques.index(current_cat)
                                         except:
                                             idx_init = 0
 
-                                        # 1. Création d'une clé unique basée sur les données de la ligne
-                                        # On combine Nom + Date + Montant pour que la clé soit rattachée à LA transaction
-                                        id_stable = f"{row['nom']}_{row['date']}_{row['montant']}"
-
-                                        # 2. Affichage du Selectbox avec la nouvelle clé
+                                        # 1. Affichage du Selectbox : idx est l'id de la transaction, la clé lui reste rattachée
                                         nouvelle_cat = st.selectbox(
                                             "C", 
                                             options=options_dynamiques, 
                                             index=idx_init, 
-                                            key=f"cat_{id_stable}_{idx}", # <-- Clé stable + idx pour éviter les doublons parfaits
+                                            key=f"cat_{idx}",
                                             label_visibility="collapsed",
                                             on_change=update_df_from_ui,
-                                            args=(idx, f"cat_{id_stable}_{idx}", 'categorie') # <-- Ne pas oublier de mettre à jour la clé ici aussi
+                                            args=(idx, f"cat_{idx}", 'categorie')
                                         )
-                                        df_f.at[idx, 'categorie'] = nouvelle_cat
+                                        affecter_valeur(df_f, idx, 'categorie', nouvelle_cat)
                                     
                                     with c_mois:
                                         st.selectbox(
@@ -4261,17 +5328,18 @@ if st.session_state.get("authentication_status"):
                                                         nouvelle_ligne['nom'] = f"{row_data['nom']} (Part)"
                                                         nouvelles_lignes.append(nouvelle_ligne)
                                                     
-                                                    # Mise à jour du DataFrame
+                                                    # Mise à jour du DataFrame (l'originale disparaît, les parts reçoivent des index neufs)
                                                     df_temp = df_temp.drop(index_origine)
-                                                    df_temp = pd.concat([df_temp, pd.DataFrame(nouvelles_lignes)], ignore_index=True)
-                                                    
-                                                    # Sauvegarde vers GSheets
-                                                    sauvegarder_donnees_neon(df_temp, st.session_state.user)
-                                                    st.session_state.df = df_temp
+                                                    df_temp = ajouter_transactions(df_temp, pd.DataFrame(nouvelles_lignes))
                                                     
-                                                    st.success(f"Transaction divisée en {nb_parts} !")
-                                                    time.sleep(1)
-                                                    relancer_avec_succes()
+                                                    # Sauvegarde vers Neon : suppression de l'originale + insertion des parts
+                                                    if sauvegarder_modifications_neon(df_temp, st.session_state.user):
+                                                        st.session_state.df = df_temp
+                                                        for ligne in nouvelles_lignes:
+                                                            index_suggestions().mettre_a_jour(ligne['nom'], ligne['categorie'])
+                                                        st.success(f"Transaction divisée en {nb_parts} !")
+                                                        time.sleep(1)
+                                                        relancer_avec_succes()
 
                                             multi_split_dialog(idx, row)
 
@@ -4285,12 +5353,41 @@ if st.session_state.get("authentication_status"):
                                             on_change=refresh_sidebar  # <--- AJOUTEZ CECI
                                         )
 
+                        # Mode grille : un seul widget, les modifications restent dans son état jusqu'à la sauvegarde
+                        @st.fragment
+                        @profile_fragment()
+                        def afficher_grille_transactions(df_f):
+                            st.markdown(f'<p style="font-size:18px; font-weight:bold; margin-top:5px;">▦ Édition en masse ({len(df_f)})</p>', unsafe_allow_html=True)
+                            options_cat = sorted(set(LISTE_categorieS_COMPLETE) | set(df_f['categorie'].dropna().astype(str)))
+                            options_mois = nomS_mois + sorted(set(df_f['mois'].dropna().astype(str)) - set(nomS_mois))
+                            st.data_editor(
+                                grille_editeur(df_f),
+                                hide_index=True,
+                                use_container_width=True,
+                                height=570,
+                                disabled=[c for c in COLONNES_GRILLE if c not in COLONNES_GRILLE_MODIFIABLES],
+                                column_config={
+                                    "date": st.column_config.DateColumn("Date", format="DD/MM/YYYY"),
+                                    "nom": st.column_config.TextColumn("Détails"),
+                                    "compte": st.column_config.TextColumn("Compte"),
+                                    "montant": st.column_config.NumberColumn("Montant", format="%.2f €"),
+                                    "categorie": st.column_config.SelectboxColumn("Catégorie", options=options_cat, required=True),
+                                    "mois": st.column_config.SelectboxColumn("Mois", options=options_mois, required=True),
+                                },
+                                key=cle_grille
+                            )
+                            nb_modifs = len(modifications_grille(st.session_state.get(cle_grille), df_f.index))
+                            if nb_modifs:
+                                st.caption(f"✏️ {nb_modifs} ligne(s) modifiée(s), non sauvegardée(s)")
+
                         # --- C. APPEL DE LA FONCTION ---
-                        if not df_f.empty:
-                            # On appelle la fonction une seule fois, au même niveau que sa définition
-                            afficher_tableau_transactions(df_f)
+                        if df_f.empty:
+                            st.info("Aucune transaction à afficher.")
+                        elif mode_grille:
+                            afficher_grille_transactions(df_f)
                         else:
-                            st.info("Aucune transaction à afficher.")        
+                            # On appelle la fonction une seule fois, au même niveau que sa définition
+                            afficher_tableau_transactions(df_f)        
                                 
                                 
                         with st.container(border=True):
@@ -4305,38 +5402,44 @@ if st.session_state.get("authentication_status"):
                                     nouvelles_regles = []
 
                                     # --- 1. APPLICATION DES MODIFICATIONS ---
-                                    for idx_f in df_f.index:
-                                        row_f = df_f.loc[idx_f]
+                                    if mode_grille:
+                                        # Coût proportionnel au nombre de cellules modifiées, pas à la taille de la sélection
+                                        modifs_grille = modifications_grille(st.session_state.get(cle_grille), df_f.index)
+                                        nouvelles_regles = appliquer_modifications_grille(st.session_state.df, modifs_grille, apprendre)
+                                        if modifs_grille:
+                                            st.session_state.modifs_en_attente = True
+                                        # Les modifications sont reportées dans le df : la grille repart de zéro
+                                        st.session_state.pop(cle_grille, None)
+                                    else:
+                                        for idx_f in df_f.index:
+                                            row_f = df_f.loc[idx_f]
                                         
-                                        # Reconstruction de l'ID stable (doit être IDENTIQUE à la selectbox)
-                                        id_stable_f = f"{row_f['nom']}_{row_f['date']}_{row_f['montant']}"
-                                        key_cat = f"cat_{id_stable_f}_{idx_f}"
-                                        key_mo = f"mo_{id_stable_f}_{idx_f}" # Clé stable aussi pour le mois !
-
-                                        # Mise à jour du mois
-                                        if key_mo in st.session_state:
-                                            st.session_state.df.at[idx_f, 'mois'] = st.session_state[key_mo]
-
-                                        # Logique d'apprentissage
-                                        if key_cat in st.session_state:
-                                            cat_choisie = st.session_state[key_cat]
-                                            cat_initiale = temoin.get(idx_f)
-
-                                            # On compare même si l'initiale est None/NaN
-                                            if str(cat_choisie) != str(cat_initiale):
-                                                nom_op = row_f['nom']
+                                            # Clés des widgets (doivent être IDENTIQUES aux selectbox) : idx_f est l'id de la transaction
+                                            key_cat = f"cat_{idx_f}"
+                                            key_mo = f"mo_{idx_f}"
+
+                                            # Mise à jour du mois
+                                            if key_mo in st.session_state:
+                                                affecter_valeur(st.session_state.df, idx_f, 'mois', st.session_state[key_mo])
+
+                                            # Logique d'apprentissage
+                                            if key_cat in st.session_state:
+                                                cat_choisie = st.session_state[key_cat]
+                                                cat_initiale = temoin.get(idx_f)
+
+                                                # On compare même si l'initiale est None/NaN
+                                                if str(cat_choisie) != str(cat_initiale):
+                                                    nom_op = row_f['nom']
+                                                    index_suggestions().mettre_a_jour(nom_op, cat_choisie)
                                                 
-                                                if apprendre:
-                                                    nouvelles_regles.append((nom_op, cat_choisie))
-                                                    # Cascade sur tout le DF
-                                                    mask = st.session_state.df['nom'] == nom_op
-                                                    st.session_state.df.loc[mask, 'categorie'] = cat_choisie
-                                                else:
-                                                    # Mise à jour simple si apprentissage décoché
-                                                    st.session_state.df.at[idx_f, 'categorie'] = cat_choisie
-
-                                    # --- 2. PRÉPARATION DE L'ENVOI (APRÈS LES MISES À JOUR) ---
-                                    df_a_sauver = st.session_state.df.copy() # On copie APRÈS la cascade
+                                                    if apprendre:
+                                                        nouvelles_regles.append((nom_op, cat_choisie))
+                                                        # Cascade sur tout le DF
+                                                        mask = st.session_state.df['nom'] == nom_op
+                                                        affecter_valeur(st.session_state.df, mask, 'categorie', cat_choisie)
+                                                    else:
+                                                        # Mise à jour simple si apprentissage décoché
+                                                        affecter_valeur(st.session_state.df, idx_f, 'categorie', cat_choisie)
 
                                     if nouvelles_regles:
                                         st.info(f"🧠 Apprentissage de {len(nouvelles_regles)} règle(s)...")
@@ -4344,17 +5447,12 @@ if st.session_state.get("authentication_status"):
                                         if "df_temoin" in st.session_state:
                                             del st.session_state.df_temoin
 
-                                    # --- 3. SAUVEGARDE NEON ---
+                                    # --- 2. SAUVEGARDE NEON (uniquement les lignes modifiées depuis le dernier instantané) ---
                                     try:
-                                        # Nettoyage des dates (format Neon)
-                                        df_a_sauver['date'] = pd.to_datetime(df_a_sauver['date'], dayfirst=True, errors='coerce')
-                                        df_a_sauver = df_a_sauver.dropna(subset=['date'])
-
                                         with st.spinner("Sauvegarde en cours..."):
-                                            success = sauvegarder_donnees_neon(df_a_sauver, user_actuel)
+                                            success = sauvegarder_modifications_neon(st.session_state.df, user_actuel)
                                             if success:
-                                                st.cache_data.clear()
-                                                st.success("✅ Modifications enregistrées !")
+                                                st.success(f"✅ Modifications enregistrées ! ({success['inserees']} ajoutée(s), {success['modifiees']} modifiée(s), {success['supprimees']} supprimée(s))")
                                                 time.sleep(1)
                                                 st.rerun()
                                     except Exception as e:
@@ -4403,10 +5501,8 @@ if st.session_state.get("authentication_status"):
                         st.markdown("---")
                         c_st1, c_st2 = st.columns(2)
                         
-                        # --- CORRECTION ICI ---
-                        # On convertit en datetime pour pouvoir trouver le max et formater
-                        dates_converties = pd.to_datetime(stats_compte["date"], dayfirst=True, errors='coerce')
-                        date_max = dates_converties.max()
+                        # Les dates sont déjà en datetime64 (forme canonique du df de session)
+                        date_max = stats_compte["date"].max()
                         
                         # On vérifie que la date n'est pas vide (NaT) avant de formater
                         derniere_date = date_max.strftime("%d/%m/%Y") if pd.notnull(date_max) else "Inconnue"
@@ -4464,7 +5560,6 @@ if st.session_state.get("authentication_status"):
                     else:
                         try:
                             with st.spinner("Analyse et catégorisation en cours..."):
-                                st.cache_data.clear()
                                 raw = f.read()
                                 
                                 # --- 1. DÉCODAGE ROBUSTE ---
@@ -4527,7 +5622,7 @@ if st.session_state.get("authentication_status"):
                                             df_n["M_Final"] = df_n["montant"].apply(clean_montant_physique)
                                         else:
                                             st.error(f"Colonnes trouvées : {cols}. Vérifiez votre fichier CSV.")
-                                            st.stop()
+                                            arreter_rerun()
 
                                         # Détection nom
                                         n_col = "nom" if "nom" in cols else (cols[1] if len(cols) > 1 else cols[0])
@@ -4536,67 +5631,58 @@ if st.session_state.get("authentication_status"):
                                         # --- 6. CRÉATION DU DF FINAL ---
                                         df_res = pd.DataFrame({
                                             "date": df_n["date_C"], 
-                                            "nom": df_n[n_col].astype(str).apply(simplifier_nom_definitif),
+                                            "nom": simplifier_noms_series(df_n[n_col]),
                                             "montant": df_n["M_Final"], 
                                             "compte": [c_nom] * len(df_n)
                                         })
 
         
 
-                                        # --- MODIFICATION ICI : On utilise df_n pour avoir accès à TOUTES les colonnes ---
-                                        df_res["categorie"] = df_n.apply(
-                                            lambda row: categoriser(row[n_col], row["M_Final"], c_nom, row), 
-                                            axis=1
+                                        # --- CATÉGORISATION EN BLOC : df_n donne accès à TOUTES les colonnes ---
+                                        df_res["categorie"] = categoriser_batch(
+                                            df_n[n_col], df_n["M_Final"], c_nom, df_n.get('Informations complementaires')
                                         )
 
-                                        df_res["mois"] = df_res["date"].dt.month.map(lambda x: nomS_mois[int(x)-1])
+                                        df_res["mois"] = noms_mois_depuis_numeros(df_res["date"].dt.month)
                                         df_res["année"] = df_res["date"].dt.year
                                         
                                         # --- SAUVEGARDE ET SYNCHRONISATION ---
 
-                                        # 1. On récupère les données déjà présentes dans le Google Sheet
+                                        # --- 4. PRÉPARATION DU LOT IMPORTÉ ---
                                         try:
-                                            df_existant = charger_donnees(st.session_state["user"])
-                                        except:
-                                            df_existant = pd.DataFrame()
-
-                                        # --- 4. PRÉPARATION POUR GOOGLE SHEETS (VERSION NETTOYÉE) ---
-                                        try:
-                                            # On prépare le DataFrame final (fusion existant + nouveau)
-                                            if not df_existant.empty:
-                                                df_final = pd.concat([df_existant, df_res], ignore_index=True)
-                                            else:
-                                                df_final = df_res
-
+                                            # Seul le relevé importé part vers Neon : l'historique déjà en base n'est pas renvoyé.
                                             # SÉCURITÉ : On s'assure que 'date' est bien au format datetime avant l'envoi
                                             # On utilise dayfirst=True car ton CSV est en format français
+                                            df_final = df_res.copy()
                                             df_final['date'] = pd.to_datetime(df_final['date'], dayfirst=True, errors='coerce')
                                             
                                             # On retire les lignes où la date n'a pas pu être lue
                                             df_final = df_final.dropna(subset=['date'])
 
                                             # --- 5. SAUVEGARDE ---
-                                            # On envoie le DataFrame PROPRE (avec des objets dates) à la fonction.
-                                            # C'EST CETTE FONCTION QUI GÉRERA LES DOUBLONS ET LE FORMAT ISO FINAL.
-                                            sauvegarder_donnees_neon(df_final, st.session_state["user"])
-                                            
-                                            # MISE À JOUR LOCALE
-                                            st.cache_data.clear()
-                                            st.session_state.df = charger_donnees(st.session_state["user"])
+                                            # C'EST CETTE FONCTION QUI GÉRERA LES DOUBLONS : seules les lignes absentes de Neon sont écrites.
+                                            df_inserees = importer_transactions_neon(df_final, st.session_state["user"])
+                                            if df_inserees is not None:
+                                                # MISE À JOUR LOCALE : on ajoute les nouvelles lignes à la session, sans recharger l'historique
+                                                if not df_inserees.empty:
+                                                    st.session_state.df = concat_transactions(st.session_state.df, df_inserees)
+                                                    completer_instantane_transactions(st.session_state.df.loc[df_inserees.index])
+                                                    index_suggestions().ajouter_df(df_inserees)
                                             
-                                            st.toast("✅ Données synchronisées avec succès !", icon="🚀")
+                                                st.toast("✅ Données synchronisées avec succès !", icon="🚀")
                                             
-                                            # Stats pour le résumé
-                                            st.session_state.dernier_import_stats = {
-                                                "nb": len(df_res),
-                                                "dep": df_res[df_res['montant'] < 0]['montant'].sum(),
-                                                "rev": df_res[df_res['montant'] > 0]['montant'].sum(),
-                                                "compte": c_nom,
-                                                "date": datetime.now().strftime("%H:%M")
-                                            }
+                                                # Stats pour le résumé
+                                                st.session_state.dernier_import_stats = {
+                                                    "nb": len(df_inserees),
+                                                    "doublons": len(df_final) - len(df_inserees),
+                                                    "dep": df_inserees[df_inserees['montant'] < 0]['montant'].sum(),
+                                                    "rev": df_inserees[df_inserees['montant'] > 0]['montant'].sum(),
+                                                    "compte": c_nom,
+                                                    "date": datetime.now().strftime("%H:%M")
+                                                }
                                             
-                                            time.sleep(1)
-                                            relancer_avec_succes()
+                                                time.sleep(1)
+                                                relancer_avec_succes()
 
                                         except Exception as e_save:
                                             st.error(f"Erreur lors de la préparation des données : {e_save}")
@@ -4622,7 +5708,7 @@ if st.session_state.get("authentication_status"):
                         c1, c2, c3, c4 = st.columns(4)
                         
                         c1.metric("compte cible", stats['compte'])
-                        c2.metric("Opérations ajoutées", f"+{stats['nb']}")
+                        c2.metric("Opérations ajoutées", f"+{stats['nb']}", help=f"{stats.get('doublons', 0)} ligne(s) déjà présente(s) ignorée(s)")
                         
                         # On affiche les dépenses en négatif rouge
                         c3.metric("Total Dépenses", f"{abs(stats['dep']):.2f} €", delta="-", delta_color="inverse")
@@ -4708,8 +5794,6 @@ if st.session_state.get("authentication_status"):
                         
                         st.success(f"Base Neon mise à jour : '{nouveau_nom}' !")
                         
-                        # On vide le cache pour que le prochain st.rerun lise les nouvelles données
-                        st.cache_data.clear()
                         st.rerun()
                         
                     except Exception as e:
@@ -4719,6 +5803,7 @@ if st.session_state.get("authentication_status"):
         
 
         @st.fragment
+        @profile_fragment()
         def formulaire_saisie_depense(groupe_choisi, key_suffix):
             st.markdown("### ➕ Nouvelle dépense")
             
@@ -4801,7 +5886,6 @@ if st.session_state.get("authentication_status"):
                         
                         if sauvegarder_transaction_tricount_neon(nouvelle_depense):
                             st.success("Dépense ajoutée !")
-                            st.cache_data.clear()
                             st.rerun()
 
             
@@ -4829,7 +5913,6 @@ if st.session_state.get("authentication_status"):
                         })
                     
                     st.success(f"Le groupe '{groupe_a_supprimer}' a été supprimé !")
-                    st.cache_data.clear()
                     
                     # On force le retour à l'accueil du Tricount
                     time.sleep(1)
@@ -4904,7 +5987,6 @@ if st.session_state.get("authentication_status"):
                     
                     if mettre_a_jour_transaction_tricount_neon(row['id'], donnees_maj):
                         st.success("C'est à jour ! 🚀")
-                        st.cache_data.clear()
                         st.rerun()
 
                 
@@ -4942,12 +6024,12 @@ if st.session_state.get("authentication_status"):
                     }
                     if sauvegarder_transaction_tricount_neon(data_init):
                         st.success(f"Groupe '{nom_nouveau}' créé !")
-                        st.cache_data.clear()
                         st.rerun()
 
         # --- 2. LE FRAGMENT PRINCIPAL (L'interface) ---
 
         @st.fragment
+        @profile_fragment()
         def afficher_espace_tricount():
             # 1. RÉCUPÉRATION DES DONNÉES
             df_tri = charger_tricount_neon(st.session_state["user"])
@@ -5171,7 +6253,6 @@ if st.session_state.get("authentication_status"):
                                                                                 AND utilisateur = :user
                                                                             """), {"emo": e, "nom": p, "grp": groupe_choisi, "user": st.session_state["user"]})
                                                                         
-                                                                        st.cache_data.clear()
                                                                         st.rerun()
                                                                     except Exception as ex:
                                                                         st.error(f"Erreur SQL : {ex}")
@@ -5280,4 +6361,8 @@ if st.session_state.get("authentication_status"):
                                     st.info("Aucune dépense enregistrée.")
                             else:
                                 st.write("Le sheet est vide.")
-        afficher_espace_tricount()
\ No newline at end of file
+        afficher_espace_tricount()
+
+
+bilan_requetes_rerun()
+afficher_profil_rerun()
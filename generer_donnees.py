@@ -0,0 +1,343 @@
+"""
+Jeu de données synthétique pour mesurer l'application sans vrais relevés bancaires.
+
+Génère des utilisateurs fictifs (bench_1, bench_2...) dans une base Postgres :
+- un compte de connexion par utilisateur (table users, mot de passe haché comme à l'inscription) ;
+- des comptes répartis en groupes ;
+- des transactions sur plusieurs années, avec des libellés de style bancaire et des virements internes 🔄 ;
+- des budgets, des prévisions et des groupes Tricount.
+
+Écrit aussi, si demandé, les relevés CSV correspondants aux formats La Banque Postale, Revolut et Banque Populaire.
+Leurs en-têtes sont reconnus par CORRESPONDANCE : on les importe par l'onglet Importer.
+
+La base cible est une base de test avec le schéma de l'application (branche Neon, Postgres local),
+migrations passées (python migrations.py --base ...) : l'application s'y lance telle quelle et on s'y connecte
+en bench_1 / --mot-de-passe. Jamais la base de production.
+
+    python generer_donnees.py --transactions 100000 --base postgresql://... --csv exports/
+    python generer_donnees.py --utilisateurs 3 --transactions 1000000 --base postgresql://... --mesurer
+    python generer_donnees.py --transactions 5000 --csv exports/     # relevés CSV seuls, sans base
+
+Les mots-clés et CORRESPONDANCE sont lus dans app.py, sans l'exécuter (les mois viennent d'analyses.py) : les libellés générés
+contiennent les mots-clés des règles de l'application, et les en-têtes CSV restent reconnus par l'import.
+--mesurer chronomètre les lectures SQL principales et les calculs du tableau de bord importés d'analyses.py
+(agrégats mensuels, flux par mois) sur l'historique chargé. Le chargement de l'application (normalisation des types)
+et la catégorisation restent dans app.py, un script Streamlit qu'on ne peut pas importer : pour ceux-là,
+lancez l'application sur la base générée avec ?profil=1, le profil du rerun détaille chaque chargeur et calcul.
+"""
+import argparse
+import ast
+import os
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import streamlit_authenticator as stauth
+from sqlalchemy import create_engine, inspect, text
+
+from analyses import agregats_mensuels_depuis_df, flux_mensuels, nomS_mois
+
+FICHIER_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+TABLES = ["users", "transactions", "configuration", "budgets", "previsions", "tricount"]
+
+
+def lire_constante(nom):
+    """Valeur littérale d'une constante de app.py (assignation de premier niveau), sans exécuter le script."""
+    with open(FICHIER_APP, encoding="utf-8") as f:
+        arbre = ast.parse(f.read())
+    for noeud in arbre.body:
+        if isinstance(noeud, ast.Assign) and any(isinstance(c, ast.Name) and c.id == nom for c in noeud.targets):
+            return ast.literal_eval(noeud.value)
+    raise KeyError(f"{nom} introuvable dans app.py")
+
+# (compte, groupe, format du relevé, part des dépenses courantes)
+COMPTES = [
+    ("compte CHEQUES", "Personnel", "banque_postale", 0.60),
+    ("REVOLUT", "Personnel", "revolut", 0.25),
+    ("COMMUN", "Commun", "banque_populaire", 0.15),
+    ("LIVRET A", "Épargne", "banque_postale", 0.0),
+]
+COULEURS = ["#3498db", "#9b59b6", "#e67e22", "#2ecc71"]
+
+# Catégories qui ne sont pas des dépenses courantes (générées à part, à rythme mensuel)
+CATEGORIES_REVENUS = ["💰 Salaire", "🏥 Remboursements", "👫 compte Commun"]
+MONTANT_MOYEN = {
+    "🛒 Alimentation": 35, "🛍️ Shopping": 60, "👕 Habillement": 55, "📱 Abonnements": 13, "⛽ Carburant": 55,
+    "🔑 Loyer": 750, "⚖️ Impôts": 180, "🏠 Assurance Habitation": 25, "🚗 Auto": 220, "🔨 Bricolage": 70,
+    "🌐 Web/Énergie": 45, "🏧 Retraits": 40, "💸 Virements envoyé": 120, "🏦 Frais Bancaires": 8,
+}
+PREFIXES = ["CB ", "ACHAT CB ", "PRLV SEPA ", "CARTE X1234 "]
+
+FORMATS_CSV = {
+    # En-têtes proches des exports des banques, avec des colonnes utiles prises parmi les synonymes de CORRESPONDANCE
+    # (l'export Revolut en français : sa colonne Type, synonyme de nom, doublerait le libellé et n'est pas écrite)
+    "banque_postale": {"sep": ";", "decimal": ",", "encodage": "latin-1",
+                       "colonnes": ["Date", "Libellé", "Montant(EUROS)"]},
+    "revolut": {"sep": ",", "decimal": ".", "encodage": "utf-8",
+                "colonnes": ["Produit", "Date", "Description", "Montant", "Frais", "Devise", "État", "Solde"]},
+    "banque_populaire": {"sep": ";", "decimal": ",", "encodage": "latin-1",
+                         "colonnes": ["Date de comptabilisation", "Libelle simplifie", "Informations complementaires",
+                                      "Debit", "Credit", "Date operation", "Date de valeur"]},
+}
+
+
+def verifier_formats(correspondance):
+    """Chaque format doit être détecté par l'import (ligne d'en-tête) et fournir une date, un libellé et un montant (ou Débit/Crédit)."""
+    synonymes = {std: {s.lower() for s in syns} for std, syns in correspondance.items()}
+    for banque, fmt in FORMATS_CSV.items():
+        entete = fmt["sep"].join(fmt["colonnes"]).lower()
+        if "date" not in entete or not any(m in entete for m in ["montant", "debit", "credit", "valeur"]):
+            raise ValueError(f"Format {banque} : l'import ne reconnaîtrait pas la ligne d'en-tête")
+        reconnus = {std for col in fmt["colonnes"] for std, syns in synonymes.items() if col.lower() in syns}
+        if not {"date", "nom"} <= reconnus or not ({"montant"} <= reconnus or {"Debit", "Credit"} <= reconnus):
+            raise ValueError(f"Format {banque} : colonnes non reconnues par CORRESPONDANCE ({sorted(reconnus)})")
+
+
+def dates_aleatoires(rng, n, debut, fin):
+    jours = (pd.Timestamp(fin) - pd.Timestamp(debut)).days
+    return pd.Timestamp(debut) + pd.to_timedelta(rng.integers(0, jours + 1, n), unit="D")
+
+
+def depenses_courantes(rng, n, mots_cles, debut, fin):
+    """n dépenses par carte ou prélèvement : libellé bancaire autour d'un mot-clé de la catégorie."""
+    paires = [(cat, mot) for cat, mots in mots_cles.items() if cat not in CATEGORIES_REVENUS for mot in mots]
+    choix = rng.integers(0, len(paires), n)
+    categories = np.array([p[0] for p in paires], dtype=object)[choix]
+    mots = pd.Series(np.array([p[1] for p in paires], dtype=object)[choix])
+    dates = dates_aleatoires(rng, n, debut, fin)
+
+    moyennes = np.array([MONTANT_MOYEN.get(c, 30) for c in categories], dtype=float)
+    montants = -np.round(rng.lognormal(np.log(moyennes), 0.5), 2)
+    prefixes = pd.Series(np.array(PREFIXES, dtype=object)[rng.integers(0, len(PREFIXES), n)])
+    noms = prefixes + mots + " " + pd.Series(dates.strftime("%d/%m"))
+    return pd.DataFrame({"date": dates, "nom": noms.values, "montant": montants, "categorie": categories})
+
+
+def operations_mensuelles(debut, fin, salaire):
+    """Salaire, loyer et virements internes 🔄 (les deux jambes), une fois par mois."""
+    lignes = []
+    for jour in pd.date_range(debut, fin, freq="MS"):
+        lignes += [
+            (jour + pd.Timedelta(days=1), "VIR SEPA FRANCE TRAVAIL SALAIRE", salaire, "💰 Salaire", "compte CHEQUES"),
+            (jour + pd.Timedelta(days=4), "PRLV SEPA LOYER AGENCE IMMOBILIERE", -750.0, "🔑 Loyer", "COMMUN"),
+            (jour + pd.Timedelta(days=2), "VIREMENT VERS LIVRET A", -200.0, "🔄 Virement : CCP vers Livret A", "compte CHEQUES"),
+            (jour + pd.Timedelta(days=2), "VIREMENT RECU DE compte CHEQUES", 200.0, "🔄 Virement : CCP vers Livret A", "LIVRET A"),
+            (jour + pd.Timedelta(days=3), "VIREMENT VERS COMMUN", -600.0, "🔄 Transfert Interne", "compte CHEQUES"),
+            (jour + pd.Timedelta(days=3), "VERSEMENT COMMUN compte CHEQUES", 600.0, "🔄 Transfert Interne", "COMMUN"),
+        ]
+    df = pd.DataFrame(lignes, columns=["date", "nom", "montant", "categorie", "compte"])
+    return df[df["date"] <= pd.Timestamp(fin)]
+
+
+def transactions_utilisateur(rng, nb, annees, mots_cles, fin):
+    debut = pd.Timestamp(fin) - pd.DateOffset(years=annees) + pd.Timedelta(days=1)
+    mensuelles = operations_mensuelles(debut, fin, salaire=float(rng.integers(1800, 3500)))
+    courantes = depenses_courantes(rng, max(nb - len(mensuelles), 0), mots_cles, debut, fin)
+    comptes = [c for c, _, _, part in COMPTES if part > 0]
+    parts = np.array([part for _, _, _, part in COMPTES if part > 0])
+    courantes["compte"] = rng.choice(comptes, len(courantes), p=parts / parts.sum())
+
+    df = pd.concat([mensuelles, courantes], ignore_index=True).sort_values("date", kind="stable", ignore_index=True)
+    df["date"] = df["date"].dt.normalize()
+    df["mois"] = np.array(nomS_mois, dtype=object)[df["date"].dt.month.to_numpy() - 1]
+    df["année"] = df["date"].dt.year
+    return df.head(nb) if nb < len(df) else df
+
+
+def creer_utilisateur(user, mot_de_passe, moteur):
+    """Compte de connexion de user (rien si l'identifiant existe déjà)."""
+    with moteur.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO users (username, name, password, email)
+            SELECT :u, :n, :p, :e
+            WHERE NOT EXISTS (SELECT 1 FROM users WHERE username = :u)
+        """), {"u": user, "n": user.replace("_", " ").title(), "p": stauth.Hasher.hash(mot_de_passe), "e": f"{user}@example.com"})
+
+
+def configuration_utilisateur(user, rng):
+    return pd.DataFrame([
+        {"utilisateur": user, "compte": compte, "solde": float(rng.integers(0, 5000)), "groupe": groupe,
+         "objectif": 0.0, "couleur": couleur}
+        for (compte, groupe, _, _), couleur in zip(COMPTES, COULEURS)
+    ])
+
+
+def budgets_utilisateur(user):
+    categories = {"🛒 Alimentation": 400.0, "⛽ Carburant": 120.0, "🛍️ Shopping": 150.0, "📱 Abonnements": 40.0}
+    return pd.DataFrame([
+        {"utilisateur": user, "mois": mois, "compte": "compte CHEQUES", "type": "categorie", "nom": cat, "somme": somme}
+        for mois in nomS_mois for cat, somme in categories.items()
+    ])
+
+
+def previsions_utilisateur(user, fin):
+    lignes = []
+    for jour in pd.date_range(pd.Timestamp(fin) + pd.Timedelta(days=1), periods=12, freq="MS"):
+        lignes += [
+            (jour, "[PRÉVI] Salaire", 2500.0, "💰 Salaire", "compte CHEQUES"),
+            (jour, "[PRÉVI] Loyer", -750.0, "🔑 Loyer", "COMMUN"),
+            (jour, "[PRÉVI] Courses", -400.0, "🛒 Alimentation", "compte CHEQUES"),
+        ]
+    df = pd.DataFrame(lignes, columns=["date", "nom", "montant", "categorie", "compte"])
+    df["mois"] = np.array(nomS_mois, dtype=object)[df["date"].dt.month.to_numpy() - 1]
+    df["année"] = df["date"].dt.year
+    df["date"] = df["date"].dt.strftime("%Y-%m-%d")
+    df["utilisateur"] = user.lower()
+    return df
+
+
+def tricount_utilisateur(user, rng, nb_groupes=2, depenses_par_groupe=40):
+    membres = [user, "Alice", "Bob", "Chloé"]
+    lignes = []
+    for g in range(nb_groupes):
+        groupe = f"Voyage {g + 1}"
+        lignes.append({"date": "01/01/2024", "libellé": "Initialisation du groupe", "payé_par": "Système",
+                       "pour_qui": "Système:0", "montant": 0.0, "groupe": groupe, "utilisateur": user})
+        for _ in range(depenses_par_groupe):
+            montant = float(np.round(rng.lognormal(np.log(40), 0.6), 2))
+            part = round(montant / len(membres), 2)
+            parts = [part] * (len(membres) - 1) + [round(montant - part * (len(membres) - 1), 2)]
+            lignes.append({
+                "date": dates_aleatoires(rng, 1, "2024-01-01", "2024-12-31")[0].strftime("%d/%m/%Y"),
+                "libellé": str(rng.choice(["Restaurant", "Courses", "Essence", "Location", "Musée"])),
+                "payé_par": str(rng.choice(membres)),
+                "pour_qui": ",".join(f"{m}:{p}" for m, p in zip(membres, parts)),
+                "montant": montant, "groupe": groupe, "utilisateur": user,
+            })
+    return pd.DataFrame(lignes)
+
+
+def ecrire_csv(df, compte, banque, dossier, user):
+    """Relevé d'un compte au format de sa banque (montants signés, dates jj/mm/aaaa)."""
+    fmt = FORMATS_CSV[banque]
+    dates = df["date"].dt.strftime("%d/%m/%Y")
+    if banque == "banque_postale":
+        sortie = pd.DataFrame({"Date": dates, "Libellé": df["nom"], "Montant(EUROS)": df["montant"]})
+        entete = f"Numéro Compte   {fmt['sep']}0000000X020\nType {fmt['sep']}CCP\nCompte tenu en  {fmt['sep']}euros\n\n"
+    elif banque == "revolut":
+        sortie = pd.DataFrame({"Produit": "Courant", "Date": df["date"].dt.strftime("%Y-%m-%d 12:00:00"),
+                               "Description": df["nom"], "Montant": df["montant"], "Frais": 0.0, "Devise": "EUR",
+                               "État": "TERMINÉ", "Solde": df["montant"].cumsum().round(2)})
+        entete = ""
+    else:
+        sortie = pd.DataFrame({"Date de comptabilisation": dates, "Libelle simplifie": df["nom"],
+                               "Informations complementaires": "",
+                               "Debit": df["montant"].where(df["montant"] < 0), "Credit": df["montant"].where(df["montant"] >= 0),
+                               "Date operation": dates, "Date de valeur": dates})
+        entete = ""
+    chemin = os.path.join(dossier, f"{user}_{compte.replace(' ', '_')}_{banque}.csv")
+    with open(chemin, "w", encoding=fmt["encodage"], errors="replace", newline="") as f:
+        f.write(entete)
+        sortie[fmt["colonnes"]].to_csv(f, sep=fmt["sep"], decimal=fmt["decimal"], index=False)
+    return chemin
+
+
+def ecrire_table(df, table, moteur):
+    # INSERT multi-lignes : un aller-retour par lot ; l'id des transactions vient de la colonne identity
+    df.to_sql(table, moteur, if_exists="append", index=False, chunksize=5000, method="multi")
+
+
+def chronometrer(fonction, repetitions):
+    """(meilleur temps en s, résultat du dernier appel)."""
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        durees.append(time.perf_counter() - debut)
+    return min(durees), resultat
+
+
+def mesurer_base(moteur, utilisateurs, repetitions=3):
+    """
+    Temps des lectures que l'application fait le plus (historique complet, un mois, agrégats mensuels),
+    puis des calculs du tableau de bord (analyses.py) sur l'historique complet.
+    """
+    requetes = {
+        "historique complet": 'SELECT * FROM transactions WHERE utilisateur = :u',
+        "un mois": 'SELECT * FROM transactions WHERE utilisateur = :u AND "année" = :a AND mois = :m',
+        "agrégats mensuels": 'SELECT compte, "année", mois, categorie, SUM(montant), COUNT(*) FROM transactions '
+                             'WHERE utilisateur = :u GROUP BY compte, "année", mois, categorie',
+    }
+    params = {"u": utilisateurs[0], "a": date.today().year, "m": nomS_mois[date.today().month - 1]}
+    print("Lectures SQL :")
+    for nom, sql in requetes.items():
+        def lire():
+            with moteur.connect() as conn:
+                return pd.read_sql(text(sql), conn, params=params)
+        duree, df = chronometrer(lire, repetitions)
+        print(f"  {nom:<20} {duree * 1000:8.1f} ms  ({len(df)} lignes)")
+
+    with moteur.connect() as conn:
+        historique = pd.read_sql(text(requetes["historique complet"]), conn, params=params)
+    print(f"Calculs du tableau de bord ({len(historique)} transactions) :")
+    duree, agregats = chronometrer(lambda: agregats_mensuels_depuis_df(historique), repetitions)
+    print(f"  {'agrégats mensuels':<20} {duree * 1000:8.1f} ms  ({len(agregats)} lignes)")
+    # Comme l'onglet Analyses : une année, virements internes 🔄 exclus
+    annee = agregats[agregats["annee"] == params["a"]]
+    virements = [c for c in agregats["categorie"].unique() if c.startswith("🔄")]
+    duree, flux = chronometrer(lambda: flux_mensuels(annee, virements), repetitions)
+    print(f"  {'flux par mois':<20} {duree * 1000:8.1f} ms  ({len(flux)} mois)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère des utilisateurs et transactions synthétiques.")
+    parser.add_argument("--utilisateurs", type=int, default=1, help="nombre d'utilisateurs (bench_1, bench_2...)")
+    parser.add_argument("--transactions", type=int, default=1000, help="transactions par utilisateur (1k à 1M)")
+    parser.add_argument("--annees", type=int, default=3, help="profondeur de l'historique, en années")
+    parser.add_argument("--base", help="URL Postgres d'une base de test au schéma de l'application (aucune écriture si absent)")
+    parser.add_argument("--mot-de-passe", default="bench", help="mot de passe des utilisateurs créés")
+    parser.add_argument("--csv", help="dossier où écrire les relevés CSV (aucun si absent)")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--mesurer", action="store_true", help="chronométrer lectures et calculs du tableau de bord après l'écriture")
+    args = parser.parse_args()
+    if not args.base and not args.csv:
+        parser.error("rien à faire : indiquez --base, --csv ou les deux")
+    if args.mesurer and not args.base:
+        parser.error("--mesurer demande --base")
+
+    mots_cles = lire_constante("categorieS_MOTS_CLES")
+    verifier_formats(lire_constante("CORRESPONDANCE"))
+    rng = np.random.default_rng(args.graine)
+    moteur = create_engine(args.base) if args.base else None
+    if moteur is not None:
+        if moteur.dialect.name != "postgresql":
+            parser.error("--base doit être une URL Postgres : l'application ne tourne que sur Postgres")
+        manquantes = [t for t in TABLES if not inspect(moteur).has_table(t)]
+        if manquantes:
+            parser.error(f"tables absentes de la base : {', '.join(manquantes)} (schéma de l'application attendu)")
+    fin = date.today()
+    utilisateurs = [f"bench_{i + 1}" for i in range(args.utilisateurs)]
+    if args.csv:
+        os.makedirs(args.csv, exist_ok=True)
+
+    for user in utilisateurs:
+        debut = time.perf_counter()
+        df = transactions_utilisateur(rng, args.transactions, args.annees, mots_cles, fin)
+        genere = time.perf_counter()
+
+        if moteur is not None:
+            creer_utilisateur(user, args.mot_de_passe, moteur)
+            ecrire_table(df.assign(utilisateur=user), "transactions", moteur)
+            ecrire_table(configuration_utilisateur(user, rng), "configuration", moteur)
+            ecrire_table(budgets_utilisateur(user), "budgets", moteur)
+            ecrire_table(previsions_utilisateur(user, fin), "previsions", moteur)
+            ecrire_table(tricount_utilisateur(user, rng), "tricount", moteur)
+            ecrit = time.perf_counter()
+            print(f"{user} : {len(df)} transactions générées en {genere - debut:.1f} s, écrites en {ecrit - genere:.1f} s "
+                  f"({len(df) / max(ecrit - genere, 1e-9):.0f} lignes/s)")
+        else:
+            print(f"{user} : {len(df)} transactions générées en {genere - debut:.1f} s")
+
+        if args.csv:
+            for compte, _, banque, _ in COMPTES:
+                lignes = df[df["compte"] == compte]
+                if not lignes.empty:
+                    print(f"  {ecrire_csv(lignes, compte, banque, args.csv, user)} ({len(lignes)} lignes)")
+
+    if args.mesurer:
+        mesurer_base(moteur, utilisateurs)
+
+
+if __name__ == "__main__":
+    main()
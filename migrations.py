@@ -0,0 +1,262 @@
+"""
+Migrations du schéma Neon. Elles se lancent une fois par déploiement, hors de l'application :
+celle-ci ne fait plus de DDL au démarrage et refuse de s'ouvrir si une migration manque.
+
+    python migrations.py                           # URL lue dans .streamlit/secrets.toml
+    python migrations.py --base postgresql://...
+
+Chaque migration a un numéro ; celles déjà passées sont notées dans schema_migrations et ne sont pas rejouées.
+Une migration s'exécute dans sa propre transaction, avec son enregistrement.
+"""
+import argparse
+import os
+import tomllib
+
+from sqlalchemy import create_engine, text
+
+FICHIER_SECRETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+
+def migrer_agregats_mensuels(conn_sql):
+    """
+    Totaux mensuels par (utilisateur, compte, année, mois, catégorie, sens), tenus à jour par des triggers
+    sur transactions : le tableau de bord lit quelques centaines de lignes au lieu de tout l'historique.
+    La table est remplie depuis l'existant lors de sa création.
+    """
+    deja_creee = conn_sql.execute(text("SELECT to_regclass('agregats_mensuels') IS NOT NULL")).scalar()
+    conn_sql.execute(text("""
+        CREATE TABLE IF NOT EXISTS agregats_mensuels (
+            utilisateur TEXT NOT NULL,
+            compte TEXT NOT NULL,
+            annee INTEGER NOT NULL,
+            mois TEXT NOT NULL,
+            categorie TEXT NOT NULL,
+            sens TEXT NOT NULL,
+            total NUMERIC NOT NULL DEFAULT 0,
+            nb INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (utilisateur, compte, annee, mois, categorie, sens)
+        )
+    """))
+    # Une seule fonction pour les trois événements : on retire les anciennes lignes, on ajoute les nouvelles
+    conn_sql.execute(text("""
+        CREATE OR REPLACE FUNCTION maj_agregats_mensuels() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO agregats_mensuels AS a (utilisateur, compte, annee, mois, categorie, sens, total, nb)
+                SELECT utilisateur, coalesce(compte, ''), coalesce(année, extract(year FROM date)::int, 0),
+                       coalesce(mois, ''), coalesce(categorie, ''),
+                       CASE WHEN coalesce(montant, 0) >= 0 THEN 'credit' ELSE 'debit' END,
+                       -sum(coalesce(montant, 0)), -count(*)
+                FROM anciennes WHERE utilisateur IS NOT NULL GROUP BY 1, 2, 3, 4, 5, 6
+                ON CONFLICT (utilisateur, compte, annee, mois, categorie, sens)
+                DO UPDATE SET total = a.total + EXCLUDED.total, nb = a.nb + EXCLUDED.nb;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO agregats_mensuels AS a (utilisateur, compte, annee, mois, categorie, sens, total, nb)
+                SELECT utilisateur, coalesce(compte, ''), coalesce(année, extract(year FROM date)::int, 0),
+                       coalesce(mois, ''), coalesce(categorie, ''),
+                       CASE WHEN coalesce(montant, 0) >= 0 THEN 'credit' ELSE 'debit' END,
+                       sum(coalesce(montant, 0)), count(*)
+                FROM nouvelles WHERE utilisateur IS NOT NULL GROUP BY 1, 2, 3, 4, 5, 6
+                ON CONFLICT (utilisateur, compte, annee, mois, categorie, sens)
+                DO UPDATE SET total = a.total + EXCLUDED.total, nb = a.nb + EXCLUDED.nb;
+            END IF;
+            -- Seules les clés touchées par l'instruction peuvent tomber à zéro : on ne parcourt qu'elles
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM agregats_mensuels AS a
+                USING (
+                    SELECT DISTINCT utilisateur, coalesce(compte, '') AS compte,
+                           coalesce(année, extract(year FROM date)::int, 0) AS annee,
+                           coalesce(mois, '') AS mois, coalesce(categorie, '') AS categorie,
+                           CASE WHEN coalesce(montant, 0) >= 0 THEN 'credit' ELSE 'debit' END AS sens
+                    FROM anciennes WHERE utilisateur IS NOT NULL
+                ) AS cles
+                WHERE a.utilisateur = cles.utilisateur AND a.compte = cles.compte AND a.annee = cles.annee
+                  AND a.mois = cles.mois AND a.categorie = cles.categorie AND a.sens = cles.sens
+                  AND a.nb <= 0;
+            END IF;
+            RETURN NULL;
+        END $$
+    """))
+    conn_sql.execute(text("DROP TRIGGER IF EXISTS agregats_insert ON transactions"))
+    conn_sql.execute(text("DROP TRIGGER IF EXISTS agregats_update ON transactions"))
+    conn_sql.execute(text("DROP TRIGGER IF EXISTS agregats_delete ON transactions"))
+    conn_sql.execute(text("""
+        CREATE TRIGGER agregats_insert AFTER INSERT ON transactions
+        REFERENCING NEW TABLE AS nouvelles FOR EACH STATEMENT EXECUTE FUNCTION maj_agregats_mensuels()
+    """))
+    conn_sql.execute(text("""
+        CREATE TRIGGER agregats_update AFTER UPDATE ON transactions
+        REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles FOR EACH STATEMENT EXECUTE FUNCTION maj_agregats_mensuels()
+    """))
+    conn_sql.execute(text("""
+        CREATE TRIGGER agregats_delete AFTER DELETE ON transactions
+        REFERENCING OLD TABLE AS anciennes FOR EACH STATEMENT EXECUTE FUNCTION maj_agregats_mensuels()
+    """))
+    if not deja_creee:
+        # Remplissage initial : les écritures concurrentes attendent la fin (triggers déjà en place)
+        conn_sql.execute(text("LOCK TABLE transactions IN SHARE MODE"))
+        conn_sql.execute(text("""
+            INSERT INTO agregats_mensuels (utilisateur, compte, annee, mois, categorie, sens, total, nb)
+            SELECT utilisateur, coalesce(compte, ''), coalesce(année, extract(year FROM date)::int, 0),
+                   coalesce(mois, ''), coalesce(categorie, ''),
+                   CASE WHEN coalesce(montant, 0) >= 0 THEN 'credit' ELSE 'debit' END,
+                   sum(coalesce(montant, 0)), count(*)
+            FROM transactions WHERE utilisateur IS NOT NULL GROUP BY 1, 2, 3, 4, 5, 6
+        """))
+
+
+def migrer_regles(conn_sql):
+    """Table des règles de catégorisation propres à chaque utilisateur."""
+    conn_sql.execute(text("""
+        CREATE TABLE IF NOT EXISTS regles (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            utilisateur TEXT NOT NULL,
+            priorite INTEGER NOT NULL DEFAULT 100,
+            motif TEXT NOT NULL,
+            type_match TEXT NOT NULL DEFAULT 'contient',
+            categorie TEXT NOT NULL,
+            portee TEXT NOT NULL DEFAULT 'nom',
+            condition TEXT
+        )
+    """))
+    conn_sql.execute(text("CREATE INDEX IF NOT EXISTS regles_utilisateur_idx ON regles (utilisateur, priorite)"))
+
+
+# Mots-clés personnels qui faisaient partie des règles génériques avant la table regles (proches, employeurs,
+# bailleur, alias du compte commun), dans leur ordre de priorité d'alors : (motif, catégorie, portée, condition).
+REGLES_PERSONNELLES_HISTORIQUES = [
+    ("MARYLINE FONTA", "🤝 Virements Reçus", "nom", "credit"),
+    ("AURORE FONTA", "🤝 Virements Reçus", "nom", "credit"),
+    ("LEBARBIER THEO", "🤝 Virements Reçus", "nom", "credit"),
+    ("LEBARBIER DIDIER", "🤝 Virements Reçus", "nom", "credit"),
+    ("SARL LES GOURMANDISES", "💰 Salaire", "texte", None),
+    ("JEFF DE BRUGES", "💰 Salaire", "texte", None),
+    ("MELTED", "💰 Salaire", "nom", None),
+    ("JEFF DB", "💰 Salaire", "nom", None),
+    ("FAUSTINE BOJUC", "🏥 Remboursements", "nom", None),
+    ("A FONTA AUDE OU LEBARBIER THEO", "👫 compte Commun", "nom", None),
+    ("AUDE FONTATHEO LEBARBIE", "👫 compte Commun", "nom", None),
+    ("JASON MOLINER", "🔑 Loyer", "nom", None),
+]
+
+
+def migrer_regles_personnelles(conn_sql):
+    """
+    Reprend ces mots-clés comme règles personnelles des utilisateurs dont l'historique les contient
+    (sans eux, leur catégorisation régresserait). Une règle déjà présente (même motif et catégorie) n'est pas doublée.
+    """
+    motifs = [motif for motif, _, _, _ in REGLES_PERSONNELLES_HISTORIQUES]
+    proprietaires = conn_sql.execute(
+        text("SELECT DISTINCT utilisateur FROM transactions WHERE utilisateur IS NOT NULL AND upper(nom) LIKE ANY(:motifs)"),
+        {"motifs": [f"%{motif}%" for motif in motifs]}
+    ).scalars().all()
+    for user in proprietaires:
+        conn_sql.execute(text("""
+            INSERT INTO regles (utilisateur, priorite, motif, type_match, categorie, portee, condition)
+            SELECT :u, s.priorite, s.motif, 'contient', s.categorie, s.portee, NULLIF(s.condition, '')
+            FROM unnest(
+                CAST(:priorites AS integer[]), CAST(:motifs AS text[]), CAST(:categories AS text[]),
+                CAST(:portees AS text[]), CAST(:conditions AS text[])
+            ) AS s(priorite, motif, categorie, portee, condition)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM regles r WHERE r.utilisateur = :u AND r.motif = s.motif AND r.categorie = s.categorie
+            )
+        """), {
+            "u": user,
+            "priorites": [10 * (i + 1) for i in range(len(REGLES_PERSONNELLES_HISTORIQUES))],
+            "motifs": motifs,
+            "categories": [categorie for _, categorie, _, _ in REGLES_PERSONNELLES_HISTORIQUES],
+            "portees": [portee for _, _, portee, _ in REGLES_PERSONNELLES_HISTORIQUES],
+            "conditions": [condition or "" for _, _, _, condition in REGLES_PERSONNELLES_HISTORIQUES],
+        })
+        print(f"   règles personnelles reprises pour {user}")
+
+
+def migrer_transactions_id(conn_sql):
+    """
+    Donne à chaque transaction un identifiant stable (id, colonne identity qui numérote aussi les insertions),
+    et retire l'unicité sur (date, nom, montant, utilisateur) qui empêchait deux achats identiques le même jour.
+    Irréversible : deux lignes identiques peuvent ensuite coexister.
+    """
+    conn_sql.execute(text("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS id BIGINT GENERATED BY DEFAULT AS IDENTITY"))
+    conn_sql.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS transactions_id_idx ON transactions (id)"))
+    # La clé naturelle reste indexée (import, recherche de doublons), mais n'est plus unique
+    conn_sql.execute(text("CREATE INDEX IF NOT EXISTS transactions_cle_naturelle_idx ON transactions (utilisateur, date, nom, montant)"))
+    # Index de lectures filtrées qui ne sont jamais faites (Gérer filtre en mémoire) : retirés là où
+    # l'ancien code de démarrage les avait créés, ils ne coûtaient qu'à l'écriture
+    conn_sql.execute(text("DROP INDEX IF EXISTS transactions_periode_idx"))
+    conn_sql.execute(text("DROP INDEX IF EXISTS transactions_compte_date_idx"))
+    conn_sql.execute(text("""
+        DO $$
+        DECLARE c record;
+        BEGIN
+            FOR c IN
+                SELECT con.conname FROM pg_constraint con
+                WHERE con.conrelid = 'transactions'::regclass AND con.contype IN ('u', 'p')
+                AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text) FROM pg_attribute a
+                     WHERE a.attrelid = con.conrelid AND a.attnum = ANY(con.conkey))
+                    = ARRAY['date', 'montant', 'nom', 'utilisateur']
+            LOOP
+                EXECUTE 'ALTER TABLE transactions DROP CONSTRAINT ' || quote_ident(c.conname);
+            END LOOP;
+            FOR c IN
+                SELECT ic.relname FROM pg_index i JOIN pg_class ic ON ic.oid = i.indexrelid
+                WHERE i.indrelid = 'transactions'::regclass AND i.indisunique
+                AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text) FROM pg_attribute a
+                     WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey))
+                    = ARRAY['date', 'montant', 'nom', 'utilisateur']
+            LOOP
+                EXECUTE 'DROP INDEX ' || quote_ident(c.relname);
+            END LOOP;
+        END $$
+    """))
+
+
+# (numéro, nom, fonction) dans l'ordre d'application ; un numéro ne change plus une fois déployé
+MIGRATIONS = [
+    (1, "agregats_mensuels", migrer_agregats_mensuels),
+    (2, "regles", migrer_regles),
+    (3, "regles_personnelles", migrer_regles_personnelles),
+    (4, "transactions_id", migrer_transactions_id),
+]
+
+
+def migrations_manquantes(conn_sql):
+    """Numéros des migrations pas encore passées sur cette base."""
+    if not conn_sql.execute(text("SELECT to_regclass('schema_migrations') IS NOT NULL")).scalar():
+        return [numero for numero, _, _ in MIGRATIONS]
+    passees = set(conn_sql.execute(text("SELECT version FROM schema_migrations")).scalars())
+    return [numero for numero, _, _ in MIGRATIONS if numero not in passees]
+
+
+def migrer(moteur):
+    with moteur.begin() as conn_sql:
+        conn_sql.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                nom TEXT NOT NULL,
+                appliquee_le TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+    for numero, nom, fonction in MIGRATIONS:
+        with moteur.begin() as conn_sql:
+            # Deux déploiements simultanés ne passent pas la même migration deux fois
+            conn_sql.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))"))
+            if conn_sql.execute(text("SELECT 1 FROM schema_migrations WHERE version = :v"), {"v": numero}).first():
+                continue
+            fonction(conn_sql)
+            conn_sql.execute(text("INSERT INTO schema_migrations (version, nom) VALUES (:v, :n)"), {"v": numero, "n": nom})
+            print(f"✅ Migration {numero} ({nom}) appliquée")
+
+
+def url_par_defaut():
+    with open(FICHIER_SECRETS, "rb") as f:
+        return tomllib.load(f)["connections"]["postgresql"]["url"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Applique les migrations du schéma Neon.")
+    parser.add_argument("--base", help="URL SQLAlchemy (par défaut : celle de .streamlit/secrets.toml)")
+    args = parser.parse_args()
+    migrer(create_engine(args.base or url_par_defaut()))
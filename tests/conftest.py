@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les modules testés (analyses.py...) sont à la racine du dépôt, à côté de app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+"""Les réductions vectorisées d'analyses.py donnent les mêmes chiffres que les anciens groupby().agg(lambda ...)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyses import (
+    nomS_mois, rang_mois, trier_mois, noms_mois_depuis_numeros,
+    revenus_depenses_par_mois, agregats_mensuels_depuis_df, flux_mensuels,
+)
+
+
+@pytest.fixture
+def transactions():
+    rng = np.random.default_rng(0)
+    n = 400
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 366, n), unit="D")
+    # Juin n'a aucune ligne : un mois absent doit rester absent (ou à zéro), pas décaler les autres
+    dates = dates[dates.month != 6]
+    return pd.DataFrame({
+        "date": dates,
+        "nom": "OPERATION",
+        "montant": np.round(rng.normal(0, 80, len(dates)), 2),
+        "compte": rng.choice(["CCP", "LIVRET A"], len(dates)),
+        "categorie": rng.choice(["🛒 Alimentation", "💰 Salaire", "🔄 Transfert Interne"], len(dates)),
+        "mois": noms_mois_depuis_numeros(pd.Series(dates.month)).values,
+        "année": dates.year,
+    })
+
+
+def ancien_revenus_depenses(df):
+    """Forme d'avant : un groupby par mois et deux lambdas par groupe."""
+    return df.groupby("mois")["montant"].agg(
+        Revenus=lambda x: x[x > 0].sum(),
+        Dépenses=lambda x: abs(x[x < 0].sum()),
+    )
+
+
+def test_revenus_depenses_identiques_aux_lambdas(transactions):
+    nouveau = revenus_depenses_par_mois(transactions).set_index("mois")
+    ancien = ancien_revenus_depenses(transactions)
+    pd.testing.assert_frame_equal(nouveau.loc[ancien.index], ancien, check_names=False)
+    # Les mois sans opération sont présents, à zéro, et l'ordre est celui du calendrier
+    assert nouveau.index.tolist() == nomS_mois
+    assert (nouveau.loc["Juin"] == 0).all()
+
+
+def test_revenus_depenses_colonnes_renommees(transactions):
+    assert revenus_depenses_par_mois(transactions, "Rev", "Dep").columns.tolist() == ["mois", "Rev", "Dep"]
+
+
+def test_flux_mensuels_identiques_aux_lambdas(transactions):
+    exclues = ["🔄 Transfert Interne"]
+    nouveau = flux_mensuels(agregats_mensuels_depuis_df(transactions), exclues).set_index("mois")
+    ancien = ancien_revenus_depenses(transactions[~transactions["categorie"].isin(exclues)])
+    pd.testing.assert_frame_equal(nouveau.loc[ancien.index], ancien, check_names=False)
+    assert nouveau.index.tolist() == [m for m in nomS_mois if m != "Juin"]
+
+
+def test_agregats_conservent_totaux_et_effectifs(transactions):
+    agregats = agregats_mensuels_depuis_df(transactions)
+    assert agregats["nb"].sum() == len(transactions)
+    assert agregats["total"].sum() == pytest.approx(transactions["montant"].sum())
+    assert set(agregats["sens"]) <= {"credit", "debit"}
+
+
+def test_entrees_vides():
+    vide = pd.DataFrame(columns=["date", "nom", "montant", "compte", "categorie", "mois", "année"])
+    par_mois = revenus_depenses_par_mois(vide)
+    assert par_mois["mois"].tolist() == nomS_mois
+    assert (par_mois[["Revenus", "Dépenses"]] == 0).all().all()
+    assert agregats_mensuels_depuis_df(vide).empty
+    assert flux_mensuels(agregats_mensuels_depuis_df(vide)).columns.tolist() == ["mois", "Revenus", "Dépenses"]
+    assert flux_mensuels(agregats_mensuels_depuis_df(vide)).empty
+
+
+def test_ordre_des_mois():
+    assert rang_mois(["Mars", "Janvier", "Inconnu", "Décembre"]).tolist() == [2, 0, -1, 11]
+    assert trier_mois(["Mars", "Janvier", "Mars", None, "Décembre"]) == ["Janvier", "Mars", "Décembre"]
+    assert noms_mois_depuis_numeros(pd.Series([1, 12, 13, None])).tolist()[:2] == ["Janvier", "Décembre"]
+    assert noms_mois_depuis_numeros(pd.Series([1, 12, 13, None])).isna().tolist() == [False, False, True, True]